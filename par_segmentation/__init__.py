@@ -1,53 +1,104 @@
-from .funcs import (
-    asi,
-    bounded_mean_1d,
-    bounded_mean_2d,
-    direcslist,
-    dosage,
-    in_notebook,
-    interp_1d_array,
-    interp_2d_array,
-    load_image,
-    make_mask,
-    norm_roi,
-    organise_by_nd,
-    readnd,
-    rolling_ave_1d,
-    rolling_ave_2d,
-    rotate_roi,
-    rotated_embryo,
-    save_img,
-    save_img_jpeg,
-    straighten,
-    gaus,
-    error_func,
-)
-from .legacy import bg_subtraction, polycrop, calc_vol, calc_sa
-from .roi import interp_roi, offset_coordinates, spline_roi
+import importlib
+
+"""
+Public functions and classes are loaded lazily: submodules (and their dependencies) are only imported when one of
+their names is first accessed, so that importing the package is fast
+
+"""
+
+# Public names defined in each submodule
+_SUBMODULES = {
+    ".cache": ["ResultCache"],
+    ".funcs": [
+        "asi",
+        "asi_batch",
+        "bounded_mean_1d",
+        "bounded_mean_1d_batch",
+        "bounded_mean_2d",
+        "bounded_mean_2d_batch",
+        "direcslist",
+        "dosage",
+        "dosage_batch",
+        "in_notebook",
+        "interp_1d_array",
+        "interp_2d_array",
+        "interp_matrix",
+        "load_image",
+        "make_mask",
+        "norm_roi",
+        "organise_by_nd",
+        "readnd",
+        "rolling_ave_1d",
+        "rolling_ave_2d",
+        "rotate_roi",
+        "rotated_embryo",
+        "save_img",
+        "save_img_jpeg",
+        "straighten",
+        "gaus",
+        "error_func",
+        "TiffStack",
+    ],
+    ".legacy": ["bg_subtraction", "polycrop", "calc_vol", "calc_sa"],
+    ".qc": ["render_qc"],
+    ".ragged": ["RaggedArray"],
+    ".roi": [
+        "interp_roi",
+        "interp_roi_batch",
+        "offset_coordinates",
+        "offset_coordinates_batch",
+        "spline_roi",
+        "SplineRoi",
+    ],
+}
+_LAZY = {name: module for module, names in _SUBMODULES.items() for name in names}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(_LAZY))
+
 
 __all__ = [
-    "load_image",
-    "save_img",
-    "save_img_jpeg",
-    "straighten",
-    "rotated_embryo",
-    "rotate_roi",
-    "norm_roi",
-    "interp_1d_array",
-    "interp_2d_array",
-    "rolling_ave_1d",
-    "rolling_ave_2d",
+    "TiffStack",
+    "asi",
+    "asi_batch",
     "bounded_mean_1d",
+    "bounded_mean_1d_batch",
     "bounded_mean_2d",
-    "asi",
+    "bounded_mean_2d_batch",
+    "direcslist",
     "dosage",
+    "dosage_batch",
+    "error_func",
+    "gaus",
+    "in_notebook",
+    "interp_1d_array",
+    "interp_2d_array",
+    "interp_matrix",
+    "load_image",
     "make_mask",
-    "readnd",
+    "norm_roi",
     "organise_by_nd",
-    "direcslist",
-    "in_notebook",
-    "gaus",
-    "error_func",
+    "readnd",
+    "rolling_ave_1d",
+    "rolling_ave_2d",
+    "rotate_roi",
+    "rotated_embryo",
+    "save_img",
+    "save_img_jpeg",
+    "straighten",
 ]
-__all__ += ["polycrop", "bg_subtraction", "calc_vol", "calc_sa"]
-__all__ += ["spline_roi", "interp_roi", "offset_coordinates"]
+__all__ += ["bg_subtraction", "calc_sa", "calc_vol", "polycrop"]
+__all__ += ["interp_roi", "offset_coordinates", "spline_roi"]
+__all__ += ["SplineRoi", "interp_roi_batch", "offset_coordinates_batch"]
+__all__ += ["RaggedArray"]
+__all__ += ["render_qc"]
+__all__ += ["ResultCache"]
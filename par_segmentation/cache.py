@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+from importlib import metadata
+
+import numpy as np
+
+"""
+Content-addressed on-disk cache of per-embryo results, so that embryos re-run with unchanged images, ROIs and model
+parameters don't have to be refitted
+
+"""
+
+# Per-embryo results stored in the cache, and the axis along which each varies in length (as in RaggedArray), or None
+# for results with the same shape for every embryo. Results that a model doesn't produce (or that are None) are skipped
+RESULT_FIELDS = {
+    "roi": 0,
+    "mems": 0,
+    "cyts": 0,
+    "offsets": 0,
+    "mems_full": 0,
+    "cyts_full": 0,
+    "offsets_full": 0,
+    "losses": None,
+    "straight_images": -1,
+    "straight_images_sim": -1,
+    "straight_images_resids": -1,
+}
+
+# Bump if the results stored for a given key change
+_CACHE_VERSION = 2
+
+
+def _package_version() -> str:
+    try:
+        return metadata.version("par_segmentation")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class ResultCache:
+    """
+    Directory of cached results, one compressed npz file per embryo, named by a hash of the image, input ROI and model
+    parameters. The total size of the cache is bounded: when it exceeds max_size, the least recently used entries are
+    deleted (using file modification times, which are updated whenever an entry is read). The total size is tracked as
+    entries are added, so the directory is only scanned once, and again when entries need to be evicted
+
+    Args:
+        path: directory of the cache (will be created if it doesn't exist)
+        max_size: maximum total size of the cache (bytes)
+
+    """
+
+    def __init__(self, path: str, max_size: float = 1e9):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+        # Running total size of the cache (computed when first needed)
+        self._total = None
+
+    @staticmethod
+    def key(img: np.ndarray, roi: np.ndarray, params: dict) -> str:
+        """
+        Hash of an image, input ROI and model parameters. The cache format and package versions are included, so
+        entries are invalidated when the fitting code changes
+
+        Args:
+            img: image (a 2D array)
+            roi: input ROI coordinates
+            params: model parameters (must be json serialisable, apart from numpy scalars and arrays)
+
+        Returns:
+            hex digest
+
+        """
+        h = hashlib.sha256()
+        for array in (img, roi):
+            array = np.ascontiguousarray(array)
+            h.update(f"{array.dtype.str}{array.shape}".encode())
+            h.update(array.data)
+        h.update(
+            json.dumps(
+                {
+                    "version": _CACHE_VERSION,
+                    "package_version": _package_version(),
+                    "params": params,
+                },
+                sort_keys=True,
+                default=lambda x: np.asarray(x).tolist(),
+            ).encode()
+        )
+        return h.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """
+        Loads cached results
+
+        Args:
+            key: key of the entry (see key())
+
+        Returns:
+            dictionary of results, or None if the key isn't in the cache
+
+        """
+        path = self._file(key)
+        try:
+            with np.load(path) as f:
+                results = {field: f[field] for field in f.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, corrupt, or evicted by another process since it was loaded
+            return None
+        return results
+
+    def put(self, key: str, results: dict):
+        """
+        Saves results to the cache, evicting the least recently used entries if the cache is full
+
+        Args:
+            key: key of the entry (see key())
+            results: dictionary of numpy arrays
+
+        """
+        path = self._file(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **results)
+        if self._total is None:
+            self._total = self.size
+        try:
+            self._total -= os.stat(path).st_size
+        except FileNotFoundError:
+            pass
+        self._total += os.stat(tmp).st_size
+        os.replace(tmp, path)
+        if self._total > self.max_size:
+            self._evict()
+
+    def clear(self):
+        """
+        Deletes all entries
+        """
+        for entry in self._entries():
+            os.remove(entry.path)
+        self._total = 0
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._file(key))
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the cache (bytes)
+        """
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".npz")
+
+    def _entries(self) -> list:
+        return [e for e in os.scandir(self.path) if e.name.endswith(".npz")]
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the cache fits within max_size (rescanning the directory, so
+        entries added or removed by other processes are accounted for)
+        """
+        entries = []
+        for e in self._entries():
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, e.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+
+def embryo_results(iq, i: int) -> dict:
+    """
+    Collects the results for embryo i from a model that has been run
+
+    Args:
+        iq: model (e.g. ImageQuantGradientDescent)
+        i: index of the embryo
+
+    Returns:
+        dictionary of numpy arrays
+
+    """
+    results = {}
+    for field in RESULT_FIELDS:
+        value = getattr(iq, field, None)
+        if value is not None:
+            results[field] = np.asarray(value[i])
+    return results
+
+
+def set_results(iq, results: list):
+    """
+    Sets the results of a model from per-embryo results (as returned by embryo_results)
+
+    Args:
+        iq: model
+        results: list of dictionaries of results (one per embryo)
+
+    """
+    from .ragged import RaggedArray
+
+    for field, axis in RESULT_FIELDS.items():
+        if all(field in r for r in results):
+            values = [r[field] for r in results]
+            if axis is None:
+                setattr(iq, field, np.array(values))
+            else:
+                setattr(iq, field, RaggedArray.from_list(values, axis=axis))
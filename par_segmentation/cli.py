@@ -0,0 +1,323 @@
+import argparse
+import ast
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+"""
+Command-line batch runner: quantifies every embryo folder in an experiment tree
+
+Embryo folders are found by searching the experiment directories for folders containing an image and an ROI file (e.g.
+folders created with organise_by_nd). Embryos are grouped by image size and ROI length, and each group is quantified
+in batches, with batches shared across a pool of worker processes. Results for each embryo are saved to a subfolder
+of the embryo folder, together with the settings used, so that interrupted runs can be resumed (embryos already
+quantified with the same settings are skipped). Results for all embryos are then compiled into a single table
+
+Example:
+    par-segmentation path/to/experiment --method GD --param nfits=100 --n-jobs 4 --output results.csv
+
+"""
+
+
+def find_embryos(
+    paths: list | str,
+    image: str = "af_corrected.tif",
+    roi: str = "ROI.txt",
+    exclude: tuple | None = ("!",),
+) -> list:
+    """
+    Finds embryo folders (folders containing an image file and an ROI file) within one or more directories
+
+    Args:
+        paths: directory or list of directories to search (recursively)
+        image: file name (or glob pattern) of the image in each embryo folder
+        roi: file name (or glob pattern) of the ROI in each embryo folder
+        exclude: exclude folders whose path contains any strings within this tuple (as in direcslist)
+
+    Returns:
+        sorted list of (folder, image path, ROI path) for each embryo
+
+    """
+    paths = [paths] if isinstance(paths, str) else paths
+    embryos = []
+    for path in paths:
+        for folder, _, _ in os.walk(path):
+            if exclude is not None and any(ex in folder for ex in exclude):
+                continue
+            images = sorted(glob.glob(os.path.join(glob.escape(folder), image)))
+            rois = sorted(glob.glob(os.path.join(glob.escape(folder), roi)))
+            if len(images) > 0 and len(rois) > 0:
+                embryos.append((os.path.normpath(folder), images[0], rois[0]))
+    return sorted(set(embryos))
+
+
+def group_embryos(embryos: list, batch_size: int = 16) -> list:
+    """
+    Groups embryos into batches with the same image size and ROI length. Image sizes are read from file headers
+
+    Args:
+        embryos: list of (folder, image path, ROI path) as returned by find_embryos
+        batch_size: maximum number of embryos in a batch
+
+    Returns:
+        list of batches (lists of embryos)
+
+    """
+    import tifffile
+
+    groups = {}
+    for embryo in embryos:
+        with tifffile.TiffFile(embryo[1]) as tif:
+            shape = tuple(tif.series[0].shape)
+        length = len(np.loadtxt(embryo[2]))
+        groups.setdefault((shape, length), []).append(embryo)
+    return [
+        group[i : i + batch_size]
+        for group in groups.values()
+        for i in range(0, len(group), batch_size)
+    ]
+
+
+def run_experiment(
+    paths: list | str,
+    output: str | None = None,
+    method: str = "GD",
+    params: dict | None = None,
+    image: str = "af_corrected.tif",
+    roi: str = "ROI.txt",
+    results_dir: str = "par_segmentation",
+    exclude: tuple | None = ("!",),
+    batch_size: int = 16,
+    n_jobs: int = 1,
+    overwrite: bool = False,
+    verbose: bool = True,
+):
+    """
+    Quantifies all embryos in one or more experiment directories, and compiles results into a single table
+
+    Args:
+        paths: experiment directory or list of directories
+        output: optional, path to save compiled results to. Saved as a Parquet file if the path ends in '.parquet', an
+            Arrow IPC/Feather file if it ends in '.arrow' or '.feather', otherwise as csv
+        method: 'GD', 'DE' or 'flexi'
+        params: optional, keyword arguments for the model (see ImageQuant)
+        image: file name (or glob pattern) of the image in each embryo folder
+        roi: file name (or glob pattern) of the ROI in each embryo folder
+        results_dir: name of the folder (within each embryo folder) to save results to
+        exclude: exclude folders whose path contains any strings within this tuple
+        batch_size: maximum number of embryos to quantify together
+        n_jobs: number of worker processes
+        overwrite: if True, embryos are quantified even if they have already been quantified with the same settings
+        verbose: if True, prints progress
+
+    Returns:
+        pandas dataframe of results for all embryos
+
+    """
+    if method not in ("GD", "DE", "flexi"):
+        raise ValueError('method must be "GD", "DE" or "flexi"')
+
+    # Settings as they are saved to (and read back from) json
+    settings = json.loads(json.dumps({"method": method, "params": params or {}}))
+
+    # Find embryos, skipping those already completed
+    embryos = find_embryos(paths, image, roi, exclude)
+    todo = [
+        e
+        for e in embryos
+        if overwrite or _load_settings(os.path.join(e[0], results_dir)) != settings
+    ]
+    if verbose:
+        print(
+            f"Found {len(embryos)} embryos ({len(embryos) - len(todo)} already completed)"
+        )
+
+    # Quantify remaining embryos
+    batches = group_embryos(todo, batch_size)
+    if verbose and len(batches) > 0:
+        print(f"Quantifying {len(todo)} embryos in {len(batches)} batches")
+    if n_jobs == 1 or len(batches) <= 1:
+        for batch in batches:
+            _run_batch(batch, settings, results_dir)
+    else:
+        from joblib import Parallel, delayed
+
+        Parallel(n_jobs=n_jobs)(
+            delayed(_run_batch)(batch, settings, results_dir) for batch in batches
+        )
+
+    # Compile results
+    res = compile_results([e[0] for e in embryos], results_dir)
+    if output is not None:
+        if output.endswith(".parquet"):
+            res.to_parquet(output, index=False)
+        elif output.endswith((".arrow", ".feather")):
+            res.reset_index(drop=True).to_feather(output)
+        else:
+            res.to_csv(output, index=False)
+        if verbose:
+            print(f"Results saved to {output}")
+    return res
+
+
+def compile_results(folders: list, results_dir: str = "par_segmentation"):
+    """
+    Compiles saved results for a list of embryo folders into a single table, with the same columns as
+    ImageQuant.compile_res() plus the path of each embryo folder
+
+    Args:
+        folders: embryo folders (embryos without results are skipped)
+        results_dir: name of the folder (within each embryo folder) that results were saved to
+
+    Returns:
+        pandas dataframe
+
+    """
+    import pandas as pd
+
+    ids, paths, mems, cyts = [], [], [], []
+    for i, folder in enumerate(folders):
+        path = os.path.join(folder, results_dir)
+        if not os.path.exists(os.path.join(path, "settings.json")):
+            continue
+        ids.append(i)
+        paths.append(folder)
+        mems.append(np.atleast_1d(np.loadtxt(path + "/membrane_concentrations.txt")))
+        cyts.append(np.atleast_1d(np.loadtxt(path + "/cytoplasmic_concentrations.txt")))
+
+    lengths = np.array([len(m) for m in mems], dtype=int)
+    starts = np.cumsum(lengths) - lengths
+    columns = {
+        "EmbryoID": np.repeat(np.array(ids, dtype=int), lengths),
+        "Position": np.arange(lengths.sum()) - np.repeat(starts, lengths),
+        "Membrane signal": np.concatenate(mems) if mems else np.zeros(0),
+        "Cytoplasmic signal": np.concatenate(cyts) if cyts else np.zeros(0),
+        "Path": np.repeat(np.array(paths, dtype=object), lengths),
+    }
+    return pd.DataFrame(columns, index=columns["Position"])
+
+
+def main(argv: list | None = None) -> int:
+    """
+    Entry point for the par-segmentation command
+    """
+    parser = argparse.ArgumentParser(
+        prog="par-segmentation",
+        description="Quantify all embryos in one or more experiment directories",
+    )
+    parser.add_argument("paths", nargs="+", help="experiment directories")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="results.csv",
+        help="file to save compiled results to (.csv, .parquet, .arrow or .feather)",
+    )
+    parser.add_argument(
+        "-m", "--method", default="GD", choices=["GD", "DE", "flexi"], help="model"
+    )
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="model parameter (can be given multiple times), e.g. nfits=100",
+    )
+    parser.add_argument(
+        "--image",
+        default="af_corrected.tif",
+        help="file name (or glob pattern) of the image in each embryo folder",
+    )
+    parser.add_argument(
+        "--roi",
+        default="ROI.txt",
+        help="file name (or glob pattern) of the ROI in each embryo folder",
+    )
+    parser.add_argument(
+        "--results-dir",
+        default="par_segmentation",
+        help="folder (within each embryo folder) to save results to",
+    )
+    parser.add_argument(
+        "--exclude",
+        nargs="*",
+        default=["!"],
+        help="exclude folders whose path contains any of these strings",
+    )
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("-j", "--n-jobs", type=int, default=1)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="quantify all embryos, including those already completed",
+    )
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    run_experiment(
+        args.paths,
+        output=args.output,
+        method=args.method,
+        params=dict(_parse_param(p) for p in args.param),
+        image=args.image,
+        roi=args.roi,
+        results_dir=args.results_dir,
+        exclude=tuple(args.exclude),
+        batch_size=args.batch_size,
+        n_jobs=args.n_jobs,
+        overwrite=args.overwrite,
+        verbose=not args.quiet,
+    )
+    return 0
+
+
+def _parse_param(param: str) -> tuple:
+    """
+    Parses a KEY=VALUE model parameter (values are read as python literals where possible, otherwise as strings)
+    """
+    if "=" not in param:
+        raise ValueError(f"Parameters must be given as KEY=VALUE, not {param!r}")
+    key, value = param.split("=", 1)
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return key.strip(), value
+
+
+def _load_settings(path: str) -> dict | None:
+    try:
+        with open(os.path.join(path, "settings.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _run_batch(batch: list, settings: dict, results_dir: str):
+    """
+    Quantifies a batch of embryos and saves results to each embryo folder. The settings file is written last, marking
+    the embryo as completed
+    """
+    from .funcs import load_image
+    from .quantifier import ImageQuant
+
+    imgs = [load_image(e[1]) for e in batch]
+    rois = [np.loadtxt(e[2]) for e in batch]
+    iq = ImageQuant(img=imgs, roi=rois, method=settings["method"], **settings["params"])
+    if settings["method"] == "flexi":
+        iq.quantify()
+    else:
+        iq.run()
+
+    for i, (folder, _, _) in enumerate(batch):
+        path = os.path.join(folder, results_dir)
+        iq.save(path, i)
+        with open(path + "/settings.json", "w") as f:
+            json.dump(settings, f)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,90 @@
 import glob
 import os
+from functools import lru_cache
 
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.interpolate import CubicSpline
-from scipy.ndimage.interpolation import map_coordinates
-from skimage import io
-from scipy.special import erf
 
+from .ragged import RaggedArray
 from .roi import offset_coordinates
 
+# Heavy dependencies (OpenCV, scikit-image, SciPy, matplotlib, pandas, tifffile) are imported inside the functions
+# that use them, so that importing this module is fast
+
 ########## IMAGE HANDLING ###########
 
 
-def load_image(filename: str) -> np.ndarray:
+def load_image(filename: str, lazy: bool = False) -> np.ndarray:
     """
     Given the filename of a TIFF, creates numpy array with pixel intensities
 
     Args:
         filename: full path to the file to import (including extension)
+        lazy: if True, the image is not read into memory. Uncompressed TIFF and OME-TIFF files are memory-mapped,
+            other TIFF files are returned as a TiffStack that reads frames from disk when they are indexed. In both
+            cases pixel values keep the dtype stored in the file (frames are cast to float during preprocessing)
 
     Returns:
-        A numpy array of the image
+        A numpy array of the image (or a frame-indexable array-like if lazy is True)
 
     """
 
+    if lazy:
+        import tifffile
+
+        try:
+            return tifffile.memmap(filename, mode="r")
+        except ValueError:
+            # Compressed or non-contiguous data can't be memory-mapped
+            return TiffStack(filename)
+    from skimage import io
+
     return io.imread(filename).astype(float)
 
 
+class TiffStack:
+    """
+    Read-only, frame-indexable view of a TIFF stack. Frames are read from disk (and decompressed) when they are
+    indexed, so memory use is independent of the length of the stack. Single-frame (2D) files are treated as a stack of
+    one frame, with shape (1, height, width)
+
+    Args:
+        filename: full path to the TIFF file (including extension)
+
+    """
+
+    def __init__(self, filename: str):
+        import tifffile
+
+        self._tif = tifffile.TiffFile(filename)
+        series = self._tif.series[0]
+        self._pages = series.pages
+        self.shape = tuple(series.shape)
+        if len(self.shape) == 2:
+            self.shape = (1,) + self.shape
+        self.dtype = series.dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, i: int | slice) -> np.ndarray | list:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._pages[range(len(self))[i]].asarray()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return np.asarray(self._tif.series[0].asarray(), dtype=dtype).reshape(
+            self.shape
+        )
+
+    def close(self):
+        self._tif.close()
+
+
 def save_img(img: np.ndarray, direc: str):
     """
     Saves 2D array as .tif file
@@ -39,6 +95,8 @@ def save_img(img: np.ndarray, direc: str):
 
     """
 
+    from skimage import io
+
     io.imsave(direc, img.astype("float32"))
 
 
@@ -61,6 +119,8 @@ def save_img_jpeg(
 
     """
 
+    import matplotlib.pyplot as plt
+
     plt.imsave(direc, img, vmin=cmin, vmax=cmax, cmap=cmap)
 
 
@@ -97,6 +157,9 @@ def straighten(
     if ninterp is None:
         ninterp = thickness
 
+    # Frames may be memory-mapped or stored as integers
+    img = np.asarray(img, dtype=np.float64)
+
     # Calculate gradients
     xcoors = roi[:, 0]
     ycoors = roi[:, 1]
@@ -131,6 +194,8 @@ def straighten(
     if interp not in ["linear", "cubic"]:
         raise ValueError('interp must be "linear" or "cubic"')
 
+    from scipy.ndimage import map_coordinates
+
     order = 1 if interp == "linear" else 3
     straight = map_coordinates(
         img.T, [gridcoors_x, gridcoors_y], order=order, mode="nearest"
@@ -198,6 +263,8 @@ def rotated_embryo(
     yvals_back_grid = np.reshape(yvals_back, [len(yvals), len(xvals)])
 
     # Map coordinates using linear interpolation
+    from scipy.ndimage import map_coordinates
+
     zvals = map_coordinates(img.T, [xvals_back_grid, yvals_back_grid], order=order)
 
     # Force posterior on right
@@ -291,6 +358,8 @@ def interp_1d_array(array: np.ndarray, n: int, method: str = "cubic") -> np.ndar
     if method == "linear":
         return np.interp(x_new, x, array)
     elif method == "cubic":
+        from scipy.interpolate import CubicSpline
+
         return CubicSpline(x, array)(x_new)
     else:
         raise ValueError("Invalid method. Choose either 'linear' or 'cubic'.")
@@ -315,15 +384,50 @@ def interp_2d_array(
     if ax not in [0, 1]:
         raise ValueError("ax must be 0 or 1")
 
-    interped = (
-        np.zeros((n, array.shape[1])) if ax == 0 else np.zeros((array.shape[0], n))
-    )
+    # Apply the resampling operator to all rows/columns at once
+    operator = interp_matrix(array.shape[ax], n, method)
+    if ax == 0:
+        return operator @ array
+    else:
+        return array @ operator.T
 
-    for x in range(interped.shape[1 - ax]):
-        slice_ = (slice(None), x) if ax == 0 else (x, slice(None))
-        interped[slice_] = interp_1d_array(array[slice_], n, method)
 
-    return interped
+@lru_cache(maxsize=32)
+def interp_matrix(n_in: int, n: int, method: str = "cubic") -> np.ndarray:
+    """
+    Linear operator performing interp_1d_array, such that interp_matrix(len(array), n, method) @ array is equivalent
+    to interp_1d_array(array, n, method). Cached, so resampling many arrays of the same length only builds the
+    operator once
+
+    Args:
+        n_in: length of the arrays to interpolate
+        n: number of points to evaluate
+        method: 'linear' or 'cubic'
+
+    Returns:
+        read-only numpy array of shape [n, n_in]
+
+    """
+    x = np.arange(n_in)
+    x_new = np.linspace(0, n_in - 1, n)
+
+    if method == "linear":
+        lower = np.clip(np.floor(x_new).astype(int), 0, max(n_in - 2, 0))
+        frac = x_new - lower
+        operator = np.zeros((n, n_in))
+        operator[np.arange(n), lower] = 1 - frac
+        if n_in > 1:
+            operator[np.arange(n), lower + 1] = frac
+    elif method == "cubic":
+        # Cubic spline interpolation is linear in the data, so interpolating the identity gives the operator
+        from scipy.interpolate import CubicSpline
+
+        operator = CubicSpline(x, np.eye(n_in))(x_new)
+    else:
+        raise ValueError("Invalid method. Choose either 'linear' or 'cubic'.")
+
+    operator.flags.writeable = False
+    return operator
 
 
 def rolling_ave_1d(array: np.ndarray, window: int, periodic: bool = True) -> np.ndarray:
@@ -489,6 +593,8 @@ def error_func(x: np.ndarray, centre: float, width: float) -> np.ndarray:
 
     """
 
+    from scipy.special import erf
+
     return erf((x - centre) / width)
 
 
@@ -524,7 +630,153 @@ def dosage(img: np.ndarray, roi: np.ndarray, expand: float) -> np.ndarray:
 
     """
 
-    return np.nanmean(img * make_mask((512, 512), offset_coordinates(roi, expand)))
+    return _masked_mean(img, offset_coordinates(roi, expand))
+
+
+########### BATCH METRICS ###########
+
+
+def bounded_mean_1d_batch(
+    arrays: np.ndarray | RaggedArray, bounds: tuple
+) -> np.ndarray:
+    """
+    Averages a batch of 1D arrays over the region specified by bounds, in one vectorised operation. Equivalent to
+    calling bounded_mean_1d on each array
+
+    Args:
+        arrays: two dimensional numpy array [n, L] or RaggedArray of one dimensional arrays (e.g. membrane profiles)
+        bounds: specifies window to average over. (min, max) from 0 to 1 specifying start and end of each array
+
+    Returns:
+        numpy array of length n
+
+    """
+
+    return _as_ragged(arrays, axis=0).bounded_mean(bounds, inclusive=True)
+
+
+def bounded_mean_2d_batch(
+    arrays: np.ndarray | RaggedArray, bounds: tuple
+) -> np.ndarray:
+    """
+    Averages a batch of 2D arrays in y dimension over the region specified by bounds, in one vectorised operation.
+    Equivalent to calling bounded_mean_2d on each array
+
+    Args:
+        arrays: three dimensional numpy array [n, H, L] or RaggedArray of two dimensional arrays with ragged last axis
+            (e.g. straightened images)
+        bounds: specifies window to average over. (min, max) from 0 to 1 specifying start and end of each array
+
+    Returns:
+        numpy array of shape [n, H]
+
+    """
+
+    return _as_ragged(arrays, axis=-1).bounded_mean(bounds, inclusive=False)
+
+
+def asi_batch(mems: np.ndarray | RaggedArray, size: float) -> np.ndarray:
+    """
+    Calculates asymmetry index for a batch of membrane concentration profiles, in one vectorised operation. Equivalent
+    to calling asi on each profile
+
+    Args:
+        mems: two dimensional numpy array [n, L] or RaggedArray of membrane concentration profiles. Periodic arrays
+            starting from extreme posterior
+        size: size of region to average over when calculating anterior and posterior concentrations (from 0 to 1, where
+            1 indicates the whole embryo)
+
+    Returns:
+        numpy array of asymmetry indices (length n)
+
+    """
+
+    return _as_ragged(mems, axis=0).asi(size)
+
+
+def dosage_batch(
+    imgs: list | np.ndarray,
+    rois: list | RaggedArray,
+    expand: float,
+    ids: list | np.ndarray | None = None,
+):
+    """
+    Calculates protein dosage (see dosage) for a batch of images. Masks are only rasterised within the bounding box of
+    each (expanded) ROI
+
+    Args:
+        imgs: list of 2D numpy arrays, or a 3D numpy array (or other frame-indexable array-like)
+        rois: rois representing cell edges (one two-column numpy array per image)
+        expand: expand the ROIs by this many pixels before calculating the dosage
+        ids: optional, embryo ids (one per image). If not specified, results will be indexed by frame
+
+    Returns:
+        pandas dataframe with one row per image
+
+    """
+
+    if ids is None:
+        ids = np.arange(len(rois))
+        index_column_name = "Frame"
+    else:
+        index_column_name = "EmbryoID"
+
+    dosages = np.array(
+        [
+            _masked_mean(img, offset_coordinates(roi, expand))
+            for img, roi in zip(imgs, rois)
+        ]
+    )
+    if len(ids) != len(dosages):
+        raise ValueError(
+            f"Got {len(ids)} ids for {len(dosages)} images, expected one id per image"
+        )
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            index_column_name: np.asarray(ids).astype(int),
+            "Dosage": dosages,
+        }
+    )
+
+
+def _as_ragged(arrays: np.ndarray | RaggedArray, axis: int) -> RaggedArray:
+    """
+    Views a regular batch of arrays (first dimension n) as a RaggedArray
+    """
+
+    if isinstance(arrays, RaggedArray):
+        return arrays
+    arrays = np.asarray(arrays)
+    n, length = arrays.shape[0], arrays.shape[1:][axis]
+    data = (
+        np.concatenate(list(arrays), axis=axis)
+        if arrays.ndim > 2
+        else arrays.reshape(-1)
+    )
+    return RaggedArray(data, np.arange(n + 1) * length, axis=axis)
+
+
+def _masked_mean(img: np.ndarray, roi: np.ndarray) -> float:
+    """
+    Mean pixel intensity within an ROI, rasterising the mask only within the ROI bounding box
+    """
+
+    coors = np.int32(roi)
+
+    # Bounding box (clipped to the image)
+    x0, y0 = np.maximum(coors.min(axis=0), 0)
+    x1, y1 = np.minimum(coors.max(axis=0) + 1, (img.shape[1], img.shape[0]))
+    if x1 <= x0 or y1 <= y0:
+        return np.nan
+
+    # Mask within bounding box
+    crop = np.asarray(img[y0:y1, x0:x1], dtype=float)
+    import cv2
+
+    mask = cv2.fillPoly(np.zeros(crop.shape, dtype=np.uint8), [coors - [x0, y0]], 1)
+    return np.nanmean(crop[mask == 1])
 
 
 def make_mask(shape: tuple, roi: np.ndarray) -> np.ndarray:
@@ -540,6 +792,8 @@ def make_mask(shape: tuple, roi: np.ndarray) -> np.ndarray:
 
     """
 
+    import cv2
+
     return cv2.fillPoly(np.zeros(shape) * np.nan, [np.int32(roi)], 1)
 
 
@@ -1,3 +1,5 @@
+import functools
+
 import ipywidgets as widgets
 import matplotlib.pyplot as plt
 import numpy as np
@@ -7,6 +9,158 @@ from .funcs import in_notebook
 
 # TODO: plot_segmentation fails if only one image
 
+"""
+Viewers create their artists once and update them in place. Sliders redraw only the artists that change, on top of a
+cached background (blitting), rather than redrawing the whole figure
+
+"""
+
+
+class _DisplayFrames:
+    """
+    Frames prepared for display. The display range is computed once for the whole stack, and each frame is downsampled
+    (so that neither dimension exceeds max_size) and scaled to 8-bit the first time it's shown, then cached
+
+    Args:
+        frames: list of 2D arrays
+        lower: percentile of pixel values (in the dimmest frame) to display as black
+        upper: percentile of pixel values (in the brightest frame) to display as white
+        max_size: maximum displayed size of each frame (pixels)
+        cache_size: maximum number of frames to cache
+
+    """
+
+    def __init__(
+        self,
+        frames: list,
+        lower: float,
+        upper: float,
+        max_size: int = 1024,
+        cache_size: int = 512,
+    ):
+        self.frames = frames
+        self.vmin = min([np.percentile(i, lower) for i in frames])
+        self.vmax = max([np.percentile(i, upper) for i in frames])
+        self.max_size = max_size
+        self._get = functools.lru_cache(maxsize=cache_size)(self._convert)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self._get(int(i))
+
+    def extent(self, i: int) -> tuple:
+        """
+        Extent of frame i in original pixel coordinates (so ROIs don't need rescaling if the frame is downsampled)
+        """
+        height, width = np.shape(self.frames[int(i)])[:2]
+        return -0.5, width - 0.5, height - 0.5, -0.5
+
+    def _convert(self, i: int) -> np.ndarray:
+        frame = np.asarray(self.frames[i])
+        step = max(-(-max(frame.shape) // self.max_size), 1)
+        frame = frame[::step, ::step]
+        scale = 255 / max(self.vmax - self.vmin, np.finfo(float).tiny)
+        return np.clip((frame - self.vmin) * scale, 0, 255).astype(np.uint8)
+
+
+class _Blitter:
+    """
+    Redraws a set of animated artists on top of a cached background. The background is captured every time the
+    figure is fully drawn (e.g. after resizing), and a full redraw is requested if blitting isn't possible
+
+    Args:
+        fig: figure
+        artists: artists that change between updates. Slider axes can be included so that sliders are also redrawn by
+            blitting
+        widgets: widgets to keep references to (so that they stay responsive after the plotting function returns).
+            Sliders won't trigger full redraws themselves
+
+    """
+
+    def __init__(self, fig, artists: list, widgets: list = ()):
+        self.fig = fig
+        self.artists = list(artists)
+        self.widgets = list(widgets)
+        self.background = None
+        self._bounds = None
+        for artist in self.artists:
+            artist.set_animated(True)
+        for widget in self.widgets:
+            widget.drawon = False
+
+        # Connected with a closure rather than a bound method, so that the figure keeps this object alive
+        fig.canvas.mpl_connect("draw_event", lambda event: self._on_draw(event))
+
+    def update(self, redraw: bool = False):
+        """
+        Redraws the animated artists
+
+        Args:
+            redraw: if True, redraws the whole figure (e.g. if axes limits have changed)
+
+        """
+        canvas = self.fig.canvas
+        if (
+            redraw
+            or self.background is None
+            or self._bounds != self.fig.bbox.bounds
+            or not canvas.supports_blit
+        ):
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+
+    def _on_draw(self, event):
+        if event.canvas is self.fig.canvas and event.canvas.supports_blit:
+            self.background = event.canvas.copy_from_bbox(self.fig.bbox)
+            self._bounds = self.fig.bbox.bounds
+        for artist in self.artists:
+            artist.draw(event.renderer)
+
+
+def _show_frame(image, frames: _DisplayFrames, i: int) -> bool:
+    """
+    Updates an image artist in place to show frame i
+
+    Returns:
+        True if the frame size has changed (in which case the axes limits are updated, and the figure needs a full
+        redraw)
+
+    """
+    image.set_data(frames[i])
+    extent = frames.extent(i)
+    if tuple(image.get_extent()) == extent:
+        return False
+    image.set_extent(extent)
+    image.axes.set_xlim(extent[:2])
+    image.axes.set_ylim(extent[2:])
+    return True
+
+
+def _show_profile(line, profile: np.ndarray) -> bool:
+    """
+    Updates a line artist in place to show profile, rescaling the x axis to fit
+
+    Returns:
+        True if the x axis limits have changed (in which case the figure needs a full redraw)
+
+    """
+    line.set_data(np.arange(len(profile)), profile)
+    xlim = line.axes.get_xlim()
+    line.axes.relim()
+    line.axes.autoscale_view(scaley=False)
+    return line.axes.get_xlim() != xlim
+
+
+def _set_window_title(fig, title: str):
+    if fig.canvas.manager is not None:
+        fig.canvas.manager.set_window_title(title)
+
 
 def view_stack_tk(
     frames: list | np.ndarray,
@@ -46,35 +200,37 @@ def view_stack_tk(
     fig, ax = plt.subplots()
     plt.subplots_adjust(left=0.25, bottom=0.25)
 
-    # Specify ylim
-    vmax = max([np.percentile(i, 99.9) for i in frames_])
-    vmin = min([np.percentile(i, 0.1) for i in frames_])
+    # Display range and downsampled frames
+    display = _DisplayFrames(frames_, 0.1, 99.9)
+    frame = start_frame if stack else 0
+    image = ax.imshow(
+        display[frame], cmap="gray", vmin=0, vmax=255, extent=display.extent(frame)
+    )
+    ax.set_xticks([])
+    ax.set_yticks([])
 
     # Stack
     if stack:
         axframe = plt.axes([0.25, 0.1, 0.65, 0.03])
         if end_frame is None:
-            end_frame = len(frames_)
+            end_frame = len(frames_) - 1
         sframe = Slider(
-            axframe, "Frame", start_frame, end_frame, valinit=start_frame, valfmt="%d"
+            axframe,
+            "Frame",
+            start_frame,
+            end_frame,
+            valinit=start_frame,
+            valstep=1,
+            valfmt="%d",
         )
+        blitter = _Blitter(fig, [image, axframe], widgets=[sframe])
 
         def update(i):
-            ax.clear()
-            ax.imshow(frames_[int(i)], cmap="gray", vmin=vmin, vmax=vmax)
-            ax.set_xticks([])
-            ax.set_yticks([])
+            blitter.update(redraw=_show_frame(image, display, int(i)))
 
         sframe.on_changed(update)
-        update(start_frame)
-
-    # Single frame
-    else:
-        ax.imshow(frames_[0], cmap="gray", vmin=vmin, vmax=vmax)
-        ax.set_xticks([])
-        ax.set_yticks([])
 
-    fig.canvas.set_window_title("")
+    _set_window_title(fig, "")
 
     if show:
         plt.show(block=True)
@@ -103,27 +259,24 @@ def view_stack_jupyter(
     # Set up figure
     fig, ax = plt.subplots()
 
-    # Specify ylim
-    vmax = max([np.percentile(i, 99.9) for i in frames_])
-    vmin = min([np.percentile(i, 0.1) for i in frames_])
+    # Display range and downsampled frames
+    display = _DisplayFrames(frames_, 0.1, 99.9)
+    frame = start_frame if stack else 0
+    image = ax.imshow(
+        display[frame], cmap="gray", vmin=0, vmax=255, extent=display.extent(frame)
+    )
+    ax.set_xticks([])
+    ax.set_yticks([])
 
     # Stack
     if stack:
         if end_frame is None:
             end_frame = len(frames_) - 1
+        blitter = _Blitter(fig, [image])
 
         @widgets.interact(Frame=(start_frame, end_frame, 1))
         def update(Frame=start_frame):
-            ax.clear()
-            ax.imshow(frames_[int(Frame)], cmap="gray", vmin=vmin, vmax=vmax)
-            ax.set_xticks([])
-            ax.set_yticks([])
-
-    # Single frame
-    else:
-        ax.imshow(frames_[0], cmap="gray", vmin=vmin, vmax=vmax)
-        ax.set_xticks([])
-        ax.set_yticks([])
+            blitter.update(redraw=_show_frame(image, display, int(Frame)))
 
     fig.set_size_inches(4, 4)
     fig.tight_layout()
@@ -162,46 +315,51 @@ def plot_segmentation(frames: list | np.ndarray, rois: list | np.ndarray):
     if isinstance(frames, list):
         stack = True
         frames_ = frames
+        rois_ = rois
     elif len(frames.shape) == 3:
         stack = True
         frames_ = list(frames)
+        rois_ = rois
     else:
         stack = False
         frames_ = [
             frames,
         ]
+        rois_ = [
+            rois,
+        ]
 
-    # Specify ylim
-    ylim_top = max([np.percentile(i, 99.9) for i in frames_])
-    ylim_bottom = min([np.percentile(i, 0.01) for i in frames_])
+    # Display range and downsampled frames
+    display = _DisplayFrames(frames_, 0.01, 99.9)
 
-    # Single frame
-    if not stack:
-        ax.imshow(frames_[0], cmap="gray", vmin=ylim_bottom, vmax=ylim_top)
-        ax.plot(rois[:, 0], rois[:, 1], c="lime")
-        ax.scatter(rois[0, 0], rois[0, 1], c="lime")
-        ax.set_xticks([])
-        ax.set_yticks([])
+    # Artists (created once, then updated in place)
+    image = ax.imshow(
+        display[0], cmap="gray", vmin=0, vmax=255, extent=display.extent(0)
+    )
+    (line,) = ax.plot(rois_[0][:, 0], rois_[0][:, 1], c="lime")
+    point = ax.scatter(rois_[0][0, 0], rois_[0][0, 1], c="lime")
+    ax.set_xticks([])
+    ax.set_yticks([])
 
     # Stack
-    else:
+    if stack:
         # Add frame slider
         plt.subplots_adjust(left=0.25, bottom=0.25)
         axframe = plt.axes([0.25, 0.1, 0.65, 0.03])
-        sframe = Slider(axframe, "Frame", 0, len(frames_), valinit=0, valfmt="%d")
+        sframe = Slider(
+            axframe, "Frame", 0, len(frames_) - 1, valinit=0, valstep=1, valfmt="%d"
+        )
+        blitter = _Blitter(fig, [image, line, point, axframe], widgets=[sframe])
 
         def update(i):
-            ax.clear()
-            ax.imshow(frames_[int(i)], cmap="gray", vmin=ylim_bottom, vmax=ylim_top)
-            ax.plot(rois[int(i)][:, 0], rois[int(i)][:, 1], c="lime")
-            ax.scatter(rois[int(i)][0, 0], rois[int(i)][0, 1], c="lime")
-            ax.set_xticks([])
-            ax.set_yticks([])
+            roi = rois_[int(i)]
+            line.set_data(roi[:, 0], roi[:, 1])
+            point.set_offsets(roi[:1])
+            blitter.update(redraw=_show_frame(image, display, int(i)))
 
         sframe.on_changed(update)
-        update(0)
 
-    fig.canvas.set_window_title("Segmentation")
+    _set_window_title(fig, "Segmentation")
     plt.show(block=True)
 
     return fig, ax
@@ -226,38 +384,42 @@ def plot_segmentation_jupyter(frames: list | np.ndarray, rois: list | np.ndarray
     if isinstance(frames, list):
         stack = True
         frames_ = frames
+        rois_ = rois
     elif len(frames.shape) == 3:
         stack = True
         frames_ = list(frames)
+        rois_ = rois
     else:
         stack = False
         frames_ = [
             frames,
         ]
+        rois_ = [
+            rois,
+        ]
 
-    # Specify ylim
-    ylim_top = max([np.percentile(i, 99.9) for i in frames_])
-    ylim_bottom = min([np.percentile(i, 0.01) for i in frames_])
+    # Display range and downsampled frames
+    display = _DisplayFrames(frames_, 0.01, 99.9)
 
-    # Single frame
-    if not stack:
-        ax.imshow(frames_[0], cmap="gray", vmin=ylim_bottom, vmax=ylim_top)
-        ax.plot(rois[:, 0], rois[:, 1], c="lime")
-        ax.scatter(rois[0, 0], rois[0, 1], c="lime")
-        ax.set_xticks([])
-        ax.set_yticks([])
+    # Artists (created once, then updated in place)
+    image = ax.imshow(
+        display[0], cmap="gray", vmin=0, vmax=255, extent=display.extent(0)
+    )
+    (line,) = ax.plot(rois_[0][:, 0], rois_[0][:, 1], c="lime")
+    point = ax.scatter(rois_[0][0, 0], rois_[0][0, 1], c="lime")
+    ax.set_xticks([])
+    ax.set_yticks([])
 
     # Stack
-    else:
+    if stack:
+        blitter = _Blitter(fig, [image, line, point])
 
         @widgets.interact(Frame=(0, len(frames_) - 1, 1))
         def update(Frame=0):
-            ax.clear()
-            ax.imshow(frames_[int(Frame)], cmap="gray", vmin=ylim_bottom, vmax=ylim_top)
-            ax.plot(rois[int(Frame)][:, 0], rois[int(Frame)][:, 1], c="lime")
-            ax.scatter(rois[int(Frame)][0, 0], rois[int(Frame)][0, 1], c="lime")
-            ax.set_xticks([])
-            ax.set_yticks([])
+            roi = rois_[int(Frame)]
+            line.set_data(roi[:, 0], roi[:, 1])
+            point.set_offsets(roi[:1])
+            blitter.update(redraw=_show_frame(image, display, int(Frame)))
 
     fig.set_size_inches(4, 4)
     fig.tight_layout()
@@ -305,23 +467,27 @@ def plot_quantification(mems: list | np.ndarray):
         ylim_top = max([np.max(m) for m in mems_])
         ylim_bottom = min([np.min(m) for m in mems_])
 
+        # Artists (created once, then updated in place)
+        (line,) = ax.plot(mems_[0])
+        ax.axhline(0, c="k", linestyle="--")
+        ax.set_xlabel("Position")
+        ax.set_ylabel("Membrane concentration")
+        ax.set_ylim(min(ylim_bottom, 0), ylim_top)
+
         # Add frame silder
         plt.subplots_adjust(left=0.25, bottom=0.25)
         axframe = plt.axes([0.25, 0.1, 0.65, 0.03])
-        sframe = Slider(axframe, "Frame", 0, len(mems_), valinit=0, valfmt="%d")
+        sframe = Slider(
+            axframe, "Frame", 0, len(mems_) - 1, valinit=0, valstep=1, valfmt="%d"
+        )
+        blitter = _Blitter(fig, [line, axframe], widgets=[sframe])
 
         def update(i):
-            ax.clear()
-            ax.plot(mems_[int(i)])
-            ax.axhline(0, c="k", linestyle="--")
-            ax.set_xlabel("Position")
-            ax.set_ylabel("Membrane concentration")
-            ax.set_ylim(min(ylim_bottom, 0), ylim_top)
+            blitter.update(redraw=_show_profile(line, mems_[int(i)]))
 
         sframe.on_changed(update)
-        update(0)
 
-    fig.canvas.set_window_title("Membrane Quantification")
+    _set_window_title(fig, "Membrane Quantification")
     plt.show(block=True)
 
     return fig, ax
@@ -367,14 +533,17 @@ def plot_quantification_jupyter(mems: list | np.ndarray):
         ylim_top = max([np.max(m) for m in mems_])
         ylim_bottom = min([np.min(m) for m in mems_] + [0])
 
+        # Artists (created once, then updated in place)
+        (line,) = ax.plot(mems_[0])
+        ax.axhline(0, c="k", linestyle="--")
+        ax.set_xlabel("Position")
+        ax.set_ylabel("Membrane concentration")
+        ax.set_ylim(ylim_bottom, ylim_top)
+        blitter = _Blitter(fig, [line])
+
         @widgets.interact(Frame=(0, len(mems_) - 1, 1))
         def update(Frame=0):
-            ax.clear()
-            ax.plot(mems_[int(Frame)])
-            ax.axhline(0, c="k", linestyle="--")
-            ax.set_xlabel("Position")
-            ax.set_ylabel("Membrane concentration")
-            ax.set_ylim(ylim_bottom, ylim_top)
+            blitter.update(redraw=_show_profile(line, mems_[int(Frame)]))
 
     fig.set_size_inches(5, 3)
     fig.tight_layout()
@@ -406,6 +575,8 @@ class _FitPlotter:
         self.target = target_
         self.fit = fit_
         self.pos = 10
+        self._target = self.target[0]
+        self._fit = self.fit[0]
 
         # Set up figure
         self.fig = plt.figure()
@@ -421,65 +592,87 @@ class _FitPlotter:
         self.ylim_top = max([straight_max, fit_max])
         self.ylim_bottom = min([straight_min, fit_min])
 
+        # Artists (created once, then updated in place)
+        self.image = self.ax1.imshow(
+            self._target, cmap="gray", vmin=self.ylim_bottom, vmax=1.1 * self.ylim_top
+        )
+        self.vline = self.ax1.axvline(self.pos, c="r")
+        self.ax1.set_yticks([])
+        self.ax1.set_xlabel("Position")
+        self.ax1.xaxis.set_label_position("top")
+        (self.line_target,) = self.ax2.plot(self._target[:, self.pos], label="Actual")
+        (self.line_fit,) = self.ax2.plot(self._fit[:, self.pos], label="Fit")
+        self.ax2.set_xticks([])
+        self.ax2.set_ylabel("Intensity")
+        self.ax2.legend(frameon=False, loc="upper left", fontsize="small")
+        self.ax2.set_ylim(bottom=self.ylim_bottom, top=self.ylim_top)
+        artists = [self.image, self.vline, self.line_target, self.line_fit]
+
         # Frame slider
+        sliders = []
         if self.stack:
             plt.subplots_adjust(bottom=0.25, left=0.25)
             axframe = plt.axes([0.25, 0.1, 0.65, 0.03])
             slider_frame = Slider(
-                axframe, "Frame", 0, len(self.target), valinit=0, valfmt="%d"
+                axframe,
+                "Frame",
+                0,
+                len(self.target) - 1,
+                valinit=0,
+                valstep=1,
+                valfmt="%d",
             )
             slider_frame.on_changed(lambda f: self.update_frame(int(f)))
+            artists.append(axframe)
+            sliders.append(slider_frame)
+        self.blitter = _Blitter(self.fig, artists, widgets=sliders)
 
-        # Initial plot
-        self.update_frame(0)
+        # Position is selected by clicking (or dragging) on the straightened image
+        self.fig.canvas.mpl_connect(
+            "button_press_event", lambda event: self._on_mouse(event)
+        )
+        self.fig.canvas.mpl_connect(
+            "motion_notify_event", lambda event: self._on_mouse(event)
+        )
 
         # Show
-        self.fig.canvas.set_window_title("Local fits")
+        _set_window_title(self.fig, "Local fits")
         plt.show(block=True)
 
     def update_pos(self, p: float):
-        self.pos = int(p)
-        self.ax1_update()
-        self.ax2_update()
+        self.pos = int(np.clip(p, 0, self._target.shape[1] - 1))
+        self.vline.set_xdata([self.pos, self.pos])
+        self.line_target.set_ydata(self._target[:, self.pos])
+        self.line_fit.set_ydata(self._fit[:, self.pos])
+        self.blitter.update()
 
     def update_frame(self, i: int):
         self._target = self.target[i]
         self._fit = self.fit[i]
 
-        # Position slider
-        self.slider_pos = Slider(
-            self.ax1,
-            "",
-            0,
-            len(self._target[0, :]),
-            valinit=self.pos,
-            valfmt="%d",
-            facecolor="none",
-            edgecolor="none",
-        )
-        self.slider_pos.on_changed(self.update_pos)
-
-        self.ax1_update()
-        self.ax2_update()
-
-    def ax1_update(self):
-        self.ax1.clear()
-        self.ax1.imshow(
-            self._target, cmap="gray", vmin=self.ylim_bottom, vmax=1.1 * self.ylim_top
-        )
-        self.ax1.axvline(self.pos, c="r")
-        self.ax1.set_yticks([])
-        self.ax1.set_xlabel("Position")
-        self.ax1.xaxis.set_label_position("top")
-
-    def ax2_update(self):
-        self.ax2.clear()
-        self.ax2.plot(self._target[:, self.pos], label="Actual")
-        self.ax2.plot(self._fit[:, self.pos], label="Fit")
-        self.ax2.set_xticks([])
-        self.ax2.set_ylabel("Intensity")
-        self.ax2.legend(frameon=False, loc="upper left", fontsize="small")
-        self.ax2.set_ylim(bottom=self.ylim_bottom, top=self.ylim_top)
+        # Straightened image (full redraw if its size has changed)
+        extent = (-0.5, self._target.shape[1] - 0.5, self._target.shape[0] - 0.5, -0.5)
+        redraw = tuple(self.image.get_extent()) != extent
+        self.image.set_data(self._target)
+        if redraw:
+            self.image.set_extent(extent)
+            self.ax1.set_xlim(extent[:2])
+            self.ax1.set_ylim(extent[2:])
+
+        # Profiles
+        self.pos = min(self.pos, self._target.shape[1] - 1)
+        self.vline.set_xdata([self.pos, self.pos])
+        redraw |= _show_profile(self.line_target, self._target[:, self.pos])
+        self.line_fit.set_data(np.arange(self._fit.shape[0]), self._fit[:, self.pos])
+        self.blitter.update(redraw=redraw)
+
+    def _on_mouse(self, event):
+        if (
+            event.inaxes is self.ax1
+            and event.button is not None
+            and event.xdata is not None
+        ):
+            self.update_pos(event.xdata)
 
 
 def plot_fits(target: list | np.ndarray, fit_total: list | np.ndarray):
@@ -520,49 +713,54 @@ def plot_fits_jupyter(target: list | np.ndarray, fit: list | np.ndarray):
     ylim_top = max([straight_max, fit_max])
     ylim_bottom = min([straight_min, fit_min])
 
+    # Artists (created once, then updated in place)
+    image = ax1.imshow(target[0], cmap="gray", vmin=ylim_bottom, vmax=1.1 * ylim_top)
+    vline = ax1.axvline(0, c="r")
+    ax1.set_yticks([])
+    ax1.set_xlabel("Position")
+    ax1.xaxis.set_label_position("top")
+    (line_target,) = ax2.plot(target[0][:, 0], label="Actual")
+    (line_fit,) = ax2.plot(fit[0][:, 0], label="Fit")
+    ax2.set_xticks([])
+    ax2.set_ylabel("Intensity")
+    ax2.legend(frameon=False, loc="upper left", fontsize="small")
+    ax2.set_ylim(bottom=ylim_bottom, top=ylim_top)
+    blitter = _Blitter(fig, [image, vline, line_target, line_fit])
+
+    def update(frame: int, position: float):
+        # Straightened image (full redraw if its size has changed)
+        extent = (
+            -0.5,
+            target[frame].shape[1] - 0.5,
+            target[frame].shape[0] - 0.5,
+            -0.5,
+        )
+        redraw = tuple(image.get_extent()) != extent
+        image.set_data(target[frame])
+        if redraw:
+            image.set_extent(extent)
+            ax1.set_xlim(extent[:2])
+            ax1.set_ylim(extent[2:])
+
+        # Profiles
+        vline.set_xdata([position, position])
+        redraw |= _show_profile(line_target, target[frame][:, position])
+        line_fit.set_data(np.arange(fit[frame].shape[0]), fit[frame][:, position])
+        blitter.update(redraw=redraw)
+
     if stack:
 
         @widgets.interact(Frame=(0, len(target) - 1, 1), Position=(0, 1, 0.01))
-        def update(Frame: int = 0, Position: float = 0.1):
+        def update_stack(Frame: int = 0, Position: float = 0.1):
             position = int(Position * target[int(Frame)].shape[1] - 1)
-
-            ax1.clear()
-            ax1.imshow(
-                target[int(Frame)], cmap="gray", vmin=ylim_bottom, vmax=1.1 * ylim_top
-            )
-            ax1.axvline(position, c="r")
-            ax1.set_yticks([])
-            ax1.set_xlabel("Position")
-            ax1.xaxis.set_label_position("top")
-
-            ax2.clear()
-            ax2.plot(target[int(Frame)][:, position], label="Actual")
-            ax2.plot(fit[int(Frame)][:, position], label="Fit")
-            ax2.set_xticks([])
-            ax2.set_ylabel("Intensity")
-            ax2.legend(frameon=False, loc="upper left", fontsize="small")
-            ax2.set_ylim(bottom=ylim_bottom, top=ylim_top)
+            update(int(Frame), position)
 
     else:
 
         @widgets.interact(Position=(0, 1, 0.01))
-        def update(Position: float = 0.1):
+        def update_single(Position: float = 0.1):
             position = int(Position * (target[0].shape[1] - 1))
-
-            ax1.clear()
-            ax1.imshow(target[0], cmap="gray", vmin=ylim_bottom, vmax=1.1 * ylim_top)
-            ax1.axvline(position, c="r")
-            ax1.set_yticks([])
-            ax1.set_xlabel("Position")
-            ax1.xaxis.set_label_position("top")
-
-            ax2.clear()
-            ax2.plot(target[0][:, position], label="Actual")
-            ax2.plot(fit[0][:, position], label="Fit")
-            ax2.set_xticks([])
-            ax2.set_ylabel("Intensity")
-            ax2.legend(frameon=False, loc="upper left", fontsize="small")
-            ax2.set_ylim(bottom=ylim_bottom, top=ylim_top)
+            update(0, position)
 
     fig.set_size_inches(5, 3)
     fig.tight_layout()
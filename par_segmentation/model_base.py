@@ -1,18 +1,8 @@
-from .funcs import in_notebook
-from .interactive import (
-    view_stack,
-    view_stack_jupyter,
-    plot_quantification,
-    plot_quantification_jupyter,
-    plot_fits,
-    plot_fits_jupyter,
-    plot_segmentation,
-    plot_segmentation_jupyter,
-)
 import os
 import numpy as np
-import pandas as pd
-from .funcs import save_img
+from .funcs import in_notebook, save_img
+from .ragged import RaggedArray
+from .roi import SplineRoi
 
 
 class ImageQuantBase:
@@ -23,19 +13,31 @@ class ImageQuantBase:
     ):
         """
         Args:
-            img: numpy array of image or list of numpy arrays
+            img: numpy array of image or list of numpy arrays. Stacks may also be memory-mapped or lazily loaded
+                (see load_image), in which case frames are only read and cast to float when they are preprocessed
             roi: coordinates defining the cortex (two column numpy array of x and y
-                coordinates at 1-pixel width intervals), or a list of arrays
+                coordinates at 1-pixel width intervals), or a list of arrays. SplineRoi
+                objects are also accepted, and are converted to coordinates
         """
 
         # Input data
         self.img = img
         self.roi = roi
 
+        # Spline ROIs: create coordinates at 1-pixel width intervals
+        if isinstance(self.roi, SplineRoi):
+            self.roi = self.roi.coordinates()
+        elif isinstance(self.roi, list):
+            self.roi = [
+                r.coordinates() if isinstance(r, SplineRoi) else r for r in self.roi
+            ]
+
         # Detect if single frame or stack
         if isinstance(self.img, list) or len(self.img.shape) == 3:
             self.stack = True
-            self.img = list(self.img)
+            # Other frame-indexable array-likes (e.g. TiffStack) are kept as they are
+            if isinstance(self.img, np.ndarray):
+                self.img = list(self.img)
         else:
             self.stack = False
             self.img = [self.img]
@@ -45,15 +47,15 @@ class ImageQuantBase:
         # ROI
         if not self.stack:
             self.roi = [self.roi]
-        elif isinstance(self.roi, list):
+        elif isinstance(self.roi, list | RaggedArray):
             if len(self.roi) > 1:
                 self.roi = self.roi
             else:
-                self.roi = self.roi * self.n
+                self.roi = list(self.roi) * self.n
         else:
             self.roi = [self.roi] * self.n
 
-        # Empty results containers (to be filled by child class)
+        # Empty results containers (to be filled by child class, as RaggedArrays)
         self.mems = None
         self.cyts = None
         self.offsets = None
@@ -65,7 +67,8 @@ class ImageQuantBase:
         """
         Save results for a single image to save_path as a series of txt files and tifs
         I'd recommend using compile_res() instead as this will create a single pandas
-            dataframe with all the results
+            dataframe with all the results, or save_store() to save full results for
+            a large batch of images to a single file
 
         Args:
             save_path: path to save full results
@@ -76,78 +79,154 @@ class ImageQuantBase:
         os.makedirs(save_path, exist_ok=True)
 
         data_files = {
-            "/offsets.txt": self.offsets[i],
-            "/cytoplasmic_concentrations.txt": self.cyts[i],
-            "/membrane_concentrations.txt": self.mems[i],
-            "/roi.txt": self.roi[i],
+            "/offsets.txt": self.offsets,
+            "/cytoplasmic_concentrations.txt": self.cyts,
+            "/membrane_concentrations.txt": self.mems,
+            "/roi.txt": self.roi,
         }
 
+        # Results that a model doesn't produce (e.g. offsets in the flexi model) are skipped
         for filename, data in data_files.items():
-            np.savetxt(save_path + filename, data, fmt="%.4f", delimiter="\t")
+            if data is not None:
+                np.savetxt(save_path + filename, data[i], fmt="%.4f", delimiter="\t")
 
+        # Images (simulated and residual images are skipped if they weren't computed, e.g. with sim_images=False)
         image_files = {
-            "/target.tif": self.straight_images[i],
-            "/fit.tif": self.straight_images_sim[i],
-            "/residuals.tif": self.straight_images_resids[i],
+            "/target.tif": self.straight_images,
+            "/fit.tif": self.straight_images_sim,
+            "/residuals.tif": self.straight_images_resids,
         }
 
         for filename, img in image_files.items():
-            save_img(img, save_path + filename)
+            if img is not None:
+                save_img(img[i], save_path + filename)
+
+    def save_store(
+        self, path: str, ids: list | np.ndarray | None = None, append: bool = True
+    ):
+        """
+        Save results for all images to a single chunked, compressed HDF5 file. Results from incremental runs can be
+        appended to the same file, and results for individual embryos can be read back with load_store()
+
+        Args:
+            path: path of the HDF5 file (will be created if it doesn't already exist)
+            ids: optional, embryo ids to save alongside the results (defaults to image indices)
+            append: if True, results are appended to an existing file. If False, any existing file is overwritten
+        """
+        from .store import STORE_FIELDS, save_store
+
+        if ids is None:
+            ids = np.arange(self.n)
+
+        results = {field: getattr(self, field, None) for field in STORE_FIELDS}
+        save_store(path, results, ids=ids, append=append)
+
+    def load_store(
+        self, path: str, indices: list | np.ndarray | None = None
+    ) -> np.ndarray:
+        """
+        Load results from an HDF5 file created with save_store() into this model. Results are set as RaggedArrays, as
+        after run(). Fields that weren't saved for any of the embryos loaded are set to None, and fields saved for only
+        some of them are set as lists (with None for the missing embryos)
+
+        Args:
+            path: path of the HDF5 file
+            indices: positions (in the order saved) of the embryos to load. Should match the images this model was
+                set up with. If None, all embryos are loaded
+
+        Returns:
+            numpy array of the ids of the embryos loaded
+        """
+        from .store import STORE_FIELDS, load_store
+
+        results = load_store(path, indices=indices)
+        for field, is_image in STORE_FIELDS.items():
+            value = results.get(field)
+            if value is not None and all(v is not None for v in value):
+                value = RaggedArray.from_list(value, axis=-1 if is_image else 0)
+            setattr(self, field, value)
+        return results["ids"]
 
     def compile_res(self, ids=None, extra_columns=None):
         """
         Compile results to a pandas dataframe
 
+        Args:
+            ids: optional, embryo ids (one per image). If not specified, results will be indexed by frame
+            extra_columns: optional, dictionary of extra columns to add. Values should contain one entry per image,
+                which will be repeated for every position
+
         Returns:
             A pandas dataframe containing quantification results
         """
+        columns = self._res_columns(ids, extra_columns)
+        import pandas as pd
+
+        return pd.DataFrame(columns, index=columns["Position"])
+
+    def save_res(self, path: str, ids=None, extra_columns=None):
+        """
+        Save compiled results directly to a Parquet file (or an Arrow IPC/Feather file if path ends in '.arrow' or
+        '.feather'), with the same columns as compile_res()
+
+        Args:
+            path: path of the file to save
+            ids: optional, embryo ids (one per image). If not specified, results will be indexed by frame
+            extra_columns: optional, dictionary of extra columns to add. Values should contain one entry per image,
+                which will be repeated for every position
+        """
+        import pyarrow as pa
+
+        table = pa.table(self._res_columns(ids, extra_columns))
+        if path.endswith((".arrow", ".feather")):
+            from pyarrow import feather
+
+            feather.write_feather(table, path)
+        else:
+            from pyarrow import parquet
+
+            parquet.write_table(table, path)
+
+    def _res_columns(self, ids=None, extra_columns=None) -> dict:
+        """
+        Builds columns of compiled results as flat numpy arrays, in the column order of compile_res()
+        """
         if ids is None:
             ids = np.arange(self.n)
             index_column_name = "Frame"
         else:
             index_column_name = "EmbryoID"
 
-        # Loop through embryos
-        _dfs = []
-        for i, (m, c, _id) in enumerate(zip(self.mems, self.cyts, ids)):
-            # Construct dictionary
-            df_dict = {
-                index_column_name: [_id] * len(m),
-                "Position": np.arange(len(m)),
-                "Membrane signal": m,
-                "Cytoplasmic signal": c,
-            }
-
-            # Add extra columns
-            if extra_columns is not None:
-                for key, value in extra_columns.items():
-                    df_dict[key] = [value[i] for _ in range(len(m))]
-
-            # Append to list
-            _dfs.append(pd.DataFrame(df_dict))
-
-        # Combine
-        df = pd.concat(_dfs)
-
-        # Reorder columns
-        columns_order = [
-            index_column_name,
-            "Position",
-            "Membrane signal",
-            "Cytoplasmic signal",
-        ]
+        # Number of positions per embryo
+        n = min(len(self.mems), len(self.cyts), len(ids))
+        lengths = np.array([len(m) for m in self.mems[:n]], dtype=int)
+        starts = np.cumsum(lengths) - lengths
+
+        # Concatenate results, repeating ids for every position
+        columns = {
+            index_column_name: np.repeat(np.asarray(ids[:n]).astype(int), lengths),
+            "Position": np.arange(lengths.sum()) - np.repeat(starts, lengths),
+            "Membrane signal": np.concatenate(
+                [np.asarray(m, dtype=float) for m in self.mems[:n]]
+            ),
+            "Cytoplasmic signal": np.concatenate(
+                [np.asarray(c, dtype=float) for c in self.cyts[:n]]
+            ),
+        }
+
+        # Add extra columns
         if extra_columns is not None:
-            columns_order += list(extra_columns.keys())
-        df = df.reindex(columns=columns_order)
+            for key, value in extra_columns.items():
+                columns[key] = np.repeat(np.asarray(value[:n]), lengths)
 
-        # Specify column types
-        df = df.astype({index_column_name: int, "Position": int})
-        return df
+        return columns
 
     def view_frames(self):
         """
         Opens an interactive widget to view image(s)
         """
+        from .interactive import view_stack, view_stack_jupyter
+
         jupyter = in_notebook()
         img = self.img if self.stack else self.img[0]
         view_func = view_stack_jupyter if jupyter else view_stack
@@ -158,8 +237,10 @@ class ImageQuantBase:
         """
         Opens an interactive widget to plot membrane quantification results
         """
+        from .interactive import plot_quantification, plot_quantification_jupyter
+
         jupyter = in_notebook()
-        mems_full = self.mems if self.stack else self.mems[0]
+        mems_full = list(self.mems) if self.stack else self.mems[0]
         plot_func = plot_quantification_jupyter if jupyter else plot_quantification
         fig, ax = plot_func(mems_full)
         return fig, ax
@@ -168,10 +249,21 @@ class ImageQuantBase:
         """
         Opens an interactive widget to plot actual vs fit profiles
         """
+        from .interactive import plot_fits, plot_fits_jupyter
+
+        if self.straight_images is None or self.straight_images_sim is None:
+            raise ValueError(
+                "No simulated images to plot (if using the DE method, run with sim_images=True)"
+            )
+
         jupyter = in_notebook()
-        target_full = self.straight_images if self.stack else self.straight_images[0]
+        target_full = (
+            list(self.straight_images) if self.stack else self.straight_images[0]
+        )
         sim_full = (
-            self.straight_images_sim if self.stack else self.straight_images_sim[0]
+            list(self.straight_images_sim)
+            if self.stack
+            else self.straight_images_sim[0]
         )
         plot_func = plot_fits_jupyter if jupyter else plot_fits
         fig, ax = plot_func(target_full, sim_full)
@@ -181,9 +273,36 @@ class ImageQuantBase:
         """
         Opens an interactive widget to plot segmentation results
         """
+        from .interactive import plot_segmentation, plot_segmentation_jupyter
+
         jupyter = in_notebook()
         img = self.img if self.stack else self.img[0]
-        roi = self.roi if self.stack else self.roi[0]
+        roi = list(self.roi) if self.stack else self.roi[0]
         plot_func = plot_segmentation_jupyter if jupyter else plot_segmentation
         fig, ax = plot_func(img, roi)
         return fig, ax
+
+    def render_qc(self, out_dir: str, ids=None, **kwargs) -> list:
+        """
+        Saves QC figures (segmentation, quantification and fits) for every image without opening any windows. See
+        qc.render_qc for additional keyword arguments (e.g. n_jobs, downsample, contact_sheet)
+
+        Args:
+            out_dir: directory to save figures to
+            ids: optional, names of the embryos (one per image), used as file names
+
+        Returns:
+            list of paths of saved figures
+        """
+        from .qc import render_qc
+
+        return render_qc(
+            out_dir,
+            self.img,
+            self.roi,
+            mems=self.mems,
+            straight_images=self.straight_images,
+            straight_images_sim=self.straight_images_sim,
+            ids=ids,
+            **kwargs,
+        )
@@ -1,13 +1,17 @@
 import multiprocessing
+import os
+import tempfile
 import time
 
+import joblib
 import numpy as np
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, parallel_config
 from scipy.optimize import differential_evolution
 
 from .funcs import (
     interp_1d_array,
     interp_2d_array,
+    interp_matrix,
     rolling_ave_2d,
     rotate_roi,
     straighten,
@@ -16,6 +20,7 @@ from .funcs import (
 )
 from .roi import interp_roi, offset_coordinates, spline_roi
 from .model_base import ImageQuantBase
+from .ragged import RaggedArray
 
 """
 Legacy code for differential evolution algorithm 
@@ -56,6 +61,15 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
     Computation:
     parallel           TRUE = perform fitting in parallel
     cores              number of cores to use if parallel is True (if none will use all available)
+    vectorized         if True, each differential evolution generation is evaluated for the whole population at once
+    solver             'DE' for differential evolution, or 'grid' to evaluate every candidate offset for every profile
+                       and solve for cytoplasmic and membrane concentrations by linear least squares (deterministic,
+                       and much faster)
+
+    Outputs:
+    sim_images         if True, reconstructs simulated and residual images (straight_fit, straight_resids) after
+                       fitting. These are only needed for save and plot_fits, so can be switched off if only numeric
+                       results are required
 
     Saving:
     save_path          destination to save results, will create if it doesn't already exist
@@ -81,6 +95,9 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
         iterations: int = 2,
         interp: str = "cubic",
         bg_subtract: bool = False,
+        vectorized: bool = False,
+        solver: str = "DE",
+        sim_images: bool = True,
     ):
         super().__init__(
             img=img,
@@ -124,6 +141,10 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
         )
 
         # Computation
+        if solver not in ["DE", "grid"]:
+            raise ValueError('solver must be "DE" or "grid"')
+        self.solver = solver
+        self.vectorized = vectorized
         self.parallel = parallel
         if cores is not None:
             self.cores = cores
@@ -131,6 +152,7 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
             self.cores = multiprocessing.cpu_count()
 
         # Simulated images
+        self.sim_images = sim_images
         self.straight = None
         self.straight_filtered = None
         self.straight_fit = None
@@ -157,7 +179,8 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
             self._fit()
 
         # Simulate images
-        self._sim_images()
+        if self.sim_images:
+            self._sim_images()
 
     def _fit(self):
         # Specify number of fits
@@ -171,7 +194,7 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
         if self.bg_subtract:
             bg_intensity = np.mean(self.straight[:5, :])
             self.straight -= bg_intensity
-            self.img -= bg_intensity
+            self.img = self.img - bg_intensity
 
         # Smoothen
         if self.rol_ave != 0:
@@ -188,21 +211,36 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
         straight = interp_2d_array(straight, self.nfits, ax=1, method=self.interp)
 
         # Fit
-        if self.parallel:
-            results = np.array(
-                Parallel(n_jobs=self.cores)(
-                    delayed(self._fit_profile)(straight[:, x])
-                    for x in range(len(straight[0, :]))
-                )
-            )
+        if self.solver == "grid":
+            self.offsets, self.cyts, self.mems = self._fit_profiles_grid(straight)
+        elif self.parallel:
+            # Fit chunks of profiles on each core. Processes are requested explicitly, as joblib would otherwise fall
+            # back to threads (which the GIL-bound fits can't make use of) when run inside an image worker. The
+            # straightened image is written to a memory-mapped file, which workers read their chunks from
+            bounds = np.linspace(0, straight.shape[1], self.cores + 1).astype(int)
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "straight.pkl")
+                joblib.dump(straight, path)
+                straight_mm = joblib.load(path, mmap_mode="r")
+                with parallel_config(backend="loky"):
+                    results = np.concatenate(
+                        Parallel(n_jobs=self.cores)(
+                            delayed(_fit_profiles_de)(
+                                straight_mm, columns=slice(a, b), **self._de_args()
+                            )
+                            for a, b in zip(bounds[:-1], bounds[1:])
+                            if b > a
+                        )
+                    )
+                del straight_mm
             self.offsets = results[:, 0]
             self.cyts = results[:, 1]
             self.mems = results[:, 2]
         else:
-            for x in range(len(straight[0, :])):
-                self.offsets[x], self.cyts[x], self.mems[x] = self._fit_profile(
-                    straight[:, x]
-                )
+            results = _fit_profiles_de(straight, **self._de_args())
+            self.offsets = results[:, 0]
+            self.cyts = results[:, 1]
+            self.mems = results[:, 2]
 
         # Interpolate
         self.offsets_full = interp_1d_array(
@@ -215,37 +253,91 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
             self.mems, len(self.roi[:, 0]), method="linear"
         )
 
-    def _fit_profile(self, profile: np.ndarray) -> tuple[float, float, float]:
+    def _de_args(self) -> dict:
+        """
+        Arguments for _fit_profiles_de (passed to worker processes instead of the whole class)
+        """
+        return {
+            "cytbg_itp": self.cytbg_itp,
+            "membg_itp": self.membg_itp,
+            "thickness_itp": self.thickness_itp,
+            "itp": self.itp,
+            "freedom": self.freedom,
+            "zerocap": self.zerocap,
+            "vectorized": self.vectorized,
+        }
+
+    def _fit_profiles_grid(
+        self, profiles: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Fits all profiles (columns of profiles) at once. For every candidate offset (integer slice index into
+        cytbg_itp/membg_itp, as searched by differential evolution), the cytoplasmic and membrane concentrations are
+        solved exactly as 2-parameter linear least squares problems (batched 2x2 normal equations) within the same
+        bounds that differential evolution uses, and the offset with the lowest error is chosen for each profile
+
+        """
+
+        # Candidate slice indices within the permitted freedom
+        lower = (self.thickness_itp / 2) * (1 - self.freedom)
+        upper = (self.thickness_itp / 2) * (1 + self.freedom)
+        slice_indices = np.arange(
+            max(int(lower), 0), min(int(upper), self.thickness_itp) + 1
+        )
+
+        # Reference curves for every candidate [candidates, thickness_itp]
+        indices = slice_indices[:, np.newaxis] + np.arange(self.thickness_itp)
+        cyt_curves = self.cytbg_itp[indices]
+        mem_curves = self.membg_itp[indices]
+
+        # Normal equation terms [candidates] and [candidates, profiles]
+        cc = np.sum(cyt_curves**2, axis=1)[:, np.newaxis]
+        mm = np.sum(mem_curves**2, axis=1)[:, np.newaxis]
+        cm = np.sum(cyt_curves * mem_curves, axis=1)[:, np.newaxis]
+        cp = cyt_curves @ profiles
+        mp = mem_curves @ profiles
+        pp = np.sum(profiles**2, axis=0)[np.newaxis, :]
+
+        def sse(c, m):
+            return pp - 2 * (c * cp + m * mp) + c**2 * cc + 2 * c * m * cm + m**2 * mm
+
+        def divide(a, b):
+            return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b > 0)
+
+        # Concentration bounds for each profile, as used by differential evolution [profiles]
+        pmax = np.max(profiles, axis=0)
         if self.zerocap:
-            bounds = (
-                (
-                    (self.thickness_itp / 2) * (1 - self.freedom),
-                    (self.thickness_itp / 2) * (1 + self.freedom),
-                ),
-                (0, max(2 * max(profile), 0)),
-                (0, max(2 * max(profile), 0)),
-            )
+            lo, hi = np.zeros_like(pmax), np.maximum(2 * pmax, 0)
         else:
-            bounds = (
-                (
-                    (self.thickness_itp / 2) * (1 - self.freedom),
-                    (self.thickness_itp / 2) * (1 + self.freedom),
-                ),
-                (-0.2 * max(profile), 2 * max(profile)),
-                (-0.2 * max(profile), 2 * max(profile)),
-            )
-        res = differential_evolution(self._mse, bounds=bounds, args=(profile,), tol=0.2)
-        o = (res.x[0] - self.thickness_itp / 2) / self.itp
-        return o, res.x[1], res.x[2]
-
-    def _mse(self, l_c_m: list, profile: np.ndarray) -> np.ndarray:
-        slice_index, c, m = l_c_m
-        y = (
-            c * self.cytbg_itp[int(slice_index) : int(slice_index) + self.thickness_itp]
-        ) + (
-            m * self.membg_itp[int(slice_index) : int(slice_index) + self.thickness_itp]
-        )
-        return np.mean((profile - y) ** 2)
+            lo = np.minimum(-0.2 * pmax, 2 * pmax)
+            hi = np.maximum(-0.2 * pmax, 2 * pmax)
+
+        # Unconstrained solution, only valid where the normal equations aren't (near-)singular
+        det = cc * mm - cm**2
+        singular = det <= 1e-12 * cc * mm
+        c = divide(mm * cp - cm * mp, np.where(singular, 0, det))
+        m = divide(cc * mp - cm * cp, np.where(singular, 0, det))
+
+        # Bounded solution: best of the feasible interior solution and the optimum along each edge of the box
+        candidates = [(c, m)]
+        for bound in (lo, hi):
+            fixed = np.broadcast_to(bound, cp.shape)
+            candidates.append((fixed, np.clip(divide(mp - bound * cm, mm), lo, hi)))
+            candidates.append((np.clip(divide(cp - bound * cm, cc), lo, hi), fixed))
+        errors = np.array([sse(_c, _m) for _c, _m in candidates])
+        feasible = ~singular & (c >= lo) & (c <= hi) & (m >= lo) & (m <= hi)
+        errors[0][~feasible] = np.inf
+        errors[np.isnan(errors)] = np.inf
+        best = np.argmin(errors, axis=0)
+        c = np.choose(best, [_c for _c, _ in candidates])
+        m = np.choose(best, [_m for _, _m in candidates])
+        errors = np.take_along_axis(errors, best[np.newaxis], axis=0)[0]
+
+        # Best offset for each profile
+        best = np.argmin(errors, axis=0)
+        positions = np.arange(profiles.shape[1])
+        o = (slice_indices[best] - self.thickness_itp / 2) / self.itp
+        return o, c[best, positions], m[best, positions]
 
     """
     Misc
@@ -257,19 +349,19 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
         Creates simulated images based on fit results
 
         """
-        for x in range(len(self.roi[:, 0])):
-            c = self.cyts_full[x]
-            m = self.mems_full[x]
-            slice_index = int(
-                self.offsets_full[x] * self.itp + (self.thickness_itp / 2)
-            )
-            self.straight_fit[:, x] = interp_1d_array(
-                (c * self.cytbg_itp[slice_index : slice_index + self.thickness_itp])
-                + (m * self.membg_itp[slice_index : slice_index + self.thickness_itp]),
-                self.thickness,
-                method=self.interp,
-            )
-            self.straight_resids[:, x] = self.straight[:, x] - self.straight_fit[:, x]
+        # Gather fitted profiles for all positions at once
+        slice_index = (self.offsets_full * self.itp + (self.thickness_itp / 2)).astype(
+            int
+        )
+        indices = slice_index[:, np.newaxis] + np.arange(self.thickness_itp)
+        profiles = (self.cyts_full[:, np.newaxis] * self.cytbg_itp[indices]) + (
+            self.mems_full[:, np.newaxis] * self.membg_itp[indices]
+        )
+
+        # Resample to thickness
+        operator = interp_matrix(self.thickness_itp, self.thickness, self.interp)
+        self.straight_fit = operator @ profiles.T
+        self.straight_resids = self.straight - self.straight_fit
 
     def _adjust_roi(self):
         """
@@ -323,16 +415,131 @@ class ImageQuantDifferentialEvolutionSingle(ImageQuantBase):
         # Simulated images
         self.straight = np.zeros([self.thickness, len(self.roi[:, 0])])
         self.straight_filtered = np.zeros([self.thickness, len(self.roi[:, 0])])
-        self.straight_fit = np.zeros([self.thickness, len(self.roi[:, 0])])
-        self.straight_resids = np.zeros([self.thickness, len(self.roi[:, 0])])
+        self.straight_fit = None
+        self.straight_resids = None
+
+
+def _fit_profiles_de(
+    profiles: np.ndarray,
+    cytbg_itp: np.ndarray,
+    membg_itp: np.ndarray,
+    thickness_itp: int,
+    itp: int,
+    freedom: float,
+    zerocap: bool,
+    vectorized: bool,
+    columns: slice = slice(None),
+) -> np.ndarray:
+    """
+    Fits profiles (columns of profiles) by differential evolution
+
+    Args:
+        columns: the columns of profiles to fit (so that workers can be given a whole memory-mapped array)
+
+    Returns:
+        numpy array [nprofiles, 3] of offsets, cytoplasmic and membrane concentrations
+    """
+    profiles = profiles[:, columns]
+    results = np.zeros([profiles.shape[1], 3])
+    for x in range(profiles.shape[1]):
+        profile = np.asarray(profiles[:, x])
+        if zerocap:
+            bounds = (
+                (
+                    (thickness_itp / 2) * (1 - freedom),
+                    (thickness_itp / 2) * (1 + freedom),
+                ),
+                (0, max(2 * max(profile), 0)),
+                (0, max(2 * max(profile), 0)),
+            )
+        else:
+            bounds = (
+                (
+                    (thickness_itp / 2) * (1 - freedom),
+                    (thickness_itp / 2) * (1 + freedom),
+                ),
+                (-0.2 * max(profile), 2 * max(profile)),
+                (-0.2 * max(profile), 2 * max(profile)),
+            )
+        args = (profile, cytbg_itp, membg_itp, thickness_itp)
+        if vectorized:
+            res = differential_evolution(
+                _mse_vectorized,
+                bounds=bounds,
+                args=args,
+                tol=0.2,
+                vectorized=True,
+                updating="deferred",
+            )
+        else:
+            res = differential_evolution(_mse, bounds=bounds, args=args, tol=0.2)
+        o = (res.x[0] - thickness_itp / 2) / itp
+        results[x] = o, res.x[1], res.x[2]
+    return results
+
+
+def _mse(
+    l_c_m: list,
+    profile: np.ndarray,
+    cytbg_itp: np.ndarray,
+    membg_itp: np.ndarray,
+    thickness_itp: int,
+) -> np.ndarray:
+    slice_index, c, m = l_c_m
+    y = (c * cytbg_itp[int(slice_index) : int(slice_index) + thickness_itp]) + (
+        m * membg_itp[int(slice_index) : int(slice_index) + thickness_itp]
+    )
+    return np.mean((profile - y) ** 2)
+
+
+def _mse_vectorized(
+    l_c_m: np.ndarray,
+    profile: np.ndarray,
+    cytbg_itp: np.ndarray,
+    membg_itp: np.ndarray,
+    thickness_itp: int,
+) -> np.ndarray:
+    """
+    Vectorised version of _mse, evaluating a whole population [3, S] at once
+    """
+    slice_index, c, m = np.reshape(l_c_m, (3, -1))
+    indices = slice_index.astype(int)[:, np.newaxis] + np.arange(thickness_itp)
+    y = (c[:, np.newaxis] * cytbg_itp[indices]) + (
+        m[:, np.newaxis] * membg_itp[indices]
+    )
+    return np.mean((profile - y) ** 2, axis=1)
+
+
+def _run_single(
+    iq: ImageQuantDifferentialEvolutionSingle,
+) -> ImageQuantDifferentialEvolutionSingle:
+    iq.run()
+    return iq
 
 
 class ImageQuantDifferentialEvolutionMulti(ImageQuantBase):
+    """
+    Differential evolution quantification of multiple images
+
+    Args:
+        img: numpy array of image or list of numpy arrays
+        roi: coordinates defining the cortex, or a list of arrays
+        verbose: if True, prints progress
+        parallel: if True, images are quantified in parallel on a pool of worker processes. Cores are split between
+            images and, if there are fewer images than cores, between chunks of profiles within each image. Images (and
+            straightened images, when split into chunks of profiles) are written to memory-mapped files that workers
+            read from, rather than being copied to each worker
+        cores: number of cores to use if parallel is True (if none will use all available)
+        **kwargs: passed to ImageQuantDifferentialEvolutionSingle
+    """
+
     def __init__(
         self,
         img: np.ndarray | list,
         roi: np.ndarray | list = None,
         verbose: bool = True,
+        parallel: bool = False,
+        cores: int | None = None,
         **kwargs,
     ):
         super().__init__(
@@ -341,11 +548,19 @@ class ImageQuantDifferentialEvolutionMulti(ImageQuantBase):
         )
         self.verbose = verbose
 
+        # Computation: split cores between images and profiles within images
+        self.parallel = parallel
+        self.cores = cores if cores is not None else multiprocessing.cpu_count()
+        self.image_jobs = min(self.cores, self.n) if self.parallel else 1
+        profile_cores = max(self.cores // self.image_jobs, 1)
+
         # Set up list of classes
         self.iq = [
             ImageQuantDifferentialEvolutionSingle(
                 img=i,
                 roi=r,
+                parallel=self.parallel and profile_cores > 1,
+                cores=profile_cores,
                 **kwargs,
             )
             for i, r in zip(self.img, self.roi)
@@ -355,26 +570,37 @@ class ImageQuantDifferentialEvolutionMulti(ImageQuantBase):
         t = time.time()
 
         # Run
-        for i, iq in enumerate(self.iq):
+        if self.image_jobs > 1:
             if self.verbose:
-                print(f"Quantifying image {i + 1} of {self.n}")
-            iq.run()
+                print(f"Quantifying {self.n} images on {self.image_jobs} processes")
+            # max_nbytes=0: every array (including each image) is memory-mapped rather than copied to workers
+            self.iq = Parallel(n_jobs=self.image_jobs, max_nbytes=0, mmap_mode="r")(
+                delayed(_run_single)(iq) for iq in self.iq
+            )
+        else:
+            for i, iq in enumerate(self.iq):
+                if self.verbose:
+                    print(f"Quantifying image {i + 1} of {self.n}")
+                iq.run()
 
         # Save membrane/cytoplasmic quantification, offsets
-        self.mems = [iq.mems for iq in self.iq]
-        self.cyts = [iq.cyts for iq in self.iq]
-        self.offsets = [iq.offsets for iq in self.iq]
-        self.mems_full = [iq.mems_full for iq in self.iq]
-        self.cyts_full = [iq.cyts_full for iq in self.iq]
-        self.offsets_full = [iq.offsets_full for iq in self.iq]
+        self.mems = RaggedArray.from_list([iq.mems for iq in self.iq])
+        self.cyts = RaggedArray.from_list([iq.cyts for iq in self.iq])
+        self.offsets = RaggedArray.from_list([iq.offsets for iq in self.iq])
+        self.mems_full = RaggedArray.from_list([iq.mems_full for iq in self.iq])
+        self.cyts_full = RaggedArray.from_list([iq.cyts_full for iq in self.iq])
+        self.offsets_full = RaggedArray.from_list([iq.offsets_full for iq in self.iq])
 
         # Save new ROIs
-        self.roi = [iq.roi for iq in self.iq]
+        self.roi = RaggedArray.from_list([iq.roi for iq in self.iq])
 
         # Save target/simulated/residuals images
-        self.straight_images = [iq.straight_filtered for iq in self.iq]
-        self.straight_images_sim = [iq.straight_fit for iq in self.iq]
-        self.straight_images_resids = [iq.straight_resids for iq in self.iq]
+        self.straight_images, self.straight_images_sim, self.straight_images_resids = (
+            RaggedArray.from_list([getattr(iq, attr) for iq in self.iq], axis=-1)
+            if getattr(self.iq[0], attr) is not None
+            else None
+            for attr in ["straight_filtered", "straight_fit", "straight_resids"]
+        )
 
         if self.verbose:
             print("Time elapsed: %.2f seconds " % (time.time() - t))
@@ -1,16 +1,20 @@
+import itertools
+import json
+import os
+from functools import partial
+
 import jax
 import jax.numpy as jnp
-import matplotlib.pyplot as plt
 import numpy as np
 import optax
 from jax.nn import sigmoid
+from jax import lax
 from scipy.special import erf
-from skimage.measure import block_reduce
-from tqdm import tqdm
 
 from .funcs import interp_2d_array, rolling_ave_2d, straighten
-from .roi import interp_roi, offset_coordinates
+from .roi import interp_roi_batch, offset_coordinates_batch
 from .model_base import ImageQuantBase
+from .ragged import RaggedArray
 
 """
 TODO:
@@ -36,6 +40,8 @@ class ImageQuantFlexi(ImageQuantBase):
         norm_factor=None,
         rol_ave=1,
         nfits=None,
+        bucket_shapes=True,
+        data_parallel=False,
     ):
         super().__init__(
             img=img,
@@ -56,6 +62,13 @@ class ImageQuantFlexi(ImageQuantBase):
         self.swish_factor = 30
         self.zerocap = zerocap
 
+        # Pad batch size and width up to shape buckets during optimisation, so that compiled programs are reused
+        # across batches of different sizes
+        self.bucket_shapes = bucket_shapes
+
+        # Split the batch (embryo axis) across all JAX devices during optimisation (see set_host_device_count)
+        self.data_parallel = data_parallel
+
         # Membrane/cytoplasmic reference profile
         self.cytbg = cytbg
         self.membg = membg
@@ -71,6 +84,8 @@ class ImageQuantFlexi(ImageQuantBase):
         self.cyts_opt = None
         self.cytbg_opt = None
         self.membg_opt = None
+        self._padded_batch = None
+        self._preprocessed = None
 
         # Calculate padded size
         self.padded_size = int(
@@ -82,99 +97,151 @@ class ImageQuantFlexi(ImageQuantBase):
 
     """
 
-    def segment(self, freedom=10, roi_knots=20, lr=0.01, descent_steps=500):
-        # Set up segmenter class
-        from .quantifier import ImageQuant
-
-        iq = ImageQuant(
-            img=self.img,
-            roi=self.roi,
-            periodic=True,
-            thickness=self.thickness,
-            rol_ave=5,
-            rotate=False,
-            nfits=100,
-            iterations=1,
-            lr=lr,
-            descent_steps=descent_steps,
-            adaptive_sigma=False,
-            batch_norm=False,
-            freedom=freedom,
-            roi_knots=roi_knots,
-            fit_outer=True,
-            save_training=False,
-            save_sims=False,
-            method="GD",
-            itp=10,
-            parallel=False,
-            zerocap=False,
-            cores=None,
-            bg_subtract=False,
-            interp="cubic",
-            sigma=3.5,
-        )
-
-        # Run segmentation
-        iq.run()
+    def segment(self, freedom=10, roi_knots=20, lr=0.01, descent_steps=500, sigma=3.5):
+        """
+        Refines ROIs by fitting a model in which the membrane position in each straightened image is offset by a
+        smooth (periodic cubic spline) function of position around the ROI, alongside free membrane, cytoplasmic and
+        outer concentrations at each position. The membrane and cytoplasmic profiles are Gaussian and error functions
+        with width sigma. ROIs are then shifted by the fitted offsets
 
-        # Save loss curves
-        self.losses = iq.iq.losses
+        Runs on the same preprocessed batch and compiled descent engine as quantify. Images are therefore preprocessed
+        with the model's own rol_ave and nfits settings (by default no rolling average or interpolation), rather than
+        the rol_ave=5, nfits=100 used when segmentation was run through the gradient descent model. Refined ROIs agree
+        with the gradient descent model to within a fraction of a pixel
 
-        # Offset coordinates and save
-        self.roi[:] = [
-            interp_roi(offset_coordinates(roi, offsets_full), periodic=True)
-            for roi, offsets_full in zip(iq.roi, iq.offsets_full)
-        ]
-        self.padded_size = max([r.shape[0] for r in self.roi])
+        Args:
+            freedom: maximum offset (pixels)
+            roi_knots: number of spline knots for the offsets
+            lr: learning rate
+            descent_steps: number of descent steps
+            sigma: width of the membrane and cytoplasmic profiles
 
-    def quantify(self, lr=0.005, descent_steps=600, save_interim=False):
+        """
         # Pre-process
         self._preprocess_batch()
 
-        # Init tensors
-        self._init_params()
+        # Offsets spline basis for each image (padded positions have zero weight)
+        n, width = self._padded_shape()
+        basis = np.zeros([n, width, roi_knots])
+        for i, mask in enumerate(np.asarray(self.masks)):
+            npoints = int(np.sum(mask))
+            basis[i, :npoints] = offsets_basis(roi_knots, npoints)
 
-        # Gradient descent
-        res_interim = self._gradient_descent_quantification(
-            lr=lr, descent_steps=descent_steps, save_interim=save_interim
+        # Parameters, initialised at zero
+        params = {
+            "offsets": jnp.zeros([n, roi_knots]),
+            "cyts": jnp.zeros([n, width]),
+            "mems": jnp.zeros([n, width]),
+            "outers": jnp.zeros([n, width]),
+        }
+        params = {key: self._shard(key, value) for key, value in params.items()}
+
+        # Scale gradients <- ensures training is invariant of batch size and pooling rate
+        grad_scales = {
+            key: float(self.n if key == "offsets" else self.n * self.padded_size)
+            for key in params
+        }
+
+        # Descent steps
+        target, masks, weights = self._padded_batch
+        params, losses, _ = adam_descent(
+            segmentation_loss,
+            params,
+            (self._shard("basis", basis), target, masks, weights, freedom, sigma),
+            grad_scales=grad_scales,
+            lr=lr,
+            descent_steps=descent_steps,
         )
+        self.losses = np.asarray(losses[:, : self.n]).T
 
-        # Store results
-        self._store()
+        # Offsets at every ROI point
+        knots = np.asarray(params["offsets"])[: self.n]
+        offsets = [
+            freedom * np.tanh(offsets_basis(roi_knots, r.shape[0]) @ k)
+            for r, k in zip(self.roi, knots)
+        ]
 
-        # Return interim simulations
-        if save_interim:
-            return res_interim
+        # Offset coordinates and save
+        self.roi = interp_roi_batch(
+            offset_coordinates_batch(self.roi, offsets), periodic=True
+        )
+        self.padded_size = int(
+            max([np.ceil(r.shape[0] / self.downsampling_rate) for r in self.roi])
+        )
 
-    def calibrate_cytoplasm(self, lr=0.005, descent_steps=600, save_interim=False):
-        # Pre-process
-        self._preprocess_batch()
+    def quantify(
+        self,
+        lr=0.005,
+        descent_steps=600,
+        save_interim=False,
+        interim_stride=1,
+        solver="GD",
+    ):
+        """
+        Quantifies membrane and cytoplasmic concentrations, with the reference profiles fixed
 
-        # Init tensors
-        self._init_params()
+        Args:
+            lr: learning rate (solver 'GD')
+            descent_steps: number of descent steps (solver 'GD')
+            save_interim: if True, returns interim parameters (solver 'GD')
+            interim_stride: save interim parameters every this many steps (solver 'GD')
+            solver: 'GD' for gradient descent, or 'lstsq' to solve for concentrations directly. As the simulated
+                images are linear in the concentrations, 'lstsq' finds the exact least squares solution in one step
+                (non-negative if zerocap is True) rather than approximating it by gradient descent
 
-        # Cytbg calibration
-        res_interim = self._gradient_descent_cytoplasm_calibration(
-            lr=lr, descent_steps=descent_steps, save_interim=save_interim
-        )
+        """
+        if solver == "lstsq":
+            self._preprocess_batch()
+            self._init_params()
+            self._solve_amplitudes()
+            self._store()
+        elif solver == "GD":
+            return self._run(
+                TRAINABLE["quantification"],
+                lr,
+                descent_steps,
+                save_interim,
+                interim_stride,
+            )
+        else:
+            raise ValueError('solver must be "GD" or "lstsq"')
 
-        # Store results
-        self._store()
+    def calibrate_cytoplasm(
+        self, lr=0.005, descent_steps=600, save_interim=False, interim_stride=1
+    ):
+        return self._run(
+            TRAINABLE["cytoplasm_calibration"],
+            lr,
+            descent_steps,
+            save_interim,
+            interim_stride,
+        )
 
-        # Return interim simulations
-        if save_interim:
-            return res_interim
+    def calibrate_membrane(
+        self, lr=0.005, descent_steps=600, save_interim=False, interim_stride=1
+    ):
+        return self._run(
+            TRAINABLE["membrane_calibration"],
+            lr,
+            descent_steps,
+            save_interim,
+            interim_stride,
+        )
 
-    def calibrate_membrane(self, lr=0.005, descent_steps=600, save_interim=False):
-        # Pre-process
+    def _run(self, trainable, lr, descent_steps, save_interim, interim_stride):
+        # Pre-process (reused if already done for the current images and ROIs)
         self._preprocess_batch()
 
         # Init tensors
         self._init_params()
 
-        # Cytbg calibration
-        res_interim = self._gradient_descent_membrane_calibration(
-            lr=lr, descent_steps=descent_steps, save_interim=save_interim
+        # Gradient descent
+        res_interim = self._descend(
+            trainable=trainable,
+            lr=lr,
+            descent_steps=descent_steps,
+            save_interim=save_interim,
+            interim_stride=interim_stride,
         )
 
         # Store results
@@ -189,207 +256,118 @@ class ImageQuantFlexi(ImageQuantBase):
     
     """
 
-    def _gradient_descent_quantification(self, lr, descent_steps, save_interim):
-        # Initialisation
-        opt = optax.adam(learning_rate=lr)  # Set up optimiser
-        params = {
-            "cyts_opt": self.cyts_opt,
-            "mems_opt": self.mems_opt,
-        }  # Create params list
-        opt_state = opt.init(params)  # Set up optimiser initial state
-        self.losses = np.zeros([self.n, descent_steps])  # Create empty losses array
-
-        # Store initial values
-        if save_interim:
-            params_interim = {
-                "cyts": [
-                    params["cyts_opt"],
-                ],
-                "mems": [
-                    params["mems_opt"],
-                ],
-            }
-
-        # Define loss function
-        @jax.jit
-        def loss_function(_params):
-            sim = sim_img_batch(
-                _params["cyts_opt"],
-                _params["mems_opt"],
-                self.cytbg_opt,
-                self.membg_opt,
-                self.zerocap,
-                self.swish_factor,
-            )
-            loss_full = masked_loss_function(sim, self.target, self.masks)
-            return jnp.mean(loss_full), loss_full
-
-        # Descent steps
-        func_grad = jax.grad(loss_function, has_aux=True)
-        for e in tqdm(range(descent_steps)):
-            # Calculate gradients
-            grads, losses_full = func_grad(params)
-            self.losses[:, e] = losses_full
-
-            # Scale gradients <- ensures training is invariant of batch size and pooling rate
-            grads["cyts_opt"] *= self.n
-            grads["mems_opt"] *= self.n * self.padded_size
-
-            # Update parameters
-            updates, opt_state = opt.update(grads, opt_state, params)
-            params = optax.apply_updates(params, updates)
-
-            # Save interim parameters
-            if save_interim:
-                params_interim["cyts"].append(params["cyts_opt"])
-                params_interim["mems"].append(params["mems_opt"])
+    def _descend(self, trainable, lr, descent_steps, save_interim, interim_stride):
+        """
+        Optimises the trainable parameters by gradient descent (see adam_descent), keeping the others fixed
 
-        # Save optimised parameters
-        self.cyts_opt = params["cyts_opt"]
-        self.mems_opt = params["mems_opt"]
+        All parameters are always passed to the optimiser, and frozen parameters are given a gradient scale of zero,
+        so every mode (quantification and calibration) runs the same compiled program with the same optimiser state
+        layout. Data is padded to the bucketed batch size and width (padded images are given zero weight and padded
+        positions are masked), so that batches of similar shape also share a program
 
-        # Return interim parameters
-        if save_interim:
-            return params_interim
-        else:
-            return None
+        With data_parallel, images and their concentrations are sharded along the batch axis across devices, and
+        reference profiles are replicated. The mean loss and the gradients of the reference profiles are then computed
+        by cross-device reductions, so results are the same as on a single device
 
-    def _gradient_descent_membrane_calibration(self, lr, descent_steps, save_interim):
-        self.losses = np.zeros([self.n, descent_steps])  # Create empty losses array
-
-        # Initialisation
-        opt = optax.adam(learning_rate=lr)  # Set up optimiser
+        """
+        # Pad parameters
+        n, width = self._padded_shape()
         params = {
-            "cyts_opt": self.cyts_opt,
-            "mems_opt": self.mems_opt,
-            "membg_opt": self.membg_opt,
-        }  # Create params list
-        opt_state = opt.init(params)  # Set up optimiser initial state
-        self.losses = np.zeros([self.n, descent_steps])  # Create empty losses array
-
-        # Store initial values
-        if save_interim:
-            params_interim = {
-                "cyts": [
-                    params["cyts_opt"],
-                ],
-                "mems": [
-                    params["mems_opt"],
-                ],
-                "membg": [
-                    params["membg_opt"],
-                ],
-            }
-
-        # Define loss function
-        @jax.jit
-        def loss_function(params):
-            sim = sim_img_batch(
-                params["cyts_opt"],
-                params["mems_opt"],
-                self.cytbg_opt,
-                params["membg_opt"],
-                self.zerocap,
-                self.swish_factor,
-            )
-            loss_full = masked_loss_function(sim, self.target, self.masks)
-            return jnp.mean(loss_full), loss_full
+            key: self._shard(key, _pad_param(key, getattr(self, key), n, width))
+            for key in PARAMS
+        }
+
+        # Scale gradients <- ensures training is invariant of batch size and pooling rate
+        scales = {
+            "cyts_opt": self.n,
+            "mems_opt": self.n * self.padded_size,
+            "cytbg_opt": 1,
+            "membg_opt": 1,
+        }
+        grad_scales = {
+            key: float(scales[key] if key in trainable else 0) for key in PARAMS
+        }
 
         # Descent steps
-        func_grad = jax.grad(loss_function, has_aux=True)
-        for e in tqdm(range(descent_steps)):
-            # Calculate gradients
-            grads, losses_full = func_grad(params)
-            self.losses[:, e] = losses_full
-
-            # Scale gradients
-            grads["cyts_opt"] *= self.n
-            grads["mems_opt"] *= self.n * self.padded_size
-
-            # Update parameters
-            updates, opt_state = opt.update(grads, opt_state, params)
-            params = optax.apply_updates(params, updates)
-
-            # Save interim parameters
-            if save_interim:
-                params_interim["cyts"].append(params["cyts_opt"])
-                params_interim["mems"].append(params["mems_opt"])
-                params_interim["membg"].append(params["membg_opt"])
-
-        # Save optimised parameters
-        self.cyts_opt = params["cyts_opt"]
-        self.mems_opt = params["mems_opt"]
-        self.membg_opt = params["membg_opt"]
+        params, losses, interim = adam_descent(
+            batch_loss,
+            params,
+            (*self._padded_batch, self.swish_factor),
+            grad_scales=grad_scales,
+            lr=lr,
+            descent_steps=descent_steps,
+            interim_stride=interim_stride if save_interim else None,
+            static=(self.zerocap,),
+        )
+
+        # Save optimised parameters and losses (removing padding)
+        for key in trainable:
+            setattr(self, key, _crop_param(key, params[key], self.n, self.padded_size))
+        self.losses = np.asarray(losses[:, : self.n]).T
 
         # Return interim parameters
         if save_interim:
-            return params_interim
+            return {
+                key[:-4]: np.asarray(
+                    _crop_param(key, interim[key], self.n, self.padded_size, axis=1)
+                )
+                for key in trainable
+            }
         else:
             return None
 
-    def _gradient_descent_cytoplasm_calibration(self, lr, descent_steps, save_interim):
-        # Initialisation
-        opt = optax.adam(learning_rate=lr)  # Set up optimiser
-        params = {
-            "cyts_opt": self.cyts_opt,
-            "cytbg_opt": self.cytbg_opt,
-        }  # Create params list
-        opt_state = opt.init(params)  # Set up optimiser initial state
-        self.losses = np.zeros([self.n, descent_steps])  # Create empty losses array
-
-        # Store initial values
-        if save_interim:
-            params_interim = {
-                "cyts": [
-                    params["cyts_opt"],
-                ],
-                "cytbg": [
-                    params["cytbg_opt"],
-                ],
-            }
+    def _solve_amplitudes(self):
+        """
+        Solves for cytoplasmic and membrane concentrations directly (see solve_amplitudes). With zerocap, parameters
+        are stored as the inverse of the swish transform of the solution, so that _store recovers the solution
 
-        # Define loss function
-        @jax.jit
-        def loss_function(_params):
-            sim = sim_img_batch(
-                _params["cyts_opt"],
-                self.mems_opt,
-                _params["cytbg_opt"],
-                self.membg_opt,
-                self.zerocap,
-                self.swish_factor,
+        """
+        cyts, mems = solve_amplitudes(
+            self.target, self.masks, self.cytbg_opt, self.membg_opt, self.zerocap
+        )
+        if self.zerocap:
+            cyts, mems = (
+                inverse_swish(cyts, self.swish_factor),
+                inverse_swish(mems, self.swish_factor),
             )
-            loss_full = masked_loss_function(sim, self.target, self.masks)
-            return jnp.mean(loss_full), loss_full
-
-        # Descent steps
-        func_grad = jax.grad(loss_function, has_aux=True)
-        for e in tqdm(range(descent_steps)):
-            # Calculate gradients
-            grads, losses_full = func_grad(params)
-            self.losses[:, e] = losses_full
-
-            # Scale gradients
-            grads["cyts_opt"] *= self.n
+        self.cyts_opt, self.mems_opt = jnp.array(cyts), jnp.array(mems)
 
-            # Update parameters
-            updates, opt_state = opt.update(grads, opt_state, params)
-            params = optax.apply_updates(params, updates)
+        # Final loss for each image
+        sim = sim_img_batch(
+            self.cyts_opt,
+            self.mems_opt,
+            self.cytbg_opt,
+            self.membg_opt,
+            self.zerocap,
+            self.swish_factor,
+        )
+        self.losses = np.asarray(masked_loss_function(sim, self.target, self.masks))[
+            :, np.newaxis
+        ]
 
-            # Save interim parameters
-            if save_interim:
-                params_interim["cyts"].append(params["cyts_opt"])
-                params_interim["cytbg"].append(params["cytbg_opt"])
+    def _padded_shape(self):
+        n, width = self.n, self.padded_size
+        if self.bucket_shapes:
+            n, width = bucket_size(n), bucket_size(width)
+        if self.data_parallel:
+            # Batch must divide evenly between devices
+            n = -(-n // jax.device_count()) * jax.device_count()
+        return n, width
 
-        # Save optimised parameters
-        self.cyts_opt = params["cyts_opt"]
-        self.cytbg_opt = params["cytbg_opt"]
+    def _shard(self, key, value):
+        """
+        Places an array on devices: split along the batch axis if it has one, otherwise replicated
 
-        # Return interim parameters
-        if save_interim:
-            return params_interim
-        else:
-            return None
+        """
+        if not self.data_parallel:
+            return value
+        mesh = jax.sharding.Mesh(np.array(jax.devices()), ("batch",))
+        spec = (
+            jax.sharding.PartitionSpec("batch")
+            if key in BATCHED
+            else jax.sharding.PartitionSpec()
+        )
+        return jax.device_put(value, jax.sharding.NamedSharding(mesh, spec))
 
     """
     Preprocessing
@@ -432,6 +410,8 @@ class ImageQuantFlexi(ImageQuantBase):
                     axis=1,
                 )
                 straight = np.concatenate((straight, pad), axis=1)
+            from skimage.measure import block_reduce
+
             straight = block_reduce(straight, (1, self.downsampling_rate), np.mean)
 
         # Pad to size of largest image
@@ -450,6 +430,23 @@ class ImageQuantFlexi(ImageQuantBase):
         return target, norm, mask
 
     def _preprocess_batch(self):
+        # Reuse preprocessed batch if images, ROIs and preprocessing settings are unchanged
+        settings = (
+            self.thickness,
+            self.rol_ave,
+            self.nfits,
+            self.downsampling_rate,
+            self.batch_norm,
+            self.norm_factor,
+            self.padded_size,
+            self.bucket_shapes,
+            self.data_parallel,
+        )
+        if self._preprocessed is not None:
+            img, roi, _settings = self._preprocessed
+            if img is self.img and roi is self.roi and _settings == settings:
+                return
+
         # Preprocess
         target, norms, masks = zip(
             *[
@@ -470,6 +467,15 @@ class ImageQuantFlexi(ImageQuantBase):
             self.target /= norm
             self.norms = norm * np.ones(self.target.shape[0])
 
+        # Padded copy of the batch for optimisation (target, masks, weights)
+        n, width = self._padded_shape()
+        self._padded_batch = (
+            self._shard("target", _pad_batch(_pad_width(self.target, width), n)),
+            self._shard("masks", _pad_batch(_pad_width(self.masks, width), n)),
+            self._shard("weights", _pad_batch(jnp.ones(self.n), n)),
+        )
+        self._preprocessed = (self.img, self.roi, settings)
+
     """
     Simulation
     
@@ -548,10 +554,58 @@ class ImageQuantFlexi(ImageQuantBase):
                 for c, mask, norm in zip(self.cyts_opt, self.masks, self.norms)
             ]
 
+        # Store results as ragged arrays
+        self.mems, self.cyts = (
+            RaggedArray.from_list(data) for data in [self.mems, self.cyts]
+        )
+        self.straight_images, self.straight_images_sim = (
+            RaggedArray.from_list(data, axis=-1)
+            for data in [self.straight_images, self.straight_images_sim]
+        )
+
         # Reference profiles
         self.cytbg = self.cytbg_opt
         self.membg = self.membg_opt
 
+    """
+    Calibration
+    
+    """
+
+    def save_calibration(self, path: str):
+        """
+        Saves a calibration artefact (.npz): the reference profiles, together with the preprocessing settings and
+        normalisation factor they were calibrated with, so that they can be applied to other datasets (see
+        load_calibration and quantify_stream)
+
+        Args:
+            path: path of the file to save
+
+        """
+        if self.cytbg is None or self.membg is None:
+            raise ValueError("No reference profiles to save, run a calibration first")
+
+        # Use the batch normalisation factor from calibration, so that later datasets are normalised the same way
+        norm_factor = self.norm_factor
+        if self.batch_norm and norm_factor is None and self.norms is not None:
+            norm_factor = float(self.norms[0])
+
+        settings = {
+            "thickness": self.thickness,
+            "batch_norm": self.batch_norm,
+            "zerocap": self.zerocap,
+            "pooling_rate": self.downsampling_rate,
+            "norm_factor": norm_factor,
+            "rol_ave": self.rol_ave,
+            "nfits": self.nfits,
+        }
+        np.savez(
+            path,
+            cytbg=np.asarray(self.cytbg),
+            membg=np.asarray(self.membg),
+            settings=json.dumps(settings),
+        )
+
     """
     Interactive
     
@@ -564,6 +618,8 @@ class ImageQuantFlexi(ImageQuantBase):
         Args:
             log: if True, plot the logarithm of losses
         """
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         losses = np.log10(self.losses.T) if log else self.losses.T
         ylabel = "log10(Mean square error)" if log else "Mean square error"
@@ -573,6 +629,425 @@ class ImageQuantFlexi(ImageQuantBase):
         return fig, ax
 
 
+def load_calibration(path: str) -> dict:
+    """
+    Loads a calibration artefact saved with ImageQuantFlexi.save_calibration
+
+    Args:
+        path: path of the file
+
+    Returns:
+        dictionary of keyword arguments for ImageQuantFlexi (reference profiles and preprocessing settings)
+
+    """
+    with np.load(path) as f:
+        calibration = json.loads(str(f["settings"]))
+        calibration["cytbg"] = f["cytbg"]
+        calibration["membg"] = f["membg"]
+    return calibration
+
+
+def quantify_stream(
+    pairs, calibration, chunk_size=64, ids=None, bucket_shapes=True, **kwargs
+):
+    """
+    Quantifies a stream of images with calibrated reference profiles, in chunks of at most chunk_size images. Images
+    are only loaded/preprocessed one chunk at a time, so memory use is bounded by the chunk size rather than the size
+    of the dataset, and (with bucket_shapes) chunks of similar shape reuse the same compiled program
+
+    Args:
+        pairs: iterable of (image, roi) pairs. Can be a generator (e.g. loading images from disk lazily)
+        calibration: calibration artefact (path, or dictionary returned by load_calibration)
+        chunk_size: maximum number of images to quantify at once
+        ids: optional iterable of embryo ids (one per image). If not specified, results will be indexed by frame
+            (counting from the start of the stream)
+        bucket_shapes: see ImageQuantFlexi
+        **kwargs: passed to ImageQuantFlexi.quantify (e.g. solver='lstsq')
+
+    Yields:
+        pandas dataframe of results for each chunk (see compile_res)
+
+    """
+    if not isinstance(calibration, dict):
+        calibration = load_calibration(calibration)
+    pairs = iter(pairs)
+    ids = iter(ids) if ids is not None else None
+
+    start = 0
+    while True:
+        chunk = list(itertools.islice(pairs, chunk_size))
+        if not chunk:
+            return
+        imgs, rois = zip(*chunk)
+        iq = ImageQuantFlexi(
+            img=list(imgs),
+            roi=list(rois),
+            bucket_shapes=bucket_shapes,
+            **calibration,
+        )
+        iq.quantify(**kwargs)
+
+        # Results, indexed by position in the stream
+        if ids is not None:
+            res = iq.compile_res(ids=list(itertools.islice(ids, len(chunk))))
+        else:
+            res = iq.compile_res()
+            res["Frame"] += start
+        start += len(chunk)
+        yield res
+
+
+# Parameters of the model, those that are trained in each mode, and arrays with a batch axis (model and
+# segmentation parameters and data)
+PARAMS = ("cyts_opt", "mems_opt", "cytbg_opt", "membg_opt")
+BATCHED = (
+    "cyts_opt",
+    "mems_opt",
+    "target",
+    "masks",
+    "weights",
+    "offsets",
+    "cyts",
+    "mems",
+    "outers",
+    "basis",
+)
+TRAINABLE = {
+    "quantification": ("cyts_opt", "mems_opt"),
+    "cytoplasm_calibration": ("cyts_opt", "cytbg_opt"),
+    "membrane_calibration": ("cyts_opt", "mems_opt", "membg_opt"),
+}
+
+
+def enable_compilation_cache(path: str | None = None):
+    """
+    Enables the persistent (on-disk) JAX compilation cache, so that compiled optimisation programs are reused across
+    processes and sessions rather than compiled again in every new worker
+
+    Args:
+        path: directory to store compiled programs in. Defaults to ~/.cache/par_segmentation/jax
+
+    """
+    if path is None:
+        path = os.path.join(
+            os.path.expanduser("~"), ".cache", "par_segmentation", "jax"
+        )
+    jax.config.update("jax_compilation_cache_dir", str(path))
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0)
+
+
+def set_host_device_count(n: int):
+    """
+    Splits the CPU into n XLA host devices, so that data_parallel models can shard batches across cores. Must be
+    called before JAX is first used (i.e. before any arrays are created or models are run)
+
+    Args:
+        n: number of devices
+
+    """
+    try:
+        jax.config.update("jax_num_cpu_devices", n)
+    except AttributeError:
+        # Older JAX versions (before jax_num_cpu_devices was added): XLA flag, read when the CPU backend is initialised
+        flags = [
+            flag
+            for flag in os.environ.get("XLA_FLAGS", "").split()
+            if not flag.startswith("--xla_force_host_platform_device_count")
+        ]
+        flags.append(f"--xla_force_host_platform_device_count={n}")
+        os.environ["XLA_FLAGS"] = " ".join(flags)
+
+
+def bucket_size(size: int) -> int:
+    """
+    Rounds size up to the nearest shape bucket (powers of two, and 1.5 times powers of two), so that at most ~1/3 of
+    a padded array is padding
+
+    """
+    bucket = 1
+    while bucket < size:
+        if bucket >= 2 and bucket * 3 // 2 >= size:
+            return bucket * 3 // 2
+        bucket *= 2
+    return bucket
+
+
+def _pad_batch(array, n):
+    return jnp.pad(array, [(0, n - array.shape[0])] + [(0, 0)] * (array.ndim - 1))
+
+
+def _pad_width(array, width):
+    return jnp.pad(array, [(0, 0)] * (array.ndim - 1) + [(0, width - array.shape[-1])])
+
+
+def _pad_param(key, value, n, width):
+    value = jnp.asarray(value)
+    if key == "mems_opt":
+        return _pad_batch(_pad_width(value, width), n)
+    if key == "cyts_opt":
+        return _pad_batch(value, n)
+    return value
+
+
+def _crop_param(key, value, n, width, axis=0):
+    if key == "mems_opt":
+        return value[(slice(None),) * axis + (slice(n), slice(width))]
+    if key == "cyts_opt":
+        return value[(slice(None),) * axis + (slice(n),)]
+    return value
+
+
+def batch_loss(params, target, masks, weights, swish_factor, zerocap):
+    """
+    Mean loss over a batch of images (weighted, so that padded images can be excluded), and the loss for each image
+
+    Args:
+        params: dictionary of parameters (cyts_opt, mems_opt, cytbg_opt, membg_opt)
+        target: target images [nimgs, thickness, width]
+        masks: masks of valid positions [nimgs, width]
+        weights: weight of each image in the mean loss [nimgs]
+        swish_factor: swish factor for zerocap
+        zerocap: if True, prevents negative membrane and cytoplasm values
+
+    """
+    sim = sim_img_batch(
+        params["cyts_opt"],
+        params["mems_opt"],
+        params["cytbg_opt"],
+        params["membg_opt"],
+        zerocap,
+        swish_factor,
+    )
+    loss_full = masked_loss_function(sim, target, masks)
+    return jnp.sum(loss_full * weights) / jnp.sum(weights), loss_full
+
+
+def segmentation_loss(params, basis, target, masks, weights, freedom, sigma):
+    """
+    Mean loss of the segmentation model over a batch of images, and the loss for each image
+
+    Args:
+        params: dictionary of parameters: offsets (spline knots [nimgs, roi_knots]), and cyts, mems and outers
+            (concentrations at each position [nimgs, width])
+        basis: offsets spline basis for each image [nimgs, width, roi_knots] (see offsets_basis)
+        target: target images [nimgs, thickness, width]
+        masks: masks of valid positions [nimgs, width]
+        weights: weight of each image in the mean loss [nimgs]
+        freedom: maximum offset (pixels)
+        sigma: width of the membrane and cytoplasmic profiles
+
+    """
+    thickness = target.shape[1]
+
+    # Offsets, constrained to +/- freedom
+    offsets = freedom * jnp.tanh(jnp.einsum("nwk,nk->nw", basis, params["offsets"]))
+
+    # Positions to evaluate membrane and cytoplasmic curves [nimgs, thickness, width], capped off edge
+    positions = jnp.arange(thickness)[jnp.newaxis, :, jnp.newaxis] + jnp.expand_dims(
+        offsets, 1
+    )
+    positions = jnp.clip(positions, 0, thickness - 1.000001) - thickness / 2
+
+    # Membrane and cytoplasmic curves
+    mem_curve = jnp.exp(-(positions**2) / (2 * sigma**2))
+    cyt_curve = (1 + jax.scipy.special.erf(positions / (sigma * (2**0.5)))) / 2
+
+    # Simulate images
+    cyts, mems, outers = (
+        jnp.expand_dims(params[key], 1) for key in ["cyts", "mems", "outers"]
+    )
+    sim = outers + cyt_curve * (cyts - outers) + mem_curve * mems
+
+    loss_full = masked_loss_function(sim, target, masks)
+    return jnp.sum(loss_full * weights) / jnp.sum(weights), loss_full
+
+
+def offsets_basis(roi_knots: int, npoints: int) -> np.ndarray:
+    """
+    Basis matrix of the periodic uniform cubic B-spline used for offsets, such that offsets_basis(roi_knots, npoints)
+    @ knots evaluates the spline through roi_knots knots at npoints evenly spaced positions around the ROI
+
+    Args:
+        roi_knots: number of knots
+        npoints: number of positions
+
+    Returns:
+        numpy array [npoints, roi_knots]
+
+    """
+    positions = np.linspace(0, roi_knots, npoints + 1)[:-1]
+    segment = np.floor(positions).astype(int)
+    t = positions - segment
+    weights = np.stack(
+        [
+            (1 - t) ** 3 / 6,
+            (3 * t**3 - 6 * t**2 + 4) / 6,
+            (-3 * t**3 + 3 * t**2 + 3 * t + 1) / 6,
+            t**3 / 6,
+        ],
+        axis=-1,
+    )
+    basis = np.zeros([npoints, roi_knots])
+    for r in range(4):
+        np.add.at(
+            basis, (np.arange(npoints), (segment + r - 1) % roi_knots), weights[:, r]
+        )
+    return basis
+
+
+@partial(
+    jax.jit,
+    static_argnames=("loss_function", "static", "descent_steps", "interim_stride"),
+)
+def adam_descent(
+    loss_function,
+    params,
+    data,
+    grad_scales,
+    lr,
+    descent_steps,
+    interim_stride=None,
+    static=(),
+):
+    """
+    Runs gradient descent with the Adam optimiser. The whole optimisation is compiled as a single XLA program
+    (lax.scan over descent steps), with losses accumulated on device. Data is passed as arguments, so the compiled
+    program is reused for any data of the same shape. Parameters are frozen by giving them a gradient scale of zero
+    (Adam then leaves them unchanged), so the same program serves any choice of trainable parameters
+
+    Args:
+        loss_function: module-level function loss_function(params, *data, *static), returning the mean loss and the
+            loss for each image (e.g. batch_loss, segmentation_loss)
+        params: dictionary of initial parameters
+        data: tuple of arrays (and other traced arguments) passed to loss_function
+        grad_scales: dictionary of factors to multiply the gradients of each parameter by (0 for frozen parameters)
+        lr: learning rate
+        descent_steps: number of descent steps
+        interim_stride: if not None, parameters are saved every interim_stride steps (including the initial
+            parameters). The final parameters are always saved last, also if interim_stride doesn't divide
+            descent_steps
+        static: tuple of hashable arguments passed to loss_function at compile time
+
+    Returns:
+        optimised parameters, losses [descent_steps, nimgs], and a dictionary of interim parameters (stacked along the
+        first axis) or None
+
+    """
+    opt = optax.adam(learning_rate=lr)
+    func_grad = jax.grad(loss_function, has_aux=True)
+
+    def step(carry, _):
+        _params, opt_state = carry
+        grads, losses_full = func_grad(_params, *data, *static)
+        grads = {key: grad * grad_scales[key] for key, grad in grads.items()}
+        updates, opt_state = opt.update(grads, opt_state, _params)
+        return (optax.apply_updates(_params, updates), opt_state), losses_full
+
+    def chunk(carry, _):
+        carry, losses = lax.scan(step, carry, None, length=interim_stride)
+        return carry, (losses, carry[0])
+
+    carry = (params, opt.init(params))
+    if interim_stride is None:
+        (params, _), losses = lax.scan(step, carry, None, length=descent_steps)
+        return params, losses, None
+
+    # Save parameters at the end of each chunk of interim_stride steps
+    nchunks, remainder = divmod(descent_steps, interim_stride)
+    carry, (losses, interim) = lax.scan(chunk, carry, None, length=nchunks)
+    losses = losses.reshape((-1,) + losses.shape[2:])
+    snapshots = [params, interim]
+    if remainder:
+        carry, losses_remainder = lax.scan(step, carry, None, length=remainder)
+        losses = jnp.concatenate([losses, losses_remainder])
+        snapshots = [params, interim, carry[0]]
+    interim = jax.tree_util.tree_map(
+        lambda p0, p, *p1: jnp.concatenate(
+            [p0[jnp.newaxis], p] + [p_[jnp.newaxis] for p_ in p1]
+        ),
+        *snapshots,
+    )
+    return carry[0], losses, interim
+
+
+def solve_amplitudes(target, masks, cytbg, membg, zerocap, iterations=100):
+    """
+    Finds the cytoplasmic concentration of each image and the membrane concentration at each position that minimise
+    the masked squared error between target and the simulated images (sim_img_batch without swish), with the
+    reference profiles fixed
+
+    Without zerocap this is solved in closed form: the membrane concentration at each position has a closed form
+    solution given the cytoplasmic concentration, and substituting it leaves a linear problem in the cytoplasmic
+    concentration. With zerocap, membrane concentrations are clipped at zero and the (convex, piecewise quadratic)
+    error is minimised over the non-negative cytoplasmic concentration by bisection on its derivative
+
+    Args:
+        target: target images [nimgs, thickness, width]
+        masks: masks of valid positions [nimgs, width]
+        cytbg: cytoplasmic reference profile [thickness]
+        membg: membrane reference profile [thickness]
+        zerocap: if True, concentrations are constrained to be non-negative
+        iterations: number of bisection steps (zerocap only)
+
+    Returns:
+        cytoplasmic concentrations [nimgs], membrane concentrations [nimgs, width] (zero at masked positions)
+
+    """
+    y = np.asarray(target, dtype=np.float64)
+    w = np.asarray(masks, dtype=np.float64)
+    a = np.asarray(cytbg, dtype=np.float64)
+    b = np.asarray(membg, dtype=np.float64)
+
+    # Projections of each profile onto the reference profiles
+    ay, by = np.einsum("t,ntw->nw", a, y), np.einsum("t,ntw->nw", b, y)
+    aa, ab, bb = a @ a, a @ b, b @ b
+    nvalid = np.sum(w, axis=1)
+
+    if not zerocap:
+        c = np.sum(w * (ay - ab * by / bb), axis=1) / (nvalid * (aa - ab**2 / bb))
+        m = (by - c[:, np.newaxis] * ab) / bb
+        return c, m * w
+
+    def mems(_c):
+        return np.maximum((by - _c[:, np.newaxis] * ab) / bb, 0)
+
+    def derivative(_c):
+        return np.sum(w * (_c[:, np.newaxis] * aa + mems(_c) * ab - ay), axis=1)
+
+    # Bracket the minimum (derivative is increasing in c)
+    lower = np.zeros(y.shape[0])
+    upper = np.maximum(np.sum(w * ay, axis=1) / (nvalid * aa), 1e-12)
+    for _ in range(64):
+        increase = derivative(upper) < 0
+        if not np.any(increase):
+            break
+        upper = np.where(increase, 2 * upper, upper)
+
+    # Bisection (c = 0 if the derivative is non-negative there)
+    for _ in range(iterations):
+        mid = (lower + upper) / 2
+        positive = derivative(mid) > 0
+        lower, upper = np.where(positive, lower, mid), np.where(positive, mid, upper)
+    c = np.where(derivative(np.zeros(y.shape[0])) >= 0, 0, (lower + upper) / 2)
+    return c, mems(c) * w
+
+
+def inverse_swish(y, swish_factor, iterations=50):
+    """
+    Inverts the swish transform used for zerocap (x * sigmoid(swish_factor * x)) for non-negative y, by Newton's
+    method
+
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.maximum(y, 0)
+    for _ in range(iterations):
+        s = 1 / (1 + np.exp(-swish_factor * x))
+        f = x * s - y
+        df = s + swish_factor * x * s * (1 - s)
+        x = np.maximum(x - f / df, 0)
+    return x
+
+
 def sim_img_batch(cyts, mems, cytbg, membg, zerocap, swish_factor):
     """
     [nimgs, thickness, nfits]
@@ -613,9 +1088,9 @@ def sim_img_batch(cyts, mems, cytbg, membg, zerocap, swish_factor):
 
 def masked_loss_function(sim, target, masks):
     sq_errors = (sim - target) ** 2  # calculate errors
-    mse = jnp.sum(sq_errors * jnp.expand_dims(masks, 1), axis=[1, 2]) / jnp.sum(
-        masks, axis=1
-    )  # masked average
+    mse = jnp.sum(sq_errors * jnp.expand_dims(masks, 1), axis=[1, 2]) / jnp.maximum(
+        jnp.sum(masks, axis=1), 1
+    )  # masked average (padded images with no valid positions give zero)
     return mse
 
 
@@ -1,12 +1,13 @@
+import itertools
 import time
 
-import matplotlib.pyplot as plt
 import numpy as np
 import tensorflow as tf
 from scipy.interpolate import interp1d
 from tqdm import tqdm
 
 from ._tgf_interpolate import interpolate
+from .cache import embryo_results, set_results
 from .funcs import (
     interp_1d_array,
     interp_2d_array,
@@ -14,8 +15,14 @@ from .funcs import (
     rotate_roi,
     straighten,
 )
-from .roi import interp_roi, offset_coordinates
+from .roi import (
+    interp_roi,
+    interp_roi_batch,
+    offset_coordinates,
+    offset_coordinates_batch,
+)
 from .model_base import ImageQuantBase
+from .ragged import RaggedArray
 
 """
 TODO:
@@ -47,7 +54,41 @@ class ImageQuantGradientDescent(ImageQuantBase):
         save_training: bool = False,
         save_sims: bool = False,
         verbose: bool = True,
+        track: bool = False,
+        track_freedom: float = 10,
+        track_iterations: int = 1,
+        track_descent_steps: int = 100,
+        drift_threshold: float = 0.6,
+        drift_loss_ratio: float = 1.5,
     ):
+        # Settings, used to set up a model for each frame in tracking mode
+        settings = {
+            "sigma": sigma,
+            "periodic": periodic,
+            "thickness": thickness,
+            "rol_ave": rol_ave,
+            "rotate": rotate,
+            "nfits": nfits,
+            "iterations": iterations,
+            "lr": lr,
+            "descent_steps": descent_steps,
+            "adaptive_sigma": adaptive_sigma,
+            "batch_norm": batch_norm,
+            "freedom": freedom,
+            "roi_knots": roi_knots,
+            "fit_outer": fit_outer,
+            "zerocap": zerocap,
+            "save_training": save_training,
+            "save_sims": save_sims,
+            "verbose": verbose,
+            "track": track,
+            "track_freedom": track_freedom,
+            "track_iterations": track_iterations,
+            "track_descent_steps": track_descent_steps,
+            "drift_threshold": drift_threshold,
+            "drift_loss_ratio": drift_loss_ratio,
+        }
+
         super().__init__(
             img=img,
             roi=roi,
@@ -78,6 +119,28 @@ class ImageQuantGradientDescent(ImageQuantBase):
         self.save_sims = save_sims
         self.verbose = verbose
 
+        # Initial values of fitted variables (see quantify_stream), zero if None
+        self.warm_start = None
+
+        # Tracking mode: frames of a timelapse are fitted in order, each starting from the previous frame's refined ROI
+        # (only the first ROI is used) with reduced freedom, iterations and descent steps. A tracked fit can only move
+        # the ROI by a limited amount (its reach): Adam moves the offset knots by at most ~lr per step, and offsets are
+        # bounded by track_freedom * tanh of the knots, so it under-follows larger jumps rather than failing visibly.
+        # The ROI is therefore considered to have drifted too far to be tracked if the tracked ROI's centroid moves by
+        # more than drift_threshold (between 0 and 1) times the reach, or if the final loss exceeds drift_loss_ratio
+        # times that of the previous frame. Those frames are refitted with the full settings, and their indices saved
+        # to self.drifted
+        if not 0 < drift_threshold < 1:
+            raise ValueError("drift_threshold must be between 0 and 1")
+        self.track = track
+        self.track_freedom = track_freedom
+        self.track_iterations = track_iterations
+        self.track_descent_steps = track_descent_steps
+        self.drift_threshold = drift_threshold
+        self.drift_loss_ratio = drift_loss_ratio
+        self.drifted = None
+        self._settings = settings
+
         # Tensors
         self.cyts_t = None
         self.mems_t = None
@@ -94,6 +157,9 @@ class ImageQuantGradientDescent(ImageQuantBase):
     """
 
     def run(self):
+        if self.track:
+            return self._run_tracking()
+
         t = time.time()
 
         # Fitting
@@ -110,6 +176,71 @@ class ImageQuantGradientDescent(ImageQuantBase):
             time.sleep(0.1)
             print("Time elapsed: %.2f seconds \n" % (time.time() - t))
 
+    def _run_tracking(self):
+        """
+        Fits frames one at a time in temporal order (see track). The first frame is fitted with the full settings, and
+        each subsequent frame starts from the previous frame's refined ROI and fitted concentrations
+        """
+        t = time.time()
+        full = {**self._settings, "track": False, "verbose": False}
+        tracking = {
+            **full,
+            "freedom": self.track_freedom,
+            "iterations": self.track_iterations,
+            "descent_steps": self.track_descent_steps,
+        }
+
+        # Maximum ROI displacement a tracked fit can reach (see track)
+        reach = (
+            self.track_iterations
+            * self.track_freedom
+            * np.tanh(self.lr * self.track_descent_steps)
+        )
+
+        results = []
+        self.drifted = []
+        roi, state, loss = self.roi[0], None, None
+        iterable = tqdm(self.img) if self.verbose else self.img
+        for i, frame in enumerate(iterable):
+            # Track from the previous frame
+            drifted = False
+            if i > 0:
+                iq = ImageQuantGradientDescent(img=[frame], roi=[roi], **tracking)
+                iq.warm_start = state
+                iq.run()
+                displacement = np.linalg.norm(
+                    iq.final_state(0)[0].mean(axis=0) - roi.mean(axis=0)
+                )
+                drifted = displacement > self.drift_threshold * reach or (
+                    loss is not None and iq.losses[0, -1] > self.drift_loss_ratio * loss
+                )
+                if drifted:
+                    self.drifted.append(i)
+
+            # Full fit (first frame, or if the ROI has drifted)
+            if i == 0 or drifted:
+                iq = ImageQuantGradientDescent(img=[frame], roi=[roi], **full)
+                iq.warm_start = state
+                iq.run()
+
+            roi, state = iq.final_state(0)
+            loss = iq.losses[0, -1]
+            results.append(embryo_results(iq, 0))
+
+        # Pad losses (frames may have different numbers of descent steps)
+        steps = max(len(res["losses"]) for res in results)
+        for res in results:
+            res["losses"] = np.pad(
+                res["losses"],
+                (0, steps - len(res["losses"])),
+                constant_values=np.nan,
+            )
+        set_results(self, results)
+
+        if self.verbose:
+            print(f"Refitted {len(self.drifted)} frames after drift")
+            print("Time elapsed: %.2f seconds \n" % (time.time() - t))
+
     def _preprocess(
         self, frame: np.ndarray, roi: np.ndarray
     ) -> tuple[np.ndarray, float, np.ndarray]:
@@ -153,13 +284,21 @@ class ImageQuantGradientDescent(ImageQuantBase):
 
     def _init_tensors(self):
         """
-        Initialising offsets, cytoplasmic concentrations and membrane concentrations as zero
+        Initialising offsets, cytoplasmic concentrations and membrane concentrations as zero (or, for concentrations,
+        as the values in self.warm_start)
         Sigma initialised as user-specified value (or default), and may be trained
         """
 
         nimages = self.target.shape[0]
         self.vars = {}
 
+        # Initial values: zero, or warm started with values for a single image (e.g. from a previous frame)
+        def initial(name: str, shape: tuple) -> np.ndarray:
+            value = (self.warm_start or {}).get(name)
+            if value is None or np.shape(value) != shape[1:]:
+                return np.zeros(shape)
+            return np.tile(value, (shape[0], 1))
+
         # Offsets
         self.offsets_t = tf.Variable(
             np.zeros([nimages, self.roi_knots]), name="Offsets"
@@ -169,18 +308,18 @@ class ImageQuantGradientDescent(ImageQuantBase):
 
         # Cytoplasmic concentrations
         self.cyts_t = tf.Variable(
-            np.zeros_like(np.mean(self.target[:, -5:, :], axis=1))
+            initial("cyts", np.mean(self.target[:, -5:, :], axis=1).shape)
         )
         self.vars["cyts"] = self.cyts_t
 
         # Membrane concentrations
-        self.mems_t = tf.Variable(np.zeros_like(np.max(self.target, axis=1)))
+        self.mems_t = tf.Variable(initial("mems", np.max(self.target, axis=1).shape))
         self.vars["mems"] = self.mems_t
 
         # Outers
         if self.fit_outer:
             self.outers_t = tf.Variable(
-                np.zeros_like(np.mean(self.target[:, :5, :], axis=1))
+                initial("outers", np.mean(self.target[:, :5, :], axis=1).shape)
             )
             self.vars["outers"] = self.outers_t
 
@@ -366,7 +505,7 @@ class ImageQuantGradientDescent(ImageQuantBase):
         )
 
         # Constrain offsets
-        self.offsets = self.freedom * tf.math.tanh(offsets_spline)
+        self.offsets = (self.freedom * tf.math.tanh(offsets_spline)).numpy()
 
         # Crop results
         if self.nfits is None:
@@ -414,6 +553,38 @@ class ImageQuantGradientDescent(ImageQuantBase):
             i - j for i, j in zip(self.straight_images, self.straight_images_sim)
         ]
 
+        # Store results as ragged arrays
+        (
+            self.offsets,
+            self.cyts,
+            self.mems,
+            self.offsets_full,
+            self.cyts_full,
+            self.mems_full,
+        ) = (
+            RaggedArray.from_list(data)
+            for data in [
+                self.offsets,
+                self.cyts,
+                self.mems,
+                self.offsets_full,
+                self.cyts_full,
+                self.mems_full,
+            ]
+        )
+        (
+            self.straight_images,
+            self.straight_images_sim,
+            self.straight_images_resids,
+        ) = (
+            RaggedArray.from_list(data, axis=-1)
+            for data in [
+                self.straight_images,
+                self.straight_images_sim,
+                self.straight_images_resids,
+            ]
+        )
+
         # Save adaptable params
         if self.sigma is not None:
             self.sigma = self.sigma_t.numpy()
@@ -429,15 +600,40 @@ class ImageQuantGradientDescent(ImageQuantBase):
         A refit must be performed after this adjustment.
         """
 
-        # Offset coordinates and interpolate ROI
-        self.roi = [
-            interp_roi(offset_coordinates(roi, offsets), periodic=self.periodic)
-            for roi, offsets in zip(self.roi, self.offsets_full)
-        ]
+        # Offset coordinates and interpolate ROI (all ROIs at once)
+        self.roi = interp_roi_batch(
+            offset_coordinates_batch(self.roi, self.offsets_full),
+            periodic=self.periodic,
+        )
 
         # Rotate ROI if periodic and rotation is enabled
         if self.periodic and self.rotate:
-            self.roi = [rotate_roi(roi) for roi in self.roi]
+            self.roi = RaggedArray.from_list([rotate_roi(roi) for roi in self.roi])
+
+    def final_state(self, i: int = -1) -> tuple[np.ndarray, dict]:
+        """
+        Refined ROI and fitted variables for image i, e.g. to seed the fit of the next frame of a timelapse
+
+        Args:
+            i: index of the image
+
+        Returns:
+            ROI coordinates with the final offsets applied, and a dictionary of fitted concentrations (normalised, and
+            before zerocap constraints are applied) that can be used as warm_start (empty in tracking mode)
+
+        """
+        roi = interp_roi(
+            offset_coordinates(self.roi[i], self.offsets_full[i]),
+            periodic=self.periodic,
+        )
+        if self.periodic and self.rotate:
+            roi = rotate_roi(roi)
+        variables = {
+            name: var.numpy()[i]
+            for name, var in getattr(self, "vars", {}).items()
+            if name in ("cyts", "mems", "outers")
+        }
+        return roi, variables
 
     """
     Interactive
@@ -445,6 +641,8 @@ class ImageQuantGradientDescent(ImageQuantBase):
     """
 
     def plot_losses(self, log: bool = False):
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         losses = np.log10(self.losses.T) if log else self.losses.T
         ax.plot(losses)
@@ -453,6 +651,39 @@ class ImageQuantGradientDescent(ImageQuantBase):
         return fig, ax
 
 
+def quantify_stream(
+    frames, roi: np.ndarray, chunk_size: int = 1, warm_start: bool = True, **kwargs
+):
+    """
+    Quantifies a timelapse as frames arrive (e.g. during acquisition), one chunk of frames at a time. Each chunk is
+    fitted starting from the refined ROI of the last frame of the previous chunk, and (with warm_start) its fitted
+    concentrations, so fewer iterations and descent steps are needed than when fitting from scratch. Only the current
+    chunk and the final state of the previous chunk are kept in memory
+
+    Args:
+        frames: iterable of 2D images in temporal order. Can be a generator (e.g. yielding frames as they're acquired)
+        roi: initial ROI coordinates (for the first frame)
+        chunk_size: number of frames to fit at once (1 for the lowest latency)
+        warm_start: if True, concentrations are initialised from the previous chunk's fit rather than zero
+        **kwargs: passed to ImageQuantGradientDescent (e.g. iterations, descent_steps, freedom)
+
+    Yields:
+        ImageQuantGradientDescent model for each chunk, with results (e.g. roi, mems, cyts) for its frames
+
+    """
+    frames = iter(frames)
+    state = None
+    while True:
+        chunk = list(itertools.islice(frames, chunk_size))
+        if not chunk:
+            return
+        iq = ImageQuantGradientDescent(img=chunk, roi=[roi] * len(chunk), **kwargs)
+        iq.warm_start = state if warm_start else None
+        iq.run()
+        roi, state = iq.final_state()
+        yield iq
+
+
 def create_offsets_spline(
     offsets_t, roi_knots, periodic, nimages, nfits, roi
 ) -> tf.Tensor:
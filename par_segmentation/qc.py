@@ -0,0 +1,259 @@
+import os
+
+import numpy as np
+
+"""
+Headless rendering of quality control (QC) figures for batch runs
+
+Figures are drawn with the Agg canvas directly (no pyplot, no GUI backend), so they can be rendered on cluster nodes
+and in worker processes. Each worker creates one figure and reuses its artists for every embryo it renders, updating
+their data rather than building a new figure each time.
+
+"""
+
+# Panels that can be included in QC figures
+QC_PANELS = ("segmentation", "quantification", "fits")
+
+
+def render_qc(
+    out_dir: str,
+    imgs: list | np.ndarray,
+    rois: list,
+    mems: list | None = None,
+    straight_images: list | None = None,
+    straight_images_sim: list | None = None,
+    ids: list | None = None,
+    panels: tuple = QC_PANELS,
+    downsample: int = 1,
+    n_jobs: int = 1,
+    contact_sheet: bool = True,
+    sheet_columns: int = 8,
+    thumbnail_width: int = 400,
+    dpi: int = 100,
+) -> list:
+    """
+    Renders a QC figure for every embryo to a PNG file, and optionally a contact sheet of all embryos
+
+    Args:
+        out_dir: directory to save figures to (will be created if it doesn't exist)
+        imgs: images (one per embryo)
+        rois: ROI coordinates (one per embryo)
+        mems: optional, membrane concentrations (one array per embryo), for the 'quantification' panel
+        straight_images: optional, straightened images (one per embryo), for the 'fits' panel
+        straight_images_sim: optional, simulated straightened images (one per embryo), for the 'fits' panel
+        ids: optional, names of the embryos, used as file names (defaults to image indices)
+        panels: panels to include in each figure. Panels without data are skipped
+        downsample: factor to downsample images by before rendering (faster rendering of large images)
+        n_jobs: number of worker processes to render with
+        contact_sheet: if True, also saves a grid of thumbnails of all figures to contact_sheet.png
+        sheet_columns: number of columns in the contact sheet
+        thumbnail_width: approximate width of each figure in the contact sheet (pixels)
+        dpi: resolution of figures
+
+    Returns:
+        list of paths of saved figures (with the contact sheet last)
+
+    """
+    n = len(imgs)
+    ids = [str(i) for i in (ids if ids is not None else range(n))]
+    panels = tuple(
+        panel
+        for panel in panels
+        if not (panel == "quantification" and mems is None)
+        and not (
+            panel == "fits" and (straight_images is None or straight_images_sim is None)
+        )
+    )
+    if len(panels) == 0:
+        raise ValueError("No panels to render")
+    for panel in panels:
+        if panel not in QC_PANELS:
+            raise ValueError(f"panel must be one of {QC_PANELS}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Data for each embryo
+    items = [
+        (
+            os.path.join(out_dir, ids[i] + ".png"),
+            ids[i],
+            imgs[i],
+            rois[i],
+            mems[i] if mems is not None else None,
+            straight_images[i] if straight_images is not None else None,
+            straight_images_sim[i] if straight_images_sim is not None else None,
+        )
+        for i in range(n)
+    ]
+
+    # Render (in chunks, one figure per chunk)
+    args = (panels, downsample, dpi, thumbnail_width if contact_sheet else None)
+    if n_jobs == 1 or n <= 1:
+        results = _render_chunk(items, *args)
+    else:
+        from joblib import Parallel, delayed
+
+        chunks = [items[i :: min(n_jobs, n)] for i in range(min(n_jobs, n))]
+        results = [
+            result
+            for chunk_results in Parallel(n_jobs=n_jobs)(
+                delayed(_render_chunk)(chunk, *args) for chunk in chunks
+            )
+            for result in chunk_results
+        ]
+        order = {item[0]: i for i, item in enumerate(items)}
+        results.sort(key=lambda result: order[result[0]])
+
+    paths = [path for path, _ in results]
+
+    # Contact sheet
+    if contact_sheet:
+        path = os.path.join(out_dir, "contact_sheet.png")
+        _save_png(path, _tile([thumbnail for _, thumbnail in results], sheet_columns))
+        paths.append(path)
+
+    return paths
+
+
+class _QCFigure:
+    """
+    A QC figure whose artists are created once, and updated in place for each embryo
+
+    """
+
+    def __init__(self, panels: tuple, dpi: int):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.panels = panels
+        self.fig = Figure(figsize=(4 * len(panels), 4), dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        axes = self.fig.subplots(1, len(panels), squeeze=False)[0]
+        self.axes = dict(zip(panels, axes))
+        self.title = self.fig.suptitle("")
+
+        # Segmentation: image with ROI overlay (and a marker at the first ROI point)
+        if "segmentation" in self.axes:
+            ax = self.axes["segmentation"]
+            self.seg_img = ax.imshow(np.zeros((2, 2)), cmap="gray")
+            (self.seg_roi,) = ax.plot([], [], c="lime")
+            (self.seg_start,) = ax.plot([], [], "o", c="lime")
+            ax.set_xticks([])
+            ax.set_yticks([])
+
+        # Quantification: membrane concentration profile
+        if "quantification" in self.axes:
+            ax = self.axes["quantification"]
+            (self.quant_line,) = ax.plot([], [])
+            ax.axhline(0, c="k", linestyle="--")
+            ax.set_xlabel("Position")
+            ax.set_ylabel("Membrane concentration")
+
+        # Fits: straightened target (top) and simulated (bottom) images
+        if "fits" in self.axes:
+            ax = self.axes["fits"]
+            self.fits_img = ax.imshow(np.zeros((2, 2)), cmap="gray", aspect="auto")
+            ax.set_yticks([])
+            ax.set_xlabel("Position")
+            ax.set_ylabel("Fit (bottom), actual (top)")
+
+        self.fig.tight_layout()
+
+    def render(
+        self,
+        name: str,
+        img: np.ndarray,
+        roi: np.ndarray,
+        mems: np.ndarray | None,
+        target: np.ndarray | None,
+        fit: np.ndarray | None,
+        downsample: int,
+    ) -> np.ndarray:
+        """
+        Updates the figure for one embryo and draws it
+
+        Returns:
+            RGBA image of the figure
+
+        """
+        self.title.set_text(name)
+
+        if "segmentation" in self.axes:
+            img = np.asarray(img[::downsample, ::downsample], dtype=float)
+            roi = np.asarray(roi) / downsample
+            self.seg_img.set_data(img)
+            self.seg_img.set_clim(np.percentile(img, 0.01), np.percentile(img, 99.9))
+            self.seg_img.set_extent(
+                (-0.5, img.shape[1] - 0.5, img.shape[0] - 0.5, -0.5)
+            )
+            self.axes["segmentation"].set_xlim(-0.5, img.shape[1] - 0.5)
+            self.axes["segmentation"].set_ylim(img.shape[0] - 0.5, -0.5)
+            self.seg_roi.set_data(roi[:, 0], roi[:, 1])
+            self.seg_start.set_data(roi[:1, 0], roi[:1, 1])
+
+        if "quantification" in self.axes:
+            mems = np.asarray(mems)
+            ax = self.axes["quantification"]
+            self.quant_line.set_data(np.arange(len(mems)), mems)
+            ax.set_xlim(0, max(len(mems) - 1, 1))
+            ax.set_ylim(min(0, np.min(mems)), max(np.max(mems), 0) * 1.05 + 1e-12)
+
+        if "fits" in self.axes:
+            target = np.asarray(target)[:, ::downsample]
+            fit = np.asarray(fit)[:, ::downsample]
+            both = np.concatenate([target, fit])
+            self.fits_img.set_data(both)
+            self.fits_img.set_clim(np.min(both), np.max(both))
+            self.fits_img.set_extent(
+                (-0.5, both.shape[1] - 0.5, both.shape[0] - 0.5, -0.5)
+            )
+            self.axes["fits"].set_xlim(-0.5, both.shape[1] - 0.5)
+            self.axes["fits"].set_ylim(both.shape[0] - 0.5, -0.5)
+
+        self.fig.canvas.draw()
+        return np.asarray(self.fig.canvas.buffer_rgba())
+
+
+def _render_chunk(
+    items: list, panels: tuple, downsample: int, dpi: int, thumbnail_width
+) -> list:
+    """
+    Renders and saves QC figures for a list of embryos, reusing one figure
+
+    Returns:
+        list of (path, thumbnail) for each embryo (thumbnail is None if thumbnail_width is None)
+
+    """
+    figure = _QCFigure(panels, dpi)
+    results = []
+    for path, *data in items:
+        rgba = figure.render(*data, downsample=downsample)
+        _save_png(path, rgba)
+        thumbnail = None
+        if thumbnail_width is not None:
+            step = max(int(np.ceil(rgba.shape[1] / thumbnail_width)), 1)
+            thumbnail = rgba[::step, ::step].copy()
+        results.append((path, thumbnail))
+    return results
+
+
+def _tile(thumbnails: list, columns: int) -> np.ndarray:
+    """
+    Arranges RGBA images in a grid (white background)
+    """
+    columns = min(columns, len(thumbnails))
+    rows = -(-len(thumbnails) // columns)
+    height = max(t.shape[0] for t in thumbnails)
+    width = max(t.shape[1] for t in thumbnails)
+    sheet = np.full((rows * height, columns * width, 4), 255, dtype=np.uint8)
+    for i, t in enumerate(thumbnails):
+        r, c = divmod(i, columns)
+        sheet[
+            r * height : r * height + t.shape[0], c * width : c * width + t.shape[1]
+        ] = t
+    return sheet
+
+
+def _save_png(path: str, rgba: np.ndarray):
+    from matplotlib.image import imsave
+
+    imsave(path, rgba)
@@ -1,5 +1,10 @@
+import inspect
+
 import numpy as np
 
+# Model arguments that don't affect results (ignored when looking up results in a cache)
+_NON_RESULT_KWARGS = ("verbose", "parallel", "cores", "save_training", "save_sims")
+
 
 class ImageQuant:
     """
@@ -18,6 +23,8 @@ class ImageQuant:
         img: numpy array of image or list of numpy arrays
         roi: coordinates defining the cortex (two column numpy array of x and y coordinates at 1-pixel width intervals), or a list of arrays
         method: 'GD' for gradient descent or 'DE' for differential evolution. The former is highly recommended, the latter works but is much slower and no longer maintained
+        cache: optional, a ResultCache (or the path of its directory). Results are then cached for each embryo, keyed on
+            its image, input ROI and model parameters, and run() only fits embryos that aren't already in the cache
     """
 
     def __init__(
@@ -25,39 +32,131 @@ class ImageQuant:
         img: np.ndarray | list,
         roi: np.ndarray | list,
         method: str = "GD",
+        cache=None,
         **kwargs,
     ):
         # Set up quantifier
         self.method = method
+        self.kwargs = kwargs
+        self.iq = self._model(img, roi)
+
+        # Result cache
+        if isinstance(cache, str):
+            from .cache import ResultCache
+
+            cache = ResultCache(cache)
+        if cache is not None:
+            if self.method not in ("GD", "DE"):
+                raise ValueError('cache is only supported for methods "GD" and "DE"')
+            if any(kwargs.get(k) for k in ("batch_norm", "adaptive_sigma", "track")):
+                raise ValueError(
+                    "cache can't be used with batch_norm, adaptive_sigma or track, as results then depend on other "
+                    "embryos"
+                )
+        self.cache = cache
+
+    def _model_classes(self) -> list:
+        if self.method == "GD":
+            from .model_gd import ImageQuantGradientDescent
+
+            return [ImageQuantGradientDescent]
+        elif self.method == "DE":
+            from .model_de import (
+                ImageQuantDifferentialEvolutionMulti,
+                ImageQuantDifferentialEvolutionSingle,
+            )
+
+            return [
+                ImageQuantDifferentialEvolutionMulti,
+                ImageQuantDifferentialEvolutionSingle,
+            ]
+        return []
+
+    def _cache_params(self) -> dict:
+        """
+        Model settings that affect results, with defaults filled in for any that weren't passed explicitly (so that
+        cached results are invalidated if a default changes)
+        """
+        settings = {}
+        for cls in self._model_classes():
+            for name, param in inspect.signature(cls.__init__).parameters.items():
+                if name in ("self", "img", "roi") or param.kind in (
+                    param.VAR_POSITIONAL,
+                    param.VAR_KEYWORD,
+                ):
+                    continue
+                settings.setdefault(name, param.default)
+        settings.update(self.kwargs)
+        settings = {
+            key: value
+            for key, value in settings.items()
+            if key not in _NON_RESULT_KWARGS
+        }
+        settings["method"] = self.method
+        return settings
+
+    def _model(self, img: np.ndarray | list, roi: np.ndarray | list):
         if self.method == "GD":
             from .model_gd import ImageQuantGradientDescent
 
-            self.iq = ImageQuantGradientDescent(
+            return ImageQuantGradientDescent(
                 img=img,
                 roi=roi,
-                **kwargs,
+                **self.kwargs,
             )
 
         elif self.method == "DE":
             from .model_de import ImageQuantDifferentialEvolutionMulti
 
-            self.iq = ImageQuantDifferentialEvolutionMulti(
+            return ImageQuantDifferentialEvolutionMulti(
                 img=img,
                 roi=roi,
-                **kwargs,
+                **self.kwargs,
             )
 
         elif self.method == "flexi":
             from .model_flexi import ImageQuantFlexi
 
-            self.iq = ImageQuantFlexi(
+            return ImageQuantFlexi(
                 img=img,
                 roi=roi,
-                **kwargs,
+                **self.kwargs,
             )
 
         else:
             raise Exception('method argument must be "GD", "DE" or "flexi"')
 
+    def run(self):
+        """
+        Runs the model. If a cache is used, results for embryos found in the cache are loaded, and only the remaining
+        embryos are fitted (their results are then added to the cache)
+        """
+        if self.cache is None:
+            return self.iq.run()
+        from .cache import embryo_results, set_results
+
+        # Look up embryos in the cache
+        params = self._cache_params()
+        keys = [
+            self.cache.key(img, roi, params)
+            for img, roi in zip(self.iq.img, self.iq.roi)
+        ]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, res in enumerate(results) if res is None]
+        if self.kwargs.get("verbose", True):
+            print(f"Loaded {self.iq.n - len(missing)} of {self.iq.n} images from cache")
+
+        # Fit the remaining embryos, and cache their results
+        if len(missing) > 0:
+            iq = self._model(
+                [self.iq.img[i] for i in missing], [self.iq.roi[i] for i in missing]
+            )
+            iq.run()
+            for j, i in enumerate(missing):
+                results[i] = embryo_results(iq, j)
+                self.cache.put(keys[i], results[i])
+
+        set_results(self.iq, results)
+
     def __getattr__(self, name):
         return getattr(self.iq, name)
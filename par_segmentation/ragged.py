@@ -0,0 +1,176 @@
+import numpy as np
+
+"""
+Compact container for per-embryo results of different lengths
+
+"""
+
+
+class RaggedArray:
+    """
+    A batch of arrays that differ in length along one axis, stored as a single flat buffer plus offsets (CSR layout).
+    Supports list-like indexing and iteration (returning zero-copy views of each array), and vectorised per-array
+    operations across the whole batch
+
+    Args:
+        data: flat buffer, with all arrays concatenated along axis
+        offsets: integer array of length n + 1 giving the start and end of each array in data
+        axis: the axis along which arrays differ in length (e.g. 0 for membrane profiles or ROIs, -1 for straightened
+            images)
+
+    """
+
+    __slots__ = ("axis", "data", "offsets")
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, axis: int = 0):
+        self.data = data
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.axis = axis
+
+    @classmethod
+    def from_list(cls, arrays, axis: int = 0) -> "RaggedArray":
+        """
+        Creates a ragged array from a list (or other iterable) of arrays
+
+        Args:
+            arrays: arrays to combine. Must have the same shape apart from along axis
+            axis: the axis along which arrays differ in length
+
+        Returns:
+            RaggedArray
+
+        """
+        arrays = [np.asarray(a) for a in arrays]
+        lengths = [a.shape[axis] for a in arrays]
+        offsets = np.r_[0, np.cumsum(lengths, dtype=np.int64)]
+        return cls(np.concatenate(arrays, axis=axis), offsets, axis=axis)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        Length of each array along the ragged axis
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def positions(self) -> np.ndarray:
+        """
+        Position of every element of data within its own array
+        """
+        starts = self.offsets[:-1]
+        return np.arange(self.offsets[-1]) - np.repeat(starts, self.lengths)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int | slice) -> "np.ndarray | RaggedArray":
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return RaggedArray.from_list(
+                    [self[j] for j in range(start, stop, step)], axis=self.axis
+                )
+            a, b = self.offsets[start], self.offsets[max(start, stop)]
+            return RaggedArray(
+                self._take(a, b),
+                self.offsets[start : max(start, stop) + 1] - a,
+                axis=self.axis,
+            )
+        i = range(len(self))[i]
+        return self._take(self.offsets[i], self.offsets[i + 1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self) -> str:
+        return f"RaggedArray(n={len(self)}, lengths={self.lengths.tolist()})"
+
+    def tolist(self) -> list:
+        """
+        Returns a list of (zero-copy) views of each array
+        """
+        return list(self)
+
+    def sum(self) -> np.ndarray:
+        """
+        Sum of each array along the ragged axis
+
+        Returns:
+            numpy array with first dimension n
+        """
+        return self._segment_sums(self.data)
+
+    def mean(self) -> np.ndarray:
+        """
+        Mean of each array along the ragged axis
+
+        Returns:
+            numpy array with first dimension n
+        """
+        lengths = self.lengths.reshape((-1,) + (1,) * (self.data.ndim - 1))
+        return self.sum() / lengths
+
+    def bounded_mean(self, bounds: tuple, inclusive: bool = True) -> np.ndarray:
+        """
+        Averages each array over the region specified by bounds (see bounded_mean_1d)
+
+        Args:
+            bounds: specifies window to average over. (min, max) from 0 to 1 specifying start and end of each array
+            inclusive: if True, the position at the upper bound is included in the window (as in bounded_mean_1d). If
+                False, it is excluded (as in bounded_mean_2d)
+
+        Returns:
+            numpy array with first dimension n
+        """
+        lengths = self.lengths
+        lower = (lengths * bounds[0]).astype(int)
+        upper = (lengths * bounds[1] + int(inclusive)).astype(int)
+
+        # Window membership of every element (wrapping around if lower >= upper)
+        pos = self.positions
+        lower_, upper_ = np.repeat(lower, lengths), np.repeat(upper, lengths)
+        window = np.where(
+            lower_ < upper_,
+            (pos >= lower_) & (pos < upper_),
+            (pos < upper_) | (pos >= lower_),
+        ).astype(self.data.dtype)
+
+        # Masked sums
+        shape = [1] * self.data.ndim
+        shape[self.axis] = -1
+        window = window.reshape(shape)
+        return self._segment_sums(self.data * window) / self._segment_sums(window)
+
+    def asi(self, size: float) -> np.ndarray:
+        """
+        Asymmetry index of each membrane profile (see asi)
+
+        Args:
+            size: size of region to average over when calculating anterior and posterior concentrations (from 0 to 1,
+                where 1 indicates the whole embryo)
+
+        Returns:
+            numpy array of asymmetry indices (length n)
+        """
+        ant = self.bounded_mean((0.5 - size / 2, 0.5 + size / 2))
+        post = self.bounded_mean((1 - size / 2, size / 2))
+        return (ant - post) / (2 * (ant + post))
+
+    def _segment_sums(self, values: np.ndarray) -> np.ndarray:
+        """
+        Sums values (with the same layout as data) over each array along the ragged axis, with first dimension n.
+        Empty arrays sum to 0 (np.add.reduceat alone would instead return the next element, or fail if it's the last)
+        """
+        values = np.moveaxis(values, self.axis, 0)
+        sums = np.zeros((len(self),) + values.shape[1:], dtype=values.dtype)
+        nonempty = self.lengths > 0
+        if np.any(nonempty):
+            starts = self.offsets[:-1][nonempty]
+            sums[nonempty] = np.add.reduceat(values, starts, axis=0)
+        return sums
+
+    def _take(self, a: int, b: int) -> np.ndarray:
+        index = [slice(None)] * self.data.ndim
+        index[self.axis] = slice(a, b)
+        return self.data[tuple(index)]
@@ -1,5 +1,8 @@
+import struct
+
 import numpy as np
-from scipy.interpolate import interp1d, splev, splprep
+
+from .ragged import RaggedArray
 
 """
 Todo: This no longer works with multiple channels - intensity ranges
@@ -9,7 +12,11 @@ Todo: Ability to specify a directory and open all channels. Or an nd file
 
 
 def spline_roi(
-    roi: np.ndarray, periodic: bool = True, s: float = 0.0, k: int = 3
+    roi: np.ndarray,
+    periodic: bool = True,
+    s: float = 0.0,
+    k: int = 3,
+    density: float = 10,
 ) -> np.ndarray:
     """
     Fits a spline to points specifying the coordinates of the cortex, then interpolates to pixel distances
@@ -19,6 +26,7 @@ def spline_roi(
         periodic: set to True if the ROI is periodic
         s: splprep s parameter
         k: splprep k parameter (spline order)
+        density: number of points per pixel of perimeter at which to evaluate the spline before interpolating
 
     Returns:
         spline ROI (numpy array)
@@ -30,9 +38,12 @@ def spline_roi(
         x = np.r_[x, x[0]]
         y = np.r_[y, y[0]]
 
-    # Fit spline and evaluate it
+    # Fit spline and evaluate it (density scales with perimeter)
+    from scipy.interpolate import splev, splprep
+
     tck, _ = splprep([x, y], s=s, per=periodic, k=k)
-    xi, yi = splev(np.linspace(0, 1, 10000), tck)
+    perimeter = np.sum(np.hypot(np.diff(x), np.diff(y)))
+    xi, yi = splev(np.linspace(0, 1, max(int(perimeter * density), 100)), tck)
 
     # Interpolate
     return interp_roi(np.vstack((xi, yi)).T, periodic=periodic)
@@ -54,20 +65,67 @@ def interp_roi(
         interpolated ROI (numpy array)
 
     """
-    c = np.append(roi, [roi[0, :]], axis=0) if periodic else roi
+    return interp_roi_batch([roi], periodic=periodic, npoints=npoints, gap=gap)[0]
+
+
+def interp_roi_batch(
+    rois: list | RaggedArray,
+    periodic: bool = True,
+    npoints: int | None = None,
+    gap: int = 1,
+) -> RaggedArray:
+    """
+    Interpolates a batch of ROIs to one pixel distances (or as close as possible to one pixel), in one vectorised
+    operation. Equivalent to calling interp_roi on each ROI
 
-    # Calculate distance between points in pixel units
-    distances = np.sqrt(np.sum(np.diff(c, axis=0) ** 2, axis=1))
-    distances_cumsum = np.r_[0, np.cumsum(distances)]
-    total_length = distances_cumsum[-1]
+    Args:
+        rois: list or RaggedArray of two column arrays containing x and y coordinates
+        periodic: set to True if the ROIs are periodic
+        npoints: number of points to interpolate each ROI to
+        gap: alternatively, specify the desired gap between succesive coordinates in pixel units
+
+    Returns:
+        RaggedArray of interpolated ROIs
+
+    """
+    rois = rois if isinstance(rois, RaggedArray) else RaggedArray.from_list(rois)
+    starts, n = rois.offsets[:-1], len(rois)
+
+    # Close periodic ROIs by appending the first point of each
+    if periodic:
+        c = np.insert(rois.data, rois.offsets[1:], rois.data[starts], axis=0)
+        offsets = rois.offsets + np.arange(n + 1)
+    else:
+        c, offsets = rois.data, rois.offsets
+    starts, lengths = offsets[:-1], np.diff(offsets)
+
+    # Cumulative distance along each ROI in pixel units
+    steps = np.r_[0, np.hypot(*np.diff(c, axis=0).T)]
+    steps[starts] = 0
+    cumsum = np.cumsum(steps)
+    distances_cumsum = cumsum - np.repeat(cumsum[starts], lengths)
+    total_lengths = distances_cumsum[offsets[1:] - 1]
+
+    # Shift each ROI so that distances increase monotonically across the whole batch
+    shifts = np.r_[0, np.cumsum(total_lengths + 1)[:-1]]
+    x = distances_cumsum + np.repeat(shifts, lengths)
+
+    # Positions to evaluate (excluding the end point of each ROI)
+    num = (
+        np.full(n, npoints + 1)
+        if npoints
+        else np.round(total_lengths / gap).astype(int)
+    )
+    counts = np.maximum(num - 1, 0)
+    spacing = total_lengths / np.maximum(num - 1, 1)
+    j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(shifts, counts) + j * np.repeat(spacing, counts)
 
     # Interpolate
-    fx, fy = interp1d(distances_cumsum, c[:, 0]), interp1d(distances_cumsum, c[:, 1])
-    positions = np.linspace(
-        0, total_length, npoints + 1 if npoints else int(round(total_length / gap))
+    newpoints = np.column_stack(
+        (np.interp(positions, x, c[:, 0]), np.interp(positions, x, c[:, 1]))
     )
-    newpoints = np.column_stack((fx(positions), fy(positions)))[:-1]
-    return newpoints
+    return RaggedArray(newpoints, np.r_[0, np.cumsum(counts)])
 
 
 def offset_coordinates(
@@ -89,23 +147,216 @@ def offset_coordinates(
     """
 
     # Calculate gradients
-    xcoors = roi[:, 0]
-    ycoors = roi[:, 1]
     if periodic:
-        ydiffs = np.diff(ycoors, prepend=ycoors[-1])
-        xdiffs = np.diff(xcoors, prepend=xcoors[-1])
+        diffs = np.diff(roi, axis=0, prepend=roi[-1:])
     else:
-        ydiffs = np.diff(ycoors)
-        xdiffs = np.diff(xcoors)
-        ydiffs = np.r_[ydiffs[0], ydiffs]
-        xdiffs = np.r_[xdiffs[0], xdiffs]
+        diffs = np.diff(roi, axis=0)
+        diffs = np.r_[diffs[:1], diffs]
 
-    grad = ydiffs / xdiffs
-    tangent_grad = -1 / grad
+    # Offset coordinates
+    return _offset_along_normals(roi, diffs, offsets)
+
+
+def offset_coordinates_batch(
+    rois: list | RaggedArray,
+    offsets: list | np.ndarray | RaggedArray,
+    periodic: bool = True,
+) -> RaggedArray:
+    """
+    Adjusts a batch of ROIs according to offsets, in one vectorised operation. Equivalent to calling
+    offset_coordinates on each ROI
+
+    Args:
+        rois: list or RaggedArray of two column arrays containing x and y coordinates
+        offsets: offsets for each ROI (list or RaggedArray of arrays the same length as each ROI)
+        periodic: set to True if the ROIs are periodic
+
+    Returns:
+        RaggedArray of new coordinates
+
+    """
+    rois = rois if isinstance(rois, RaggedArray) else RaggedArray.from_list(rois)
+    offsets = (
+        offsets.data
+        if isinstance(offsets, RaggedArray)
+        else np.concatenate([np.asarray(o) for o in offsets])
+    )
+    starts, ends = rois.offsets[:-1], rois.offsets[1:]
+
+    # Calculate gradients (wrapping around, or repeating the second difference, at the start of each ROI)
+    previous = np.arange(len(rois.data)) - 1
+    if periodic:
+        previous[starts] = ends - 1
+    else:
+        previous[starts] = starts
+    diffs = rois.data - rois.data[previous]
+    if not periodic:
+        diffs[starts] = diffs[starts + 1]
 
     # Offset coordinates
-    xchange = np.sqrt((offsets**2) / (1 + tangent_grad**2))
-    ychange = xchange / np.abs(grad)
-    newxs = xcoors + np.sign(ydiffs) * np.sign(offsets) * xchange
-    newys = ycoors - np.sign(xdiffs) * np.sign(offsets) * ychange
-    return np.column_stack([newxs, newys])
+    return RaggedArray(
+        _offset_along_normals(rois.data, diffs, offsets), rois.offsets.copy()
+    )
+
+
+def _offset_along_normals(
+    roi: np.ndarray, diffs: np.ndarray, offsets: np.ndarray | float
+) -> np.ndarray:
+    """
+    Moves coordinates along unit normals to the tangents specified by diffs. Unlike computing normals from gradients,
+    this is stable for horizontal and vertical segments (coordinates with zero-length tangents are not moved)
+    """
+    norms = np.hypot(diffs[:, 0], diffs[:, 1])[:, np.newaxis]
+    normals = np.divide(
+        diffs[:, ::-1] * [1, -1], norms, out=np.zeros(diffs.shape), where=norms > 0
+    )
+    return roi + np.expand_dims(offsets, -1) * normals
+
+
+class SplineRoi:
+    """
+    Compact ROI representation: a closed (periodic) uniform cubic B-spline, stored as its control points. Dense
+    coordinates are only created when requested, at any spacing, and the ROI can be serialised to a few hundred bytes
+
+    Models accept SplineRoi objects (or lists of them) in place of coordinate arrays
+
+    Args:
+        control_points: two column array of x and y coordinates of the spline control points
+
+    """
+
+    __slots__ = ("control_points",)
+
+    _MAGIC = b"PSRO"
+    _HEADER = struct.Struct("<4sBI")
+
+    def __init__(self, control_points: np.ndarray):
+        self.control_points = np.asarray(control_points, dtype=np.float64)
+
+    @classmethod
+    def from_coordinates(
+        cls, roi: np.ndarray, knots: int = 20, periodic: bool = True
+    ) -> "SplineRoi":
+        """
+        Least-squares fit of a spline to ROI coordinates, parameterised by arc length from the first coordinate
+
+        Args:
+            roi: two column array containing x and y coordinates. e.g. roi = np.loadtxt(filename)
+            knots: number of spline knots (control points)
+            periodic: must be True (only periodic ROIs are supported)
+
+        Returns:
+            SplineRoi
+        """
+        if not periodic:
+            raise ValueError("SplineRoi only supports periodic ROIs")
+
+        # Arc length parameterisation
+        closed = np.r_[roi, roi[:1]]
+        distances = np.r_[0, np.cumsum(np.hypot(*np.diff(closed, axis=0).T))]
+        u = distances[:-1] / distances[-1]
+
+        # Least squares control points
+        basis = _periodic_bspline_basis(u, knots)
+        control_points = np.linalg.lstsq(basis, roi, rcond=None)[0]
+        return cls(control_points)
+
+    @property
+    def knots(self) -> int:
+        return self.control_points.shape[0]
+
+    def evaluate(self, u: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the spline at parameter values u (from 0 to 1, where 0 is the start of the ROI)
+
+        Returns:
+            two column array of x and y coordinates
+        """
+        return _periodic_bspline_basis(np.asarray(u), self.knots) @ self.control_points
+
+    def coordinates(
+        self, gap: float = 1, npoints: int | None = None, density: float = 10
+    ) -> np.ndarray:
+        """
+        Dense ROI coordinates, at (as close as possible to) the spacing specified
+
+        Args:
+            gap: desired gap between succesive coordinates in pixel units
+            npoints: alternatively, the number of coordinates
+            density: number of points per pixel of perimeter at which to evaluate the spline before interpolating
+
+        Returns:
+            two column array of x and y coordinates
+        """
+        closed = np.r_[self.control_points, self.control_points[:1]]
+        perimeter = np.sum(np.hypot(*np.diff(closed, axis=0).T))
+        u = np.linspace(0, 1, max(int(perimeter * density), 100), endpoint=False)
+        return interp_roi(self.evaluate(u), periodic=True, npoints=npoints, gap=gap)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return np.asarray(self.coordinates(), dtype=dtype)
+
+    def __repr__(self) -> str:
+        return f"SplineRoi(knots={self.knots})"
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialises the spline (control points stored as float32)
+        """
+        header = self._HEADER.pack(self._MAGIC, 1, self.knots)
+        return header + self.control_points.astype("<f4").tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SplineRoi":
+        """
+        Creates a SplineRoi from bytes created with to_bytes()
+        """
+        magic, _, knots = cls._HEADER.unpack_from(data)
+        if magic != cls._MAGIC:
+            raise ValueError("Data is not a serialised SplineRoi")
+        values = np.frombuffer(
+            data, dtype="<f4", count=2 * knots, offset=cls._HEADER.size
+        )
+        return cls(values.reshape(knots, 2))
+
+    def save(self, path: str):
+        """
+        Saves the spline to a binary file
+        """
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "SplineRoi":
+        """
+        Loads a spline saved with save()
+        """
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+def _periodic_bspline_basis(u: np.ndarray, knots: int) -> np.ndarray:
+    """
+    Basis matrix [len(u), knots] of a uniform periodic cubic B-spline evaluated at parameter values u (0 to 1)
+    """
+    s = (u % 1) * knots
+    i = np.floor(s).astype(int)
+    f = s - i
+
+    # Weights of control points i - 1, i, i + 1, i + 2
+    weights = (
+        np.stack(
+            [
+                (1 - f) ** 3,
+                3 * f**3 - 6 * f**2 + 4,
+                -3 * f**3 + 3 * f**2 + 3 * f + 1,
+                f**3,
+            ],
+            axis=1,
+        )
+        / 6
+    )
+    basis = np.zeros((len(u), knots))
+    for j, w in enumerate(weights.T):
+        np.add.at(basis, (np.arange(len(u)), (i + j - 1) % knots), w)
+    return basis
@@ -0,0 +1,167 @@
+import h5py
+import numpy as np
+
+"""
+Chunked, compressed HDF5 store for quantification results
+
+Each field is saved as a group containing a flat 'data' dataset, with embryos concatenated along the first axis, and
+an 'offsets' dataset (length n + 1) marking where each embryo starts and ends. Straightened images are saved
+transposed ([positions, thickness]) so that they can be concatenated in the same way. Fields missing for some embryos
+(e.g. if a batch without simulated images is appended to one with them) are saved as empty entries, so that offsets
+of every field line up with the embryo ids.
+
+"""
+
+# Fields saved by save_store, and whether they are straightened images
+STORE_FIELDS = {
+    "mems": False,
+    "cyts": False,
+    "offsets": False,
+    "roi": False,
+    "straight_images": True,
+    "straight_images_sim": True,
+    "straight_images_resids": True,
+}
+
+
+def save_store(
+    path: str,
+    results: dict,
+    ids: list | np.ndarray,
+    append: bool = True,
+    chunk_size: int = 65536,
+    compression: str = "gzip",
+):
+    """
+    Saves results for a batch of embryos to a single HDF5 file
+
+    Args:
+        path: path of the HDF5 file (will be created if it doesn't already exist)
+        results: dictionary of results. Keys are field names (see STORE_FIELDS), values are lists of numpy arrays (one
+            per embryo)
+        ids: embryo ids, one per embryo
+        append: if True, results are appended to an existing file. If False, any existing file is overwritten
+        chunk_size: approximate number of values per chunk
+        compression: HDF5 compression filter
+
+    """
+
+    with h5py.File(path, "a" if append else "w") as f:
+        # Embryo ids
+        ids = np.asarray(ids, dtype=np.int64)
+        n_saved = _append(f, "ids", ids, chunk_size, compression)
+
+        for field, is_image in STORE_FIELDS.items():
+            data = results.get(field)
+
+            # Missing field: empty entries for this batch (if the field has been saved before)
+            if data is None:
+                if field in f:
+                    offsets = f[field]["offsets"]
+                    end = offsets[-1]
+                    _append(
+                        f[field],
+                        "offsets",
+                        np.full(len(ids), end, dtype=np.int64),
+                        chunk_size,
+                    )
+                continue
+            arrays = [
+                np.asarray(d, dtype=np.float32 if is_image else np.float64)
+                for d in data
+            ]
+            if is_image:
+                arrays = [a.T for a in arrays]
+
+            # Flat data
+            group = f.require_group(field)
+            start = _append(
+                group, "data", np.concatenate(arrays), chunk_size, compression
+            )
+
+            # Offsets
+            lengths = np.array([a.shape[0] for a in arrays], dtype=np.int64)
+            if "offsets" not in group:
+                # Empty entries for embryos saved before this field was
+                _append(
+                    group, "offsets", np.zeros(n_saved + 1, dtype=np.int64), chunk_size
+                )
+            _append(group, "offsets", start + np.cumsum(lengths), chunk_size)
+
+
+def load_store(
+    path: str, indices: list | np.ndarray | None = None, fields: list | None = None
+) -> dict:
+    """
+    Loads results from an HDF5 file created with save_store
+
+    Args:
+        path: path of the HDF5 file
+        indices: positions (in the order saved) of the embryos to load. If None, all embryos are loaded
+        fields: names of the fields to load. If None, all saved fields are loaded
+
+    Returns:
+        dictionary of results. 'ids' is a numpy array of embryo ids, other values are lists of numpy arrays (one per
+        embryo, or None for embryos saved without that field). Fields missing for all of the embryos loaded are
+        omitted
+
+    """
+
+    with h5py.File(path, "r") as f:
+        ids = f["ids"][()]
+        if indices is None:
+            indices = np.arange(len(ids))
+        indices = np.asarray(indices, dtype=np.int64)
+
+        results = {"ids": ids[indices]}
+        for field, is_image in STORE_FIELDS.items():
+            if field not in f or (fields is not None and field not in fields):
+                continue
+            data = f[field]["data"]
+            offsets = f[field]["offsets"][()]
+
+            # Read contiguous blocks in one go
+            if np.array_equal(indices, np.arange(len(ids))):
+                arrays = np.split(data[()], offsets[1:-1])
+            else:
+                arrays = [data[offsets[i] : offsets[i + 1]] for i in indices]
+
+            # Empty entries (embryos saved without this field)
+            arrays = [a if a.shape[0] > 0 else None for a in arrays]
+            if all(a is None for a in arrays):
+                continue
+            results[field] = [a.T if is_image and a is not None else a for a in arrays]
+
+    return results
+
+
+def _append(
+    group: h5py.Group,
+    name: str,
+    values: np.ndarray,
+    chunk_size: int,
+    compression: str | None = None,
+) -> int:
+    """
+    Appends values to a resizable dataset along the first axis (creating it if necessary)
+
+    Returns:
+        the length of the dataset before appending
+
+    """
+
+    if name not in group:
+        rows = max(1, chunk_size // int(np.prod(values.shape[1:], dtype=np.int64)))
+        group.create_dataset(
+            name,
+            shape=(0,) + values.shape[1:],
+            maxshape=(None,) + values.shape[1:],
+            dtype=values.dtype,
+            chunks=(rows,) + values.shape[1:],
+            compression=compression,
+        )
+    dataset = group[name]
+    start = dataset.shape[0]
+    dataset.resize(start + values.shape[0], axis=0)
+    dataset[start:] = values
+    return start
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from par_segmentation import (
+    RaggedArray,
+    asi,
+    asi_batch,
+    bounded_mean_2d,
+    bounded_mean_2d_batch,
+    dosage,
+    dosage_batch,
+    load_image,
+    make_mask,
+    offset_coordinates,
+)
+
+
+class TestBatchMetrics:
+    """
+    Testing that batch metrics match their single-array equivalents
+
+    """
+
+    img = load_image(
+        os.path.dirname(os.path.abspath(__file__))
+        + "/../scripts/nwg338_af_corrected.tif"
+    )
+    roi = np.loadtxt(
+        os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_ROI_manual.txt"
+    )
+    rng = np.random.default_rng(0)
+
+    def test_asi(self):
+        mems = self.rng.random((5, 100)) + 0.1
+        assert np.allclose(asi_batch(mems, 0.33), [asi(m, 0.33) for m in mems])
+        ragged = RaggedArray.from_list([m[: 50 + i] for i, m in enumerate(mems)])
+        assert np.allclose(asi_batch(ragged, 0.33), [asi(m, 0.33) for m in ragged])
+
+    def test_bounded_mean_2d(self):
+        imgs = self.rng.random((3, 50, 80))
+        for bounds in [(0.2, 0.6), (0.8, 0.3)]:
+            assert np.allclose(
+                bounded_mean_2d_batch(imgs, bounds),
+                [bounded_mean_2d(i, bounds) for i in imgs],
+            )
+
+    def test_dosage(self):
+        # Compare against the full-image mask, on images that aren't 512x512 (including one that crops the ROI)
+        padded = np.pad(self.img, ((10, 30), (0, 20)))
+        imgs = [padded, self.img[:300, :400]]
+        rois = [self.roi + [0, 10], self.roi]
+        res = dosage_batch(imgs, rois, 5)
+        assert list(res.columns) == ["Frame", "Dosage"]
+        for i, (img, roi) in enumerate(zip(imgs, rois)):
+            mask = make_mask(img.shape, offset_coordinates(roi, 5))
+            expected = np.nanmean(img * mask)
+            assert res["Dosage"][i] == pytest.approx(expected)
+            assert dosage(img, roi, 5) == pytest.approx(expected)
+
+    def test_dosage_ids(self):
+        res = dosage_batch([self.img] * 2, [self.roi] * 2, 5, ids=[7, 9])
+        assert list(res["EmbryoID"]) == [7, 9]
+        with pytest.raises(ValueError):
+            dosage_batch([self.img] * 2, [self.roi] * 2, 5, ids=[7, 9, 11])
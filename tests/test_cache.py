@@ -0,0 +1,119 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from par_segmentation import ResultCache, load_image
+from par_segmentation.quantifier import ImageQuant
+
+IMG = load_image(
+    os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_af_corrected.tif"
+)
+ROI = np.loadtxt(
+    os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_ROI_manual.txt"
+)
+PARAMS = {"nfits": 20, "iterations": 2, "descent_steps": 20, "verbose": False}
+
+
+class TestResultCache:
+    """
+    Testing the result cache
+
+    """
+
+    def test_put_get(self, tmp_path):
+        cache = ResultCache(str(tmp_path))
+        key = cache.key(IMG, ROI, {"nfits": 20})
+        assert cache.get(key) is None
+        cache.put(key, {"mems": np.arange(5.0)})
+        assert key in cache
+        assert np.array_equal(cache.get(key)["mems"], np.arange(5.0))
+
+    def test_key(self):
+        key = ResultCache.key(IMG, ROI, {"nfits": 20})
+        assert key == ResultCache.key(IMG.copy(), ROI.copy(), {"nfits": 20})
+        assert key != ResultCache.key(IMG + 1, ROI, {"nfits": 20})
+        assert key != ResultCache.key(IMG, ROI + 1, {"nfits": 20})
+        assert key != ResultCache.key(IMG, ROI, {"nfits": 30})
+
+    def test_settings(self):
+        # Defaults are included in the key, so passing a default explicitly gives the same settings
+        iq = ImageQuant(img=IMG, roi=ROI, **PARAMS)
+        settings = iq._cache_params()
+        assert settings["sigma"] == 3.5
+        assert "verbose" not in settings
+        iq2 = ImageQuant(img=IMG, roi=ROI, sigma=3.5, **PARAMS)
+        assert ResultCache.key(IMG, ROI, settings) == ResultCache.key(
+            IMG, ROI, iq2._cache_params()
+        )
+        iq3 = ImageQuant(img=IMG, roi=ROI, sigma=3.0, **PARAMS)
+        assert ResultCache.key(IMG, ROI, settings) != ResultCache.key(
+            IMG, ROI, iq3._cache_params()
+        )
+
+    def test_get_evicted(self, tmp_path, monkeypatch):
+        # An entry evicted between loading and touching it is treated as a miss
+        cache = ResultCache(str(tmp_path))
+        cache.put("0", {"data": np.zeros(1)})
+
+        def utime(path):
+            raise FileNotFoundError(path)
+
+        monkeypatch.setattr("par_segmentation.cache.os.utime", utime)
+        assert cache.get("0") is None
+
+    def test_eviction(self, tmp_path):
+        # Least recently used entries are evicted when the cache is full
+        cache = ResultCache(str(tmp_path))
+        for i in range(3):
+            cache.put(str(i), {"data": np.random.default_rng(i).normal(size=1000)})
+            time.sleep(0.01)
+        cache.get("0")
+        cache.max_size = cache.size - 1
+        cache.put("3", {"data": np.zeros(1)})
+        assert "1" not in cache
+        assert all(k in cache for k in ["0", "2", "3"])
+        assert cache.size <= cache.max_size
+
+    def test_running_total(self, tmp_path, monkeypatch):
+        # The directory is only scanned once while the cache isn't full
+        cache = ResultCache(str(tmp_path))
+        scans = []
+        entries = cache._entries
+        monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+        for i in range(20):
+            cache.put(str(i), {"data": np.full(100, i)})
+        cache.put("0", {"data": np.zeros(1000)})
+        assert len(scans) == 1
+        assert cache._total == cache.size
+
+    def test_run(self, tmp_path):
+        imgs = [IMG, IMG[::-1]]
+        rois = [ROI, ROI * [1, -1] + [0, IMG.shape[0] - 1]]
+        iq = ImageQuant(img=imgs, roi=rois, cache=str(tmp_path), **PARAMS)
+        iq.run()
+        assert len(iq.cache) == 2
+
+        # Results for both embryos are loaded from the cache
+        iq2 = ImageQuant(img=imgs, roi=rois, cache=str(tmp_path), **PARAMS)
+        iq2.run()
+        for field in ["roi", "mems", "cyts", "offsets_full", "straight_images"]:
+            for a, b in zip(getattr(iq, field), getattr(iq2, field)):
+                assert np.array_equal(a, b)
+        assert np.array_equal(iq.losses, iq2.losses)
+        iq2.compile_res()
+
+        # Only changed embryos are refitted
+        iq3 = ImageQuant(img=[IMG, IMG + 1], roi=rois, cache=str(tmp_path), **PARAMS)
+        iq3.run()
+        assert len(iq3.cache) == 3
+        assert np.array_equal(iq3.mems[0], iq.mems[0])
+
+    def test_invalid(self, tmp_path):
+        with pytest.raises(ValueError):
+            ImageQuant(img=IMG, roi=ROI, method="flexi", cache=str(tmp_path))
+        with pytest.raises(ValueError):
+            ImageQuant(img=IMG, roi=ROI, cache=str(tmp_path), batch_norm=True)
+        with pytest.raises(ValueError):
+            ImageQuant(img=IMG, roi=ROI, cache=str(tmp_path), track=True)
@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from par_segmentation.cli import find_embryos, group_embryos, main
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__)) + "/../scripts"
+PARAMS = ["-p", "nfits=20", "-p", "iterations=1", "-p", "descent_steps=20"]
+PARAMS += ["-p", "verbose=False", "-q"]
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    # Three embryos (two with the same image size and ROI length), and one excluded folder
+    for name in ["e1", "e2", "e3", "!e4"]:
+        folder = tmp_path / "exp" / name
+        os.makedirs(folder)
+        shutil.copy(SCRIPTS + "/nwg338_af_corrected.tif", folder / "af_corrected.tif")
+        roi = np.loadtxt(SCRIPTS + "/nwg338_ROI_manual.txt")
+        np.savetxt(folder / "ROI.txt", roi[::2] if name == "e3" else roi)
+    return tmp_path / "exp"
+
+
+class TestCli:
+    """
+    Testing the command-line batch runner
+
+    """
+
+    def test_find_embryos(self, experiment):
+        embryos = find_embryos(str(experiment))
+        assert [os.path.basename(e[0]) for e in embryos] == ["e1", "e2", "e3"]
+        assert [len(b) for b in group_embryos(embryos)] == [2, 1]
+        assert [len(b) for b in group_embryos(embryos, batch_size=1)] == [1, 1, 1]
+
+    def test_run(self, experiment, tmp_path):
+        output = str(tmp_path / "results.csv")
+        assert main([str(experiment), "-o", output, "-j", "2", *PARAMS]) == 0
+        res = pd.read_csv(output)
+        assert list(res.columns) == [
+            "EmbryoID",
+            "Position",
+            "Membrane signal",
+            "Cytoplasmic signal",
+            "Path",
+        ]
+        assert list(res.EmbryoID.unique()) == [0, 1, 2]
+        for filename in ["roi.txt", "target.tif", "fit.tif", "residuals.tif"]:
+            assert os.path.exists(experiment / "e1/par_segmentation" / filename)
+
+        # Completed embryos are skipped, unless settings change
+        mtime = os.path.getmtime(experiment / "e1/par_segmentation/settings.json")
+        main([str(experiment), "-o", output, *PARAMS])
+        assert (
+            os.path.getmtime(experiment / "e1/par_segmentation/settings.json") == mtime
+        )
+        assert pd.read_csv(output).equals(res)
+        main([str(experiment), "-o", output, *PARAMS, "-p", "thickness=40"])
+        assert (
+            os.path.getmtime(experiment / "e1/par_segmentation/settings.json") > mtime
+        )
+
+    def test_invalid_param(self, experiment):
+        with pytest.raises(ValueError):
+            main([str(experiment), "-p", "nfits"])
@@ -1,11 +1,18 @@
 import os
 
 import numpy as np
+import pytest
 
-from par_segmentation import load_image
+from par_segmentation import load_image, model_de
 from par_segmentation.quantifier import ImageQuant
 
 
+def _run(iq):
+    # Runs a model inside an image worker
+    iq.run()
+    return iq
+
+
 class TestDeCompletion:
     """
     Testing that the differential evolution optimiser runs to completion
@@ -34,3 +41,78 @@ class TestDeCompletion:
         )
         iq.run()
         iq.compile_res()
+
+    def test_vectorized(self):
+        # Testing that it runs to completion with vectorised population evaluation
+        iq = ImageQuant(
+            img=self.imgs, roi=self.rois, method="DE", verbose=False, vectorized=True
+        )
+        iq.run()
+        iq.compile_res()
+
+    def test_grid(self):
+        # Testing that it runs to completion with the grid/least squares solver
+        iq = ImageQuant(
+            img=self.imgs, roi=self.rois, method="DE", verbose=False, solver="grid"
+        )
+        iq.run()
+        iq.compile_res()
+
+    def test_parallel(self):
+        # Testing that it runs to completion with images and profiles fitted in parallel
+        iq = ImageQuant(
+            img=self.imgs * 2,
+            roi=self.rois * 2,
+            method="DE",
+            verbose=False,
+            parallel=True,
+            cores=4,
+            solver="DE",
+        )
+        iq.run()
+        iq.compile_res()
+        assert len(iq.mems) == 2
+
+    def test_no_sim_images(self, tmp_path):
+        # Testing that it runs to completion without reconstructing simulated images
+        iq = ImageQuant(
+            img=self.imgs,
+            roi=self.rois,
+            method="DE",
+            verbose=False,
+            solver="grid",
+            sim_images=False,
+        )
+        iq.run()
+        iq.compile_res()
+        assert iq.iq.straight_images_sim is None
+
+        # Saving skips the simulated and residual images
+        iq.save(str(tmp_path), i=0)
+        assert os.path.exists(str(tmp_path) + "/target.tif")
+        assert not os.path.exists(str(tmp_path) + "/fit.tif")
+
+        with pytest.raises(ValueError):
+            iq.plot_fits()
+
+    def test_parallel_profiles(self):
+        # Testing that profiles split across processes inside an image worker are fitted in the right order (results
+        # match a serial fit, within the run-to-run variability of differential evolution)
+        from joblib import Parallel, delayed
+
+        res = []
+        for parallel in [False, True]:
+            iq = model_de.ImageQuantDifferentialEvolutionSingle(
+                img=self.imgs[0],
+                roi=self.rois[0],
+                nfits=4,
+                iterations=1,
+                parallel=parallel,
+                cores=2,
+            )
+            (iq,) = Parallel(n_jobs=2)(delayed(_run)(iq) for _ in range(1))
+            res.append(iq)
+        serial, parallel = res
+        assert np.allclose(parallel.cyts, serial.cyts, rtol=0.1)
+        assert np.allclose(parallel.offsets, serial.offsets, atol=1.5)
+        assert np.allclose(parallel.mems, serial.mems, atol=0.15 * serial.cyts.max())
@@ -44,3 +44,72 @@ class TestDeCorrectTests:
             7186.560758626298, rel=1e-4
         )
         assert iq.roi[0][0, 0] == pytest.approx(181.5831198442061, rel=1e-4)
+
+    def test_grid(self):
+        # Grid solver is deterministic
+        res = []
+        for _ in range(2):
+            iq = ImageQuant(
+                img=self.imgs[0],
+                roi=self.rois[0],
+                method="DE",
+                verbose=False,
+                solver="grid",
+                zerocap=True,
+            )
+            iq.run()
+            res.append(iq.compile_res())
+        assert res[0].equals(res[1])
+        assert np.all(res[0]["Membrane signal"] >= 0)
+
+    def test_grid_reference(self):
+        # Grid solver finds the same fit as differential evolution (test_1), within a tolerance
+        iq = ImageQuant(
+            img=self.imgs[0],
+            roi=self.rois[0],
+            method="DE",
+            verbose=False,
+            solver="grid",
+        )
+        iq.run()
+        res = iq.compile_res()
+        assert res.iloc[0]["Membrane signal"] == pytest.approx(
+            7222.288644674427, rel=5e-2
+        )
+        assert res.iloc[0]["Cytoplasmic signal"] == pytest.approx(
+            7186.560758626298, rel=5e-2
+        )
+        assert iq.roi[0][0, 0] == pytest.approx(181.5831198442061, rel=1e-2)
+
+    def test_grid_bounds(self):
+        # Degenerate (flat) profiles don't give NaNs, and concentrations respect the differential evolution bounds
+        iq = ImageQuant(
+            img=self.imgs[0],
+            roi=self.rois[0],
+            method="DE",
+            verbose=False,
+            solver="grid",
+        ).iq.iq[0]
+        profiles = np.ones([iq.thickness_itp, 4])
+        profiles[:, 1] = 0
+        o, c, m = iq._fit_profiles_grid(profiles)
+        assert np.all(np.isfinite(o)) and np.all(np.isfinite(c))
+        assert np.all(np.isfinite(m))
+        assert np.all(c <= 2 * profiles.max(axis=0) + 1e-9)
+        assert np.all(m >= -0.2 * profiles.max(axis=0) - 1e-9)
+
+    def test_grid_freedom(self):
+        # With freedom larger than half the thickness, candidate offsets stay within the reference curves
+        iq = ImageQuant(
+            img=self.imgs[0],
+            roi=self.rois[0],
+            method="DE",
+            verbose=False,
+            solver="grid",
+            freedom=40,
+        ).iq.iq[0]
+        profiles = np.zeros([iq.thickness_itp, 3])
+        profiles[-1] = 1
+        o, c, m = iq._fit_profiles_grid(profiles)
+        assert np.all(o >= -iq.thickness / 2)
+        assert np.all(o <= iq.thickness / 2)
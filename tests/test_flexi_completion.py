@@ -69,3 +69,108 @@ class TestFlexiCompletion:
         )
         iq.quantify()
         iq.compile_res()
+
+    def test_save_interim(self):
+        # Testing that strided interim parameters are returned, ending at the final parameters (steps 0, 15, 30, 45
+        # and 50)
+        iq = ImageQuant(
+            img=self.imgs,
+            roi=self.rois,
+            method="flexi",
+        )
+        res = iq.quantify(descent_steps=50, save_interim=True, interim_stride=15)
+        assert res["mems"].shape[0] == 5
+        assert np.allclose(res["mems"][-1], iq.mems_opt)
+        assert iq.losses.shape == (1, 50)
+
+        # Stride dividing the number of steps (steps 0, 10, ..., 50)
+        res = iq.quantify(descent_steps=50, save_interim=True, interim_stride=10)
+        assert res["mems"].shape[0] == 6
+        assert np.allclose(res["mems"][-1], iq.mems_opt)
+
+    def test_calibration(self):
+        # Testing that cytoplasm and membrane calibration run to completion
+        iq = ImageQuant(
+            img=self.imgs,
+            roi=self.rois,
+            method="flexi",
+        )
+        iq.calibrate_cytoplasm(descent_steps=50)
+        iq.calibrate_membrane(descent_steps=50)
+        iq.compile_res()
+
+    def test_bucket_shapes(self):
+        # Testing that padding to shape buckets does not change results
+        res = []
+        for bucket_shapes in [True, False]:
+            iq = ImageQuant(
+                img=self.imgs * 3,
+                roi=self.rois * 3,
+                method="flexi",
+                bucket_shapes=bucket_shapes,
+            )
+            iq.quantify(descent_steps=100)
+            res.append(iq.mems.data)
+        assert np.allclose(res[0], res[1], rtol=1e-4)
+
+    def test_compilation_cache(self, tmp_path):
+        # Testing that compiled programs are written to the persistent compilation cache
+        import jax
+
+        from par_segmentation.model_flexi import enable_compilation_cache
+
+        enable_compilation_cache(str(tmp_path))
+        try:
+            iq = ImageQuant(img=self.imgs, roi=self.rois, method="flexi")
+            iq.quantify(descent_steps=7)
+            assert len(os.listdir(tmp_path)) > 0
+        finally:
+            jax.config.update("jax_compilation_cache_dir", None)
+
+    def test_preprocessing_reused(self):
+        # Testing that preprocessing is reused across calls, and redone after segmentation
+        iq = ImageQuant(img=self.imgs, roi=self.rois, method="flexi")
+        iq.calibrate_cytoplasm(descent_steps=10)
+        target = iq.target
+        iq.quantify(descent_steps=10)
+        assert iq.target is target
+        iq.segment(descent_steps=10)
+        iq.quantify(descent_steps=10)
+        assert iq.target is not target
+
+    def test_lstsq(self):
+        # Testing that it runs to completion with the direct solver
+        for zerocap in [True, False]:
+            iq = ImageQuant(
+                img=self.imgs, roi=self.rois, method="flexi", zerocap=zerocap
+            )
+            iq.quantify(solver="lstsq")
+            iq.compile_res()
+
+    def test_segment(self):
+        # Testing that segmentation followed by calibration and quantification runs to completion
+        iq = ImageQuant(img=self.imgs, roi=self.rois, method="flexi")
+        iq.segment(descent_steps=50)
+        iq.calibrate_cytoplasm(descent_steps=50)
+        iq.quantify(descent_steps=50)
+        iq.compile_res()
+        assert iq.losses.shape == (1, 50)
+
+    def test_quantify_stream(self, tmp_path):
+        # Testing that a saved calibration can be applied to a stream of images in chunks
+        from par_segmentation.model_flexi import load_calibration, quantify_stream
+
+        iq = ImageQuant(img=self.imgs, roi=self.rois, method="flexi")
+        iq.calibrate_cytoplasm(descent_steps=50)
+        iq.save_calibration(str(tmp_path / "calibration.npz"))
+        calibration = load_calibration(str(tmp_path / "calibration.npz"))
+        assert np.allclose(calibration["cytbg"], iq.cytbg)
+
+        pairs = ((self.imgs[0], self.rois[0]) for _ in range(3))
+        res = list(
+            quantify_stream(
+                pairs, str(tmp_path / "calibration.npz"), chunk_size=2, solver="lstsq"
+            )
+        )
+        assert len(res) == 2
+        assert list(res[1]["Frame"].unique()) == [2]
@@ -5,6 +5,7 @@ import pytest
 
 from par_segmentation import load_image
 from par_segmentation.quantifier import ImageQuant
+from par_segmentation.roi import interp_roi, offset_coordinates
 
 
 class TestFlexiCorrect:
@@ -42,3 +43,123 @@ class TestFlexiCorrect:
             5736.6279296875, rel=1e-4
         )
         assert iq.roi[0][0, 0] == pytest.approx(181.7987012987013, rel=1e-4)
+
+    def test_lstsq(self):
+        # Direct solver agrees with gradient descent
+        iq = ImageQuant(img=self.imgs[0], roi=self.rois[0], method="flexi")
+        iq.quantify(solver="lstsq")
+        res = iq.compile_res()
+        assert res.iloc[0]["Membrane signal"] == pytest.approx(11081.1796875, rel=1e-2)
+        assert res.iloc[0]["Cytoplasmic signal"] == pytest.approx(
+            5736.6279296875, rel=1e-2
+        )
+
+    @pytest.mark.parametrize("zerocap", [True, False])
+    def test_solve_amplitudes(self, zerocap):
+        # Direct solver matches a generic bounded least squares solver
+        from scipy.optimize import lsq_linear
+
+        from par_segmentation.model_flexi import solve_amplitudes
+
+        rng = np.random.default_rng(0)
+        thickness, width = 20, 6
+        cytbg, membg = rng.random(thickness), rng.random(thickness)
+        target = rng.normal(size=(1, thickness, width))
+        target[0, :, :3] += 2 * cytbg[:, np.newaxis]
+        masks = np.ones((1, width))
+        masks[0, -1] = 0
+        cyts, mems = solve_amplitudes(target, masks, cytbg, membg, zerocap)
+
+        a = np.zeros((thickness * (width - 1), width))
+        for x in range(width - 1):
+            a[x * thickness : (x + 1) * thickness, 0] = cytbg
+            a[x * thickness : (x + 1) * thickness, 1 + x] = membg
+        b = target[0, :, : width - 1].T.reshape(-1)
+        res = lsq_linear(a, b, bounds=(0 if zerocap else -np.inf, np.inf)).x
+        assert cyts[0] == pytest.approx(res[0], abs=1e-8)
+        assert np.allclose(mems[0, :-1], res[1:], atol=1e-8)
+        assert mems[0, -1] == 0
+
+    def test_data_parallel(self):
+        # Calibration sharded across devices gives the same results as on one device (run in a new process, as the
+        # number of devices must be set before JAX is initialised)
+        import subprocess
+        import sys
+
+        script = f"""
+import numpy as np
+from par_segmentation.model_flexi import set_host_device_count
+set_host_device_count(2)
+from par_segmentation import load_image
+from par_segmentation.quantifier import ImageQuant
+img = load_image({self.path + "/nwg338_af_corrected.tif"!r})
+roi = np.loadtxt({self.path + "/nwg338_ROI_manual.txt"!r})
+res = []
+for data_parallel in [False, True]:
+    iq = ImageQuant(img=[img] * 3, roi=[roi, roi + 1, roi + 2], method="flexi", data_parallel=data_parallel)
+    iq.calibrate_cytoplasm(descent_steps=50)
+    res.append((iq.cytbg, iq.mems.data))
+assert np.allclose(res[0][0], res[1][0])
+assert np.allclose(res[0][1], res[1][1])
+"""
+        subprocess.run([sys.executable, "-c", script], check=True)
+
+    def test_host_device_count_fallback(self):
+        # Older JAX versions without the jax_num_cpu_devices option fall back to XLA_FLAGS (run in a new process, as
+        # the number of devices must be set before JAX is initialised)
+        import subprocess
+        import sys
+
+        script = """
+import jax
+from par_segmentation.model_flexi import set_host_device_count
+
+def update(name, value):
+    raise AttributeError(f"Unrecognized config option: {name}")
+
+jax.config.update = update
+set_host_device_count(2)
+assert len(jax.devices("cpu")) == 2
+"""
+        subprocess.run([sys.executable, "-c", script], check=True)
+
+    def test_offsets_basis(self):
+        # Offsets spline basis matches the spline used by the gradient descent model
+        import tensorflow as tf
+
+        from par_segmentation.model_flexi import offsets_basis
+        from par_segmentation.model_gd import create_offsets_spline
+
+        knots = np.random.default_rng(0).normal(size=(2, 20))
+        res = create_offsets_spline(tf.Variable(knots), 20, True, 2, 137, None)
+        assert np.allclose(res.numpy(), knots @ offsets_basis(20, 137).T, atol=1e-5)
+
+    def test_segment(self):
+        # Segmentation moves the ROI onto the membrane (matching the gradient descent model)
+        iq = ImageQuant(img=self.imgs[0], roi=self.rois[0], method="flexi")
+        iq.segment()
+        assert iq.losses[0, -1] < iq.losses[0, 0]
+        assert iq.roi[0][0] == pytest.approx([182.16, 313.81], abs=0.5)
+
+        # Mean distance of the new ROI from the manual ROI
+        roi, manual = iq.roi[0], self.rois[0]
+        distances = np.linalg.norm(roi[:, np.newaxis] - manual[np.newaxis], axis=-1)
+        assert np.mean(np.min(distances, axis=1)) > 2
+
+        # Mean distance of the new ROI from the ROI refined by the gradient descent model
+        gd = ImageQuant(
+            img=self.imgs[0],
+            roi=self.rois[0],
+            method="GD",
+            thickness=iq.thickness,
+            iterations=1,
+            freedom=10,
+            descent_steps=500,
+            verbose=False,
+        )
+        gd.run()
+        gd_roi = interp_roi(
+            offset_coordinates(gd.roi[0], gd.offsets_full[0]), periodic=True
+        )
+        distances = np.linalg.norm(roi[:, np.newaxis] - gd_roi[np.newaxis], axis=-1)
+        assert np.mean(np.min(distances, axis=1)) < 0.4
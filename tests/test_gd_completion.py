@@ -3,6 +3,7 @@ import os
 import numpy as np
 
 from par_segmentation import load_image
+from par_segmentation.model_gd import quantify_stream
 from par_segmentation.quantifier import ImageQuant
 
 
@@ -133,3 +134,16 @@ class TestGdCompletion:
         )
         iq.run()
         iq.compile_res()
+
+    def test_10(self):
+        # Testing that streaming quantification runs to completion, in chunks and with nfits None
+        for nfits in [100, None]:
+            for iq in quantify_stream(
+                iter(self.imgs * 3),
+                self.rois[0],
+                chunk_size=2,
+                descent_steps=10,
+                verbose=False,
+                nfits=nfits,
+            ):
+                iq.compile_res()
@@ -4,6 +4,7 @@ import numpy as np
 import pytest
 
 from par_segmentation import load_image
+from par_segmentation.model_gd import quantify_stream
 from par_segmentation.quantifier import ImageQuant
 
 
@@ -43,3 +44,52 @@ class TestGdCorrect:
             6995.061025591719, rel=1e-4
         )
         assert iq.roi[0][0, 0] == pytest.approx(182.18897189832285, rel=1e-4)
+
+    def test_stream(self):
+        # ROI follows an embryo moving 3 pixels per frame, and warm starting reduces the initial loss
+        iq = ImageQuant(img=self.imgs[0], roi=self.rois[0], method="GD", verbose=False)
+        iq.run()
+        roi = iq.final_state()[0]
+        frames = [np.roll(self.imgs[0], 3 * t, axis=1) for t in range(4)]
+        for t, iq_t in enumerate(
+            quantify_stream(frames, roi, iterations=1, descent_steps=100, verbose=False)
+        ):
+            shift = iq_t.final_state()[0].mean(axis=0) - roi.mean(axis=0)
+            assert shift == pytest.approx([3 * t, 0], abs=1.5)
+            if t > 0:
+                assert iq_t.losses[0, 0] < 0.1 * iq.losses[0, 0]
+
+    def test_track(self):
+        # ROI is tracked across frames, and a large jump is detected as drift (and refitted)
+        shifts = [0, 3, 6, 21]
+        frames = [np.roll(self.imgs[0], shift, axis=1) for shift in shifts]
+        iq = ImageQuant(
+            img=frames, roi=self.rois[0], method="GD", track=True, verbose=False
+        )
+        iq.run()
+        assert iq.drifted == [3]
+        assert iq.losses.shape == (4, 400)
+        rois = [iq.final_state(i)[0] for i in range(len(frames))]
+        for shift, roi in zip(shifts, rois):
+            assert roi.mean(axis=0) - rois[0].mean(axis=0) == pytest.approx(
+                [shift, 0], abs=1.5
+            )
+
+    def test_track_offsets(self):
+        # A 9 pixel jump, which the tracked fit under-follows, is detected from the ROI displacement alone (loss
+        # criterion switched off)
+        shifts = [0, 3, 12]
+        frames = [np.roll(self.imgs[0], shift, axis=1) for shift in shifts]
+        iq = ImageQuant(
+            img=frames,
+            roi=self.rois[0],
+            method="GD",
+            track=True,
+            drift_loss_ratio=np.inf,
+            verbose=False,
+        )
+        iq.run()
+        assert iq.drifted == [2]
+
+        with pytest.raises(ValueError):
+            ImageQuant(img=frames, roi=self.rois[0], track=True, drift_threshold=1)
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "cv2",
+    "matplotlib",
+    "skimage",
+    "scipy",
+    "pandas",
+    "tifffile",
+    "ipywidgets",
+    "tensorflow",
+    "jax",
+]
+
+
+def _run(code: str, *args) -> str:
+    return subprocess.run(
+        [sys.executable, *args, "-c", code], check=True, capture_output=True, text=True
+    )
+
+
+def _loaded_modules(code: str, modules: list = HEAVY_MODULES) -> list:
+    res = _run(
+        code + f"\nimport sys\nprint([m for m in {modules!r} if m in sys.modules])"
+    )
+    return eval(res.stdout.strip().splitlines()[-1])
+
+
+class TestImports:
+    """
+    Testing that heavy dependencies are only imported when needed
+
+    """
+
+    def test_package(self):
+        # Importing the package doesn't import any heavy dependencies
+        assert _loaded_modules("import par_segmentation") == []
+
+    def test_lazy_attributes(self):
+        # Public names are still available from the package, loading only their submodule's dependencies
+        assert _loaded_modules("from par_segmentation import RaggedArray, asi") == []
+        loaded = _loaded_modules("from par_segmentation import straighten")
+        assert "cv2" not in loaded
+        assert "matplotlib" not in loaded
+
+    def test_quantifier(self):
+        # Importing the quantifier doesn't import any models
+        assert (
+            _loaded_modules("from par_segmentation.quantifier import ImageQuant") == []
+        )
+
+    def test_flexi(self):
+        # The flexi model doesn't import TensorFlow or plotting libraries
+        loaded = _loaded_modules(
+            "from par_segmentation.model_flexi import ImageQuantFlexi"
+        )
+        assert "tensorflow" not in loaded
+        assert "matplotlib" not in loaded
+
+    def test_star_import(self):
+        res = _run("from par_segmentation import *\nprint(straighten.__module__)")
+        assert res.stdout.strip() == "par_segmentation.funcs"
+
+    def test_optional_dependencies(self):
+        # Importing the package doesn't import optional or slow-to-import dependencies (checked directly, rather than
+        # with a wall-clock import time budget)
+        modules = ["tensorflow", "jax", "scipy.optimize", "matplotlib", "h5py"]
+        assert _loaded_modules("import par_segmentation", modules) == []
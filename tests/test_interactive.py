@@ -0,0 +1,81 @@
+import matplotlib
+import numpy as np
+import pytest
+from matplotlib.backend_bases import MouseEvent
+
+from par_segmentation.interactive import (
+    _DisplayFrames,
+    _FitPlotter,
+    plot_quantification,
+    plot_segmentation,
+    view_stack_tk,
+)
+
+matplotlib.use("Agg")
+pytestmark = pytest.mark.filterwarnings("ignore:.*non-interactive:UserWarning")
+
+
+def _click(ax, x: float):
+    # Simulates a click at fraction x along an axis
+    canvas = ax.get_figure().canvas
+    px, py = ax.transAxes.transform((x, 0.5))
+    MouseEvent("button_press_event", canvas, px, py, button=1)._process()
+    MouseEvent("button_release_event", canvas, px, py, button=1)._process()
+
+
+rng = np.random.default_rng(0)
+FRAMES = [rng.normal(size=(60, 80)) for _ in range(3)] + [rng.normal(size=(40, 50))]
+ROIS = [np.c_[np.arange(10), np.arange(10) + i] for i in range(4)]
+
+
+class TestInteractive:
+    """
+    Testing that the interactive viewers update artists in place
+
+    """
+
+    frames = FRAMES
+    rois = ROIS
+
+    def test_display_frames(self):
+        display = _DisplayFrames(self.frames, 0.1, 99.9, max_size=30)
+        assert display[0].dtype == np.uint8
+        assert display[0].shape == (20, 27)
+        assert display[0] is display[0]
+        assert display.extent(3) == (-0.5, 49.5, 39.5, -0.5)
+
+    def test_view_stack(self):
+        fig, ax = view_stack_tk(self.frames, show=False)
+        fig.canvas.draw()
+        image = ax.images[0]
+        _click(fig.axes[1], 0.5)
+        assert len(ax.images) == 1
+        assert image.get_animated()
+        assert np.array_equal(
+            image.get_array(), _DisplayFrames(self.frames, 0.1, 99.9)[2]
+        )
+
+    def test_plot_segmentation(self):
+        fig, ax = plot_segmentation(self.frames, self.rois)
+        fig.canvas.draw()
+        _click(fig.axes[1], 1)
+        assert len(ax.images) == 1 and len(ax.lines) == 1
+        assert np.array_equal(ax.lines[0].get_xydata(), self.rois[3])
+        assert ax.get_xlim() == (-0.5, 49.5)
+
+    def test_plot_quantification(self):
+        mems = [np.arange(10), np.arange(20) * 2]
+        fig, ax = plot_quantification(mems)
+        fig.canvas.draw()
+        _click(fig.axes[1], 1)
+        assert np.array_equal(ax.lines[0].get_ydata(), mems[1])
+
+    def test_fit_plotter(self):
+        target = [f[:10] for f in self.frames]
+        fp = _FitPlotter(target, [t * 2 for t in target])
+        fp.fig.canvas.draw()
+        _click(fp.fig.axes[2], 1)
+        _click(fp.ax1, 0.5)
+        assert fp.pos == 24
+        assert np.array_equal(fp.line_fit.get_ydata(), target[3][:, 24] * 2)
+        assert len(fp.ax1.images) == 1 and len(fp.ax2.lines) == 2
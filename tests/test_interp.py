@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from par_segmentation import interp_1d_array, interp_2d_array, interp_matrix
+
+
+class TestInterp:
+    """
+    Testing that the cached resampling operator matches interp_1d_array
+
+    """
+
+    rng = np.random.default_rng(0)
+
+    @pytest.mark.parametrize("method", ["linear", "cubic"])
+    @pytest.mark.parametrize("n_in, n", [(50, 500), (500, 50), (7, 7), (2, 9)])
+    def test_interp_matrix(self, method, n_in, n):
+        array = self.rng.normal(size=n_in)
+        assert np.allclose(
+            interp_matrix(n_in, n, method) @ array, interp_1d_array(array, n, method)
+        )
+
+    @pytest.mark.parametrize("ax", [0, 1])
+    def test_interp_2d_array(self, ax):
+        array = self.rng.normal(size=(20, 30))
+        res = interp_2d_array(array, 45, ax=ax)
+        for x in range(array.shape[1 - ax]):
+            slice_ = (slice(None), x) if ax == 0 else (x, slice(None))
+            assert np.allclose(res[slice_], interp_1d_array(array[slice_], 45))
+
+    def test_invalid_method(self):
+        with pytest.raises(ValueError):
+            interp_matrix(10, 20, "quadratic")
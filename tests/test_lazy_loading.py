@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import tifffile
+
+from par_segmentation import TiffStack, load_image
+from par_segmentation.quantifier import ImageQuant
+
+
+class TestLazyLoading:
+    """
+    Testing that lazily loaded stacks match eagerly loaded ones and can be quantified
+
+    """
+
+    img = load_image(
+        os.path.dirname(os.path.abspath(__file__))
+        + "/../scripts/nwg338_af_corrected.tif"
+    )
+    roi = np.loadtxt(
+        os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_ROI_manual.txt"
+    )
+
+    def test_memmap(self, tmp_path):
+        # Uncompressed stacks are memory-mapped
+        stack = np.stack([self.img, self.img]).astype(np.uint16)
+        tifffile.imwrite(tmp_path / "stack.tif", stack)
+        lazy = load_image(str(tmp_path / "stack.tif"), lazy=True)
+        assert isinstance(lazy, np.memmap)
+        assert lazy.dtype == np.uint16
+        assert np.array_equal(lazy[1], stack[1])
+
+    def test_compressed(self, tmp_path):
+        # Compressed stacks are read frame by frame
+        stack = np.stack([self.img, self.img]).astype(np.uint16)
+        tifffile.imwrite(tmp_path / "stack.tif", stack, compression="zlib")
+        lazy = load_image(str(tmp_path / "stack.tif"), lazy=True)
+        assert isinstance(lazy, TiffStack)
+        assert lazy.shape == stack.shape
+        assert np.array_equal(lazy[-1], stack[1])
+        assert np.array_equal(np.asarray(lazy), stack)
+        lazy.close()
+
+    def test_single_frame(self, tmp_path):
+        # Single-page files are a stack of one frame
+        frame = self.img.astype(np.uint16)
+        tifffile.imwrite(tmp_path / "frame.tif", frame, compression="zlib")
+        lazy = TiffStack(str(tmp_path / "frame.tif"))
+        assert len(lazy) == 1
+        assert lazy.shape == (1,) + frame.shape
+        assert np.array_equal(lazy[0], frame)
+        assert np.array_equal(lazy[-1], frame)
+        assert len(list(lazy)) == 1
+        assert np.array_equal(np.asarray(lazy), frame[np.newaxis])
+        lazy.close()
+
+    def test_quantification(self, tmp_path):
+        # Lazily loaded stacks give the same results as eagerly loaded stacks
+        stack = np.stack([self.img, self.img]).astype(np.float32)
+        tifffile.imwrite(tmp_path / "stack.tif", stack, compression="zlib")
+        lazy = load_image(str(tmp_path / "stack.tif"), lazy=True)
+        eager = load_image(str(tmp_path / "stack.tif"))
+        res = []
+        for img in (lazy, eager):
+            iq = ImageQuant(
+                img=img,
+                roi=self.roi,
+                method="GD",
+                iterations=1,
+                descent_steps=10,
+                verbose=False,
+            )
+            iq.run()
+            res.append(iq.compile_res())
+        assert np.allclose(res[0]["Membrane signal"], res[1]["Membrane signal"])
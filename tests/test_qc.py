@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from par_segmentation import load_image, render_qc
+from par_segmentation.quantifier import ImageQuant
+
+IMG = load_image(
+    os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_af_corrected.tif"
+)
+ROI = np.loadtxt(
+    os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_ROI_manual.txt"
+)
+
+
+@pytest.fixture(scope="module")
+def iq():
+    iq = ImageQuant(
+        img=[IMG, IMG[::-1]],
+        roi=[ROI, ROI * [1, -1] + [0, IMG.shape[0] - 1]],
+        method="flexi",
+    )
+    iq.quantify(solver="lstsq")
+    return iq
+
+
+class TestQC:
+    """
+    Testing headless rendering of QC figures
+
+    """
+
+    img = IMG
+    roi = ROI
+
+    def test_render_qc(self, iq, tmp_path):
+        paths = iq.render_qc(str(tmp_path), ids=["a", "b"], n_jobs=2)
+        assert [os.path.basename(p) for p in paths] == [
+            "a.png",
+            "b.png",
+            "contact_sheet.png",
+        ]
+        for path in paths:
+            assert os.path.getsize(path) > 0
+
+    def test_parallel_matches_serial(self, iq, tmp_path):
+        from matplotlib.image import imread
+
+        serial = iq.render_qc(str(tmp_path / "serial"), contact_sheet=False)
+        parallel = iq.render_qc(
+            str(tmp_path / "parallel"), contact_sheet=False, n_jobs=2
+        )
+        for a, b in zip(serial, parallel):
+            assert np.array_equal(imread(a), imread(b))
+
+    def test_segmentation_only(self, tmp_path):
+        # Panels without data are skipped
+        paths = render_qc(
+            str(tmp_path), [self.img], [self.roi], downsample=2, contact_sheet=False
+        )
+        assert len(paths) == 1 and os.path.exists(paths[0])
+
+    def test_invalid_panel(self, tmp_path):
+        with pytest.raises(ValueError):
+            render_qc(str(tmp_path), [self.img], [self.roi], panels=("histogram",))
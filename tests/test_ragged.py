@@ -0,0 +1,59 @@
+from typing import ClassVar
+
+import numpy as np
+import pytest
+
+from par_segmentation import RaggedArray, asi, bounded_mean_1d
+
+
+class TestRaggedArray:
+    """
+    Testing that ragged arrays behave like lists of arrays, and that batch operations match single-array functions
+
+    """
+
+    arrays: ClassVar[list] = [
+        np.random.default_rng(i).random(n) + 0.1 for i, n in enumerate([100, 57, 313])
+    ]
+
+    def test_indexing(self):
+        r = RaggedArray.from_list(self.arrays)
+        assert len(r) == 3
+        assert np.array_equal(r[1], self.arrays[1])
+        assert np.array_equal(r[-1], self.arrays[-1])
+        assert np.shares_memory(r[0], r.data)
+        assert list(r[1:].lengths) == [57, 313]
+        with pytest.raises(IndexError):
+            r[3]
+
+    def test_images(self):
+        # Arrays that differ along the last axis
+        imgs = [np.ones((50, a.shape[0])) * a for a in self.arrays]
+        r = RaggedArray.from_list(imgs, axis=-1)
+        assert r[2].shape == (50, 313)
+        assert np.allclose(r.mean(), [i.mean(axis=1) for i in imgs])
+
+    def test_metrics(self):
+        r = RaggedArray.from_list(self.arrays)
+        assert np.allclose(r.mean(), [a.mean() for a in self.arrays])
+        assert np.allclose(
+            r.bounded_mean((0.9, 0.2)),
+            [bounded_mean_1d(a, (0.9, 0.2)) for a in self.arrays],
+        )
+        assert np.allclose(r.asi(0.33), [asi(a, 0.33) for a in self.arrays])
+
+    def test_empty(self):
+        # Empty arrays (e.g. missing fields in a store), including as the last entry
+        arrays = [self.arrays[0], np.zeros(0), self.arrays[1], np.zeros(0)]
+        r = RaggedArray.from_list(arrays)
+        assert np.allclose(r.sum(), [a.sum() for a in arrays])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = r.bounded_mean((0.9, 0.2))
+        assert np.allclose(
+            means[[0, 2]], [bounded_mean_1d(a, (0.9, 0.2)) for a in arrays[::2]]
+        )
+        assert np.all(np.isnan(means[[1, 3]]))
+
+        imgs = [np.ones((5, len(a))) * a for a in arrays]
+        r = RaggedArray.from_list(imgs, axis=-1)
+        assert np.allclose(r.sum(), [i.sum(axis=1) for i in imgs])
@@ -0,0 +1,70 @@
+import os
+from typing import ClassVar
+
+import numpy as np
+
+from par_segmentation import (
+    SplineRoi,
+    interp_roi,
+    interp_roi_batch,
+    load_image,
+    offset_coordinates,
+    offset_coordinates_batch,
+    spline_roi,
+)
+from par_segmentation.quantifier import ImageQuant
+
+
+class TestRoi:
+    """
+    Testing batched ROI operations and stability of offsets for axis-aligned segments
+
+    """
+
+    roi = np.loadtxt(
+        os.path.dirname(os.path.abspath(__file__)) + "/../scripts/nwg338_ROI_manual.txt"
+    )
+    rois: ClassVar[list] = [roi, roi[::2], roi[5:200]]
+    offsets: ClassVar[list] = [
+        np.random.default_rng(i).normal(size=len(r)) for i, r in enumerate(rois)
+    ]
+
+    def test_batch(self):
+        for periodic in [True, False]:
+            offset = offset_coordinates_batch(self.rois, self.offsets, periodic)
+            interped = interp_roi_batch(self.rois, periodic)
+            for i, (r, o) in enumerate(zip(self.rois, self.offsets)):
+                assert np.allclose(offset[i], offset_coordinates(r, o, periodic))
+                assert np.allclose(interped[i], interp_roi(r, periodic))
+
+    def test_axis_aligned(self):
+        # Square ROI, every segment is horizontal or vertical
+        square = np.array(
+            [[0, 0], [1, 0], [2, 0], [2, 1], [2, 2], [1, 2], [0, 2], [0, 1]], float
+        )
+        offset = offset_coordinates(square, 1.0)
+        assert np.all(np.isfinite(offset))
+        assert np.allclose(offset[2], [2, -1])
+
+    def test_spline_roi(self):
+        # Compact spline representation round trips through bytes and closely matches the input ROI
+        roi = spline_roi(self.roi)
+        s = SplineRoi.from_coordinates(roi)
+        s = SplineRoi.from_bytes(s.to_bytes())
+        coors = s.coordinates()
+        assert len(s.to_bytes()) * 40 < roi.nbytes
+        assert abs(len(coors) - len(roi)) <= 1
+        assert np.max(np.hypot(*(coors[0] - roi[0]))) < 0.2
+
+    def test_spline_roi_model(self):
+        # Models accept spline ROIs directly
+        img = load_image(
+            os.path.dirname(os.path.abspath(__file__))
+            + "/../scripts/nwg338_af_corrected.tif"
+        )
+        s = SplineRoi.from_coordinates(spline_roi(self.roi))
+        iq = ImageQuant(
+            img=img, roi=s, method="GD", iterations=1, descent_steps=10, verbose=False
+        )
+        iq.run()
+        assert iq.roi[0].shape[1] == 2
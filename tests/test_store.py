@@ -0,0 +1,142 @@
+import os
+from typing import ClassVar
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from par_segmentation import RaggedArray, load_image
+from par_segmentation.quantifier import ImageQuant
+
+
+class TestStore:
+    """
+    Testing that results saved to an HDF5 store can be appended to and read back
+
+    """
+
+    imgs: ClassVar[list] = [
+        load_image(
+            os.path.dirname(os.path.abspath(__file__))
+            + "/../scripts/nwg338_af_corrected.tif"
+        ),
+    ]
+    rois: ClassVar[list] = [
+        np.loadtxt(
+            os.path.dirname(os.path.abspath(__file__))
+            + "/../scripts/nwg338_ROI_manual.txt"
+        ),
+    ]
+
+    def test_1(self, tmp_path):
+        iq = ImageQuant(
+            img=self.imgs * 2,
+            roi=self.rois * 2,
+            method="GD",
+            iterations=1,
+            descent_steps=10,
+            verbose=False,
+        )
+        iq.run()
+
+        # Save, then append a second run
+        path = str(tmp_path / "results.h5")
+        iq.save_store(path, ids=[10, 11], append=False)
+        iq.save_store(path, ids=[12, 13])
+
+        # Partial read back into a model
+        ids = iq.load_store(path, indices=[1, 3])
+        assert list(ids) == [11, 13]
+        assert len(iq.mems) == 2
+        assert np.allclose(iq.roi[0], iq.roi[1])
+        assert iq.straight_images[0].shape == (50, self.rois[0].shape[0])
+
+    def test_round_trip(self, tmp_path):
+        # Loaded results behave like those from run()
+        iq = ImageQuant(
+            img=self.imgs * 2,
+            roi=self.rois * 2,
+            method="GD",
+            iterations=1,
+            descent_steps=10,
+            verbose=False,
+        )
+        iq.run()
+        res = iq.compile_res()
+        path = str(tmp_path / "results.h5")
+        iq.save_store(path, append=False)
+
+        iq2 = ImageQuant(
+            img=self.imgs * 2,
+            roi=self.rois * 2,
+            method="GD",
+            verbose=False,
+        )
+        iq2.load_store(path)
+        for field in ["mems", "cyts", "offsets", "roi", "straight_images"]:
+            assert isinstance(getattr(iq2, field), RaggedArray)
+        assert iq2.straight_images[0].shape == iq.straight_images[0].shape
+        assert np.allclose(
+            iq2.mems.bounded_mean((0.4, 0.6)), iq.mems.bounded_mean((0.4, 0.6))
+        )
+        pd.testing.assert_frame_equal(iq2.compile_res(), res, check_dtype=False)
+
+    def test_parquet(self, tmp_path):
+        # Results saved to Parquet match compile_res
+        pytest.importorskip("pyarrow")
+        iq = ImageQuant(
+            img=self.imgs * 2,
+            roi=self.rois * 2,
+            method="GD",
+            iterations=1,
+            descent_steps=10,
+            verbose=False,
+        )
+        iq.run()
+        path = str(tmp_path / "results.parquet")
+        iq.save_res(path, ids=[10, 11], extra_columns={"Condition": ["a", "b"]})
+        res = iq.compile_res(ids=[10, 11], extra_columns={"Condition": ["a", "b"]})
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(path), res.reset_index(drop=True), check_dtype=False
+        )
+
+    def test_missing_fields(self, tmp_path):
+        # Batches saved with different fields stay aligned with their ids
+        rng = np.random.default_rng(0)
+
+        def batch(n, sims):
+            res = {
+                "mems": [rng.normal(size=10) for _ in range(n)],
+                "straight_images": [rng.normal(size=(5, 10)) for _ in range(n)],
+            }
+            if sims:
+                res["straight_images_sim"] = [
+                    rng.normal(size=(5, 10)) for _ in range(n)
+                ]
+            return res
+
+        from par_segmentation.store import load_store, save_store
+
+        path = str(tmp_path / "results.h5")
+        batches = [batch(2, False), batch(1, True), batch(2, False), batch(1, True)]
+        for i, res in enumerate(batches):
+            save_store(path, res, ids=np.arange(len(res["mems"])) + 10 * i)
+
+        res = load_store(path)
+        assert list(res["ids"]) == [0, 1, 10, 20, 21, 30]
+        flat = [b for b in batches for _ in b["mems"]]
+        index = [0, 1, 0, 0, 1, 0]
+        for i, (b, j) in enumerate(zip(flat, index)):
+            assert np.array_equal(res["mems"][i], b["mems"][j])
+            if "straight_images_sim" in b:
+                assert np.allclose(
+                    res["straight_images_sim"][i], b["straight_images_sim"][j]
+                )
+            else:
+                assert res["straight_images_sim"][i] is None
+
+        res = load_store(path, indices=[2, 5])
+        assert np.allclose(
+            res["straight_images_sim"][1], batches[3]["straight_images_sim"][0]
+        )
+        assert "straight_images_sim" not in load_store(path, indices=[0, 4])